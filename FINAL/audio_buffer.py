@@ -0,0 +1,120 @@
+"""
+## Byte-budgeted store for model audio
+Sits between receive_audio and play_audio in place of an asyncio.Queue of
+`bytes` chunks. The model streams faster than real time, so a long reply used
+to pile up thousands of small objects, and dropping it on an interruption
+meant getting them one by one.
+
+AudioBuffer is one contiguous `bytearray` ring of `max_bytes`, allocated once:
+`put` copies a chunk in, and once the ring is full waits for play_audio to
+catch up, which leaves the rest of the reply on the socket. It never grows, so
+the memory held is the budget (PLAYBACK_BUFFER_MS) and nothing more: no
+doubling, no second ring alive while the audio is copied across.
+`read(n)` hands back whatever is buffered, up to n bytes, so play_audio pulls
+device-period-sized blocks regardless of how the server chunked the audio.
+`clear()` is O(1): the positions reset. Peaks are kept per session for
+get_metrics.
+"""
+
+import asyncio
+
+
+class AudioBuffer:
+    """Fixed byte ring of `max_bytes`; `await put(data)` on one side, `await read(n)` on the other."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._ring = bytearray(max_bytes)
+        self._start = 0 # Ring index of the oldest buffered byte
+        self._size = 0 # Bytes buffered
+        self._data = asyncio.Event()
+        self._space = asyncio.Event()
+        self._generation = 0 # Bumped by clear(); a put that waited across one is dropped
+        self.peak_bytes = 0
+        self.counters = {"bytes_in": 0, "bytes_out": 0, "reads": 0, "clears": 0, "bytes_cleared": 0,
+                         "budget_waits": 0}
+
+    def __len__(self):
+        return self._size
+
+    def empty(self):
+        return not self._size
+
+    @property
+    def capacity(self):
+        return len(self._ring)
+
+    @property
+    def write_position(self):
+        """Bytes ever put: the stream position just past the newest buffered byte."""
+        return self.counters["bytes_in"]
+
+    @property
+    def read_position(self):
+        """Stream position of the oldest buffered byte; clear() moves it up to write_position."""
+        return self.counters["bytes_out"] + self.counters["bytes_cleared"]
+
+    def _views(self, count):
+        """The oldest `count` buffered bytes as one or two views into the ring, without consuming them."""
+        ring = memoryview(self._ring)
+        end = self._start + count
+        if end <= len(ring):
+            return (ring[self._start:end],)
+        return ring[self._start:], ring[:end - len(ring)]
+
+    async def put(self, data):
+        """Append a chunk, waiting while it would take the buffer past max_bytes. False if clear() dropped it meanwhile."""
+        generation = self._generation
+        if self._size and self._size + len(data) > self.max_bytes:
+            self.counters["budget_waits"] += 1
+        while self._size and self._size + len(data) > self.max_bytes:
+            self._space.clear()
+            await self._space.wait()
+            if self._generation != generation:
+                return False
+        if len(data) > len(self._ring):
+            # A single chunk over the whole budget (the buffer is empty by now) gets a ring of its own size
+            self._ring, self._start = bytearray(len(data)), 0
+        capacity = len(self._ring)
+        end = (self._start + self._size) % capacity
+        first = min(len(data), capacity - end)
+        view = memoryview(data)
+        self._ring[end:end + first] = view[:first]
+        self._ring[:len(data) - first] = view[first:]
+        self._size += len(data)
+        self.counters["bytes_in"] += len(data)
+        self.peak_bytes = max(self.peak_bytes, self._size)
+        self._data.set()
+        return True
+
+    async def read(self, max_bytes):
+        """Up to max_bytes of the oldest audio, waiting until there is some."""
+        while not self._size:
+            self._data.clear()
+            await self._data.wait()
+        count = min(self._size, max_bytes)
+        out = b"".join(self._views(count))
+        self._start = (self._start + count) % len(self._ring)
+        self._size -= count
+        self.counters["reads"] += 1
+        self.counters["bytes_out"] += count
+        self._space.set()
+        return out
+
+    def clear(self):
+        """Drop everything buffered in O(1). Returns the bytes dropped."""
+        dropped = self._size
+        self._start = self._size = 0
+        self._generation += 1
+        self.counters["clears"] += 1
+        self.counters["bytes_cleared"] += dropped
+        self._space.set()
+        return dropped
+
+    def reset_peaks(self):
+        """Start a new session's peaks from what is buffered now."""
+        self.peak_bytes = self._size
+
+    def stats(self):
+        return dict(self.counters, buffered_bytes=self._size, capacity_bytes=len(self._ring),
+                    peak_bytes=self.peak_bytes, max_bytes=self.max_bytes)
@@ -0,0 +1,208 @@
+"""
+## Callback-mode microphone capture
+PortAudio calls `_callback` on its own thread every `frames_per_buffer` frames;
+the audio is copied into a preallocated ring buffer and the event loop is woken
+with `call_soon_threadsafe`. Readers await whole chunks from the ring, so there
+is no thread-pool round trip per chunk, and overflows (PortAudio's and the
+ring's) are counted instead of silently hidden.
+
+While muted, either the stream keeps running into the ring so the last
+`preroll_ms` of audio can be sent on unmute (the callbacks never wake the event
+loop while nobody reads), or, with no pre-roll, it is stopped with `pause()`;
+`resume()` restarts the same stream, never reopening the device, and records
+how long it took until audio flowed again.
+
+Works with any `audio_devices.AudioSource`.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+
+from metrics import LatencyHistogram
+from virtual_audio import paContinue, paInputOverflow
+
+logger = logging.getLogger(__name__)
+
+BYTES_PER_SAMPLE = 2
+
+
+class MicCapture:
+    """Microphone input stream feeding a ring buffer, read with `await read(frames)`."""
+
+    def __init__(self, rate=16000, channels=1, frames_per_buffer=1024, buffer_seconds=2.0, restart_target_ms=120.0,
+                 preroll_ms=0):
+        self.rate = rate
+        self.channels = channels
+        self.frames_per_buffer = frames_per_buffer
+        self._frame_bytes = BYTES_PER_SAMPLE * channels
+        self.buffer_seconds = buffer_seconds
+        self.preroll_ms = preroll_ms
+        self._allocate()
+        self._lock = threading.Lock()
+        self._data_ready = asyncio.Event()
+        self._reader_waiting = False # Only wake the loop when someone is waiting for audio
+        self._loop = None
+        self.stream = None
+        self.active = False
+        self._resumed_at = None # Set by resume() until the first callback arrives
+        self.restart_target_ms = restart_target_ms
+        self.restart_latency = LatencyHistogram() # resume() -> first buffer of audio
+        self.counters = {"callbacks": 0, "input_overflows": 0, "ring_overrun_frames": 0, "frames_captured": 0,
+                         "restarts": 0, "restarts_over_target": 0, "preroll_frames_sent": 0}
+
+    def _allocate(self):
+        self.preroll_frames = self.rate * self.preroll_ms // 1000
+        buffer_frames = max(int(self.rate * self.buffer_seconds), 2 * self.preroll_frames)
+        self._ring = bytearray(buffer_frames * self._frame_bytes)
+        # Monotonic byte positions; the ring index is position % len(ring)
+        self._write_pos = 0
+        self._read_pos = 0
+        self._written_at = time.perf_counter() # perf_counter() of the latest callback
+        self.captured_at = None # perf_counter() when the last frame returned by read() was captured
+
+    async def open(self, source, start=True, rate=None):
+        """Open the input stream; callbacks begin immediately unless start=False.
+
+        `rate` opens the device at another sample rate (e.g. its native one); the
+        callback period, ring and pre-roll keep the same duration.
+        """
+        self._loop = asyncio.get_running_loop()
+        if rate and rate != self.rate:
+            self.frames_per_buffer = self.frames_per_buffer * rate // self.rate
+            self.rate = rate
+            self._allocate()
+        self.discard()
+        self._written_at = time.perf_counter() # Counts as a callback, for DeviceManager's stall check
+        self.stream = await asyncio.to_thread(
+            source.open_stream,
+            rate=self.rate,
+            channels=self.channels,
+            frames_per_buffer=self.frames_per_buffer,
+            stream_callback=self._callback,
+            start=start,
+        )
+        self.active = start
+        logger.info(f"Microphone stream opened ({self.frames_per_buffer} frames per buffer, started={start})")
+
+    async def pause(self):
+        """Stop the device stream, keeping it open for a quick resume()."""
+        if self.stream is None or not self.active:
+            return
+        self.active = False
+        await asyncio.to_thread(self.stream.stop_stream)
+
+    async def resume(self):
+        """Restart the paused stream. Anything left in the ring from before the pause is dropped."""
+        if self.stream is None or self.active:
+            return
+        self.discard()
+        self.counters["restarts"] += 1
+        self._resumed_at = self._written_at = time.perf_counter()
+        self.active = True
+        await asyncio.to_thread(self.stream.start_stream)
+
+    async def mute(self):
+        """Stop delivering audio. With a pre-roll the device keeps filling the ring."""
+        if not self.preroll_frames:
+            await self.pause()
+
+    async def unmute(self):
+        """Start delivering audio, beginning with up to preroll_ms captured before this call."""
+        if not self.active:
+            await self.resume()
+            return
+        with self._lock:
+            # Skip everything older than the pre-roll; reads continue straight into live audio
+            self._read_pos = max(self._read_pos, self._write_pos - self.preroll_frames * self._frame_bytes)
+            self.counters["preroll_frames_sent"] += (self._write_pos - self._read_pos) // self._frame_bytes
+
+    def _record_restart(self, ms):
+        self.restart_latency.record(ms)
+        if ms > self.restart_target_ms:
+            self.counters["restarts_over_target"] += 1
+            logger.warning(f"Microphone restart took {ms:.0f} ms (target {self.restart_target_ms:.0f} ms); "
+                           f"a smaller frames_per_buffer restarts faster")
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        # Runs on PortAudio's thread: copy into the ring and get out quickly
+        data = memoryview(in_data)
+        size = len(self._ring)
+        with self._lock:
+            start = self._write_pos % size
+            first = min(len(data), size - start)
+            self._ring[start:start + first] = data[:first]
+            self._ring[:len(data) - first] = data[first:]
+            self._write_pos += len(data)
+            self._written_at = time.perf_counter()
+            overrun = self._write_pos - self._read_pos - size
+            if overrun > 0:
+                # Reader fell behind by more than the ring; the oldest audio is lost
+                self._read_pos += overrun
+                self.counters["ring_overrun_frames"] += overrun // self._frame_bytes
+            self.counters["callbacks"] += 1
+            self.counters["frames_captured"] += frame_count
+            if status & paInputOverflow:
+                self.counters["input_overflows"] += 1
+            wake, self._reader_waiting = self._reader_waiting, False
+            resumed_at, self._resumed_at = self._resumed_at, None
+        if resumed_at is not None:
+            self._loop.call_soon_threadsafe(self._record_restart, (time.perf_counter() - resumed_at) * 1000)
+        if wake:
+            self._loop.call_soon_threadsafe(self._data_ready.set)
+        return (None, paContinue)
+
+    @property
+    def buffered_frames(self):
+        return (self._write_pos - self._read_pos) // self._frame_bytes
+
+    @property
+    def called_at(self):
+        """perf_counter() of the latest callback (or of the open/resume still waiting for one)."""
+        return self._written_at
+
+    async def read(self, num_frames):
+        """Return the next `num_frames` of audio, waiting for the device if they aren't in yet."""
+        num_bytes = num_frames * self._frame_bytes
+        while True:
+            with self._lock:
+                size = len(self._ring) # Reallocated if the device is reopened at another rate meanwhile
+                if self._write_pos - self._read_pos >= num_bytes:
+                    start = self._read_pos % size
+                    first = min(num_bytes, size - start)
+                    ring = memoryview(self._ring)
+                    out = b"".join((ring[start:start + first], ring[:num_bytes - first]))
+                    self._read_pos += num_bytes
+                    # When the last frame read was captured: the latest callback, less what is still buffered
+                    backlog = (self._write_pos - self._read_pos) // self._frame_bytes
+                    self.captured_at = self._written_at - backlog / self.rate
+                    return out
+                self._data_ready.clear()
+                self._reader_waiting = True
+            await self._data_ready.wait()
+
+    def discard(self):
+        """Drop everything captured so far, e.g. audio from while the mic was muted."""
+        with self._lock:
+            self._read_pos = self._write_pos
+
+    async def close(self):
+        self.active = False
+        stream, self.stream = self.stream, None
+        if stream is not None:
+            logger.info("Closing microphone stream.")
+            try:
+                await asyncio.to_thread(stream.stop_stream)
+                await asyncio.to_thread(stream.close)
+            except Exception as e:
+                logger.error(f"Error closing audio stream: {e}")
+
+    def stats(self):
+        return dict(self.counters,
+                    rate=self.rate,
+                    frames_per_buffer=self.frames_per_buffer,
+                    preroll_ms=self.preroll_frames * 1000 // self.rate,
+                    active=self.active,
+                    buffered_ms=round(self.buffered_frames * 1000 / self.rate, 1),
+                    restart_latency=self.restart_latency.snapshot())
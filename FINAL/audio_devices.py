@@ -0,0 +1,339 @@
+"""
+## Audio sources and sinks
+Where mic audio comes from and where model audio goes, behind one small
+interface so the host and the test scripts run the same with a sound card, a
+WAV file, a synthetic tone or nothing at all. Streams follow PyAudio's API
+(read / stream_callback, write, start_stream / stop_stream / close), so
+MicCapture and play_audio don't care which backend they got.
+
+Chosen by spec string, from AI_TUTOR_AUDIO_SOURCE / AI_TUTOR_AUDIO_SINK or a
+script's --source / --sink:
+
+    source: pyaudio[:DEVICE_INDEX] | tone | bursts | null | wav:PATH
+    sink:   pyaudio[:DEVICE_INDEX] | null | discard | wav:PATH
+
+Everything but pyaudio is paced against the wall clock like a real device,
+except the discard sink, which takes audio as fast as it is written.
+
+`current_default()` names the device the system would give a new stream now.
+PortAudio only enumerates devices when it initialises, and re-initialising
+takes every open stream with it, so PyAudio asks a short-lived child process
+instead; the host's streams are left alone.
+"""
+
+import json
+import logging
+import subprocess
+import sys
+import time
+import wave
+
+import numpy as np
+
+from resample import PolyphaseResampler
+from virtual_audio import VirtualStream, paInt16
+
+logger = logging.getLogger(__name__)
+
+VIRTUAL_RATE = 48000 # Native rate the virtual devices report, like most laptop hardware
+
+_pyaudio = None # One PortAudio instance shared by a PyAudio source and sink
+_pyaudio_users = 0
+_pyaudio_generation = 0 # Bumped by each re-initialisation
+_probed = (0.0, (None, None)) # perf_counter() and result of the last _probe_pyaudio_defaults()
+
+# Run in a child process: a fresh PortAudio sees the current default devices
+_PROBE_SCRIPT = """
+import json, pyaudio
+pya = pyaudio.PyAudio()
+def name(info):
+    try:
+        return info()["name"]
+    except (IOError, OSError):
+        return None
+print(json.dumps([name(pya.get_default_input_device_info), name(pya.get_default_output_device_info)]))
+pya.terminate()
+"""
+
+
+def _acquire_pyaudio():
+    global _pyaudio, _pyaudio_users
+    if _pyaudio is None:
+        import pyaudio
+        _pyaudio = pyaudio.PyAudio()
+    _pyaudio_users += 1
+    return _pyaudio
+
+
+def _refresh_pyaudio(generation):
+    """Re-initialise PortAudio so it sees the current devices and defaults, unless that happened since `generation`.
+
+    Every stream must be closed first. Returns the instance and its generation.
+    """
+    global _pyaudio, _pyaudio_generation
+    if generation == _pyaudio_generation:
+        import pyaudio
+        _pyaudio.terminate()
+        _pyaudio = pyaudio.PyAudio()
+        _pyaudio_generation += 1
+    return _pyaudio, _pyaudio_generation
+
+
+def _probe_pyaudio_defaults(max_age=1.0):
+    """(input, output) names of the system's default devices now; None for one that can't be found.
+
+    A source and a sink asking in turn share one probe.
+    """
+    global _probed
+    probed_at, names = _probed
+    if time.perf_counter() - probed_at > max_age:
+        try:
+            result = subprocess.run([sys.executable, "-c", _PROBE_SCRIPT], capture_output=True, text=True,
+                                    timeout=10, check=True)
+            names = tuple(json.loads(result.stdout.strip().splitlines()[-1]))
+        except subprocess.CalledProcessError as e:
+            error = (e.stderr.strip().splitlines() or [f"exit status {e.returncode}"])[-1] # Skip PortAudio's chatter
+            logger.warning(f"Could not look up the default audio devices: {error}")
+            names = (None, None)
+        except (OSError, ValueError, IndexError, subprocess.SubprocessError) as e:
+            logger.warning(f"Could not look up the default audio devices: {e}")
+            names = (None, None)
+        _probed = (time.perf_counter(), names)
+    return names
+
+
+def _release_pyaudio():
+    global _pyaudio, _pyaudio_users
+    _pyaudio_users -= 1
+    if _pyaudio_users == 0 and _pyaudio is not None:
+        _pyaudio.terminate()
+        _pyaudio = None
+
+
+class AudioSource:
+    """Mic side. `open_stream` returns a PyAudio-style input stream."""
+
+    name = "source"
+    rate = VIRTUAL_RATE
+
+    def device_info(self):
+        return {"index": None, "name": self.name, "defaultSampleRate": float(self.rate)}
+
+    def open_stream(self, rate, channels=1, frames_per_buffer=1024, stream_callback=None, start=True):
+        raise NotImplementedError
+
+    def refresh(self):
+        """Look at the system's devices again (e.g. a new default); its streams must be closed."""
+
+    def current_default(self):
+        """Name of the device a stream opened now would get, without disturbing open ones; None if it can't tell."""
+        return None
+
+    def close(self):
+        pass
+
+
+class AudioSink:
+    """Speaker side. `open_stream` returns a PyAudio-style output stream."""
+
+    name = "sink"
+    rate = VIRTUAL_RATE
+
+    def device_info(self):
+        return {"index": None, "name": self.name, "defaultSampleRate": float(self.rate)}
+
+    def open_stream(self, rate, channels=1, frames_per_buffer=1024, stream_callback=None, start=True):
+        raise NotImplementedError
+
+    def refresh(self):
+        """Look at the system's devices again (e.g. a new default); its streams must be closed."""
+
+    def current_default(self):
+        """Name of the device a stream opened now would get, without disturbing open ones; None if it can't tell."""
+        return None
+
+    def close(self):
+        pass
+
+
+class PyAudioSource(AudioSource):
+    """The system's default (or a given) input device."""
+
+    def __init__(self, device_index=None):
+        self.pya = _acquire_pyaudio()
+        self.generation = _pyaudio_generation
+        self.device_index = None if device_index is None else int(device_index)
+        self.name = "PyAudio input"
+
+    def device_info(self):
+        if self.device_index is None:
+            return self.pya.get_default_input_device_info()
+        return self.pya.get_device_info_by_index(self.device_index)
+
+    def open_stream(self, rate, channels=1, frames_per_buffer=1024, stream_callback=None, start=True):
+        return self.pya.open(format=paInt16, channels=channels, rate=rate, input=True,
+                             input_device_index=self.device_info()["index"], frames_per_buffer=frames_per_buffer,
+                             stream_callback=stream_callback, start=start)
+
+    def refresh(self):
+        if self.pya is not None:
+            self.pya, self.generation = _refresh_pyaudio(self.generation)
+
+    def current_default(self):
+        # A fixed device index doesn't follow the default
+        return _probe_pyaudio_defaults()[0] if self.device_index is None else None
+
+    def close(self):
+        if self.pya is not None:
+            self.pya = None
+            _release_pyaudio()
+
+
+class PyAudioSink(AudioSink):
+    """The system's default (or a given) output device."""
+
+    def __init__(self, device_index=None):
+        self.pya = _acquire_pyaudio()
+        self.generation = _pyaudio_generation
+        self.device_index = None if device_index is None else int(device_index)
+        self.name = "PyAudio output"
+
+    def device_info(self):
+        if self.device_index is None:
+            return self.pya.get_default_output_device_info()
+        return self.pya.get_device_info_by_index(self.device_index)
+
+    def open_stream(self, rate, channels=1, frames_per_buffer=1024, stream_callback=None, start=True):
+        return self.pya.open(format=paInt16, channels=channels, rate=rate, output=True,
+                             output_device_index=self.device_info()["index"], frames_per_buffer=frames_per_buffer,
+                             stream_callback=stream_callback, start=start)
+
+    def refresh(self):
+        if self.pya is not None:
+            self.pya, self.generation = _refresh_pyaudio(self.generation)
+
+    def current_default(self):
+        return _probe_pyaudio_defaults()[1] if self.device_index is None else None
+
+    def close(self):
+        if self.pya is not None:
+            self.pya = None
+            _release_pyaudio()
+
+
+class ToneSource(AudioSource):
+    """Synthetic mic: a steady tone, tone bursts (1 s in every 3, like speech with pauses) or silence."""
+
+    def __init__(self, mode="tone", rate=VIRTUAL_RATE):
+        self.mode = mode
+        self.rate = rate
+        self.name = f"Virtual microphone ({mode})"
+
+    def open_stream(self, rate, channels=1, frames_per_buffer=1024, stream_callback=None, start=True):
+        return VirtualStream(rate, channels, input=True, frames_per_buffer=frames_per_buffer, input_mode=self.mode,
+                             stream_callback=stream_callback, start=start)
+
+
+class NullSource(ToneSource):
+    """A mic that only ever hears silence."""
+
+    def __init__(self, rate=VIRTUAL_RATE):
+        super().__init__("silence", rate)
+        self.name = "Null microphone"
+
+
+class WavSource(AudioSource):
+    """Plays a 16-bit WAV file into the mic, looped; reports the file's rate as the device's."""
+
+    def __init__(self, path):
+        with wave.open(path, "rb") as f:
+            if f.getsampwidth() != 2:
+                raise ValueError(f"{path}: only 16-bit PCM WAV files are supported")
+            self.rate = f.getframerate()
+            samples = np.frombuffer(f.readframes(f.getnframes()), dtype="<i2")
+            if f.getnchannels() > 1:
+                samples = samples.reshape(-1, f.getnchannels()).mean(axis=1).astype("<i2")
+        if not len(samples):
+            raise ValueError(f"{path}: no audio")
+        self.pcm = samples.tobytes()
+        self.name = f"WAV file {path}"
+
+    def open_stream(self, rate, channels=1, frames_per_buffer=1024, stream_callback=None, start=True):
+        pcm = self.pcm if rate == self.rate else PolyphaseResampler(self.rate, rate).process(self.pcm)
+        return VirtualStream(rate, channels, input=True, frames_per_buffer=frames_per_buffer, source_pcm=pcm,
+                             stream_callback=stream_callback, start=start)
+
+
+class NullSink(AudioSink):
+    """Swallows audio; paced like a speaker unless paced=False ("discard")."""
+
+    def __init__(self, paced=True, rate=VIRTUAL_RATE):
+        self.paced = paced
+        self.rate = rate
+        self.name = "Virtual speaker" if paced else "Discard"
+
+    def open_stream(self, rate, channels=1, frames_per_buffer=1024, stream_callback=None, start=True):
+        return VirtualStream(rate, channels, output=True, paced=self.paced, frames_per_buffer=frames_per_buffer,
+                             stream_callback=stream_callback, start=start)
+
+
+class WavSink(AudioSink):
+    """Records everything played to a WAV file, paced like a speaker. Later streams append to it."""
+
+    def __init__(self, path, rate=VIRTUAL_RATE):
+        self.path = path
+        self.rate = rate
+        self.name = f"WAV file {path}"
+        self._file = None
+
+    def open_stream(self, rate, channels=1, frames_per_buffer=1024, stream_callback=None, start=True):
+        if self._file is None:
+            self._file = wave.open(self.path, "wb")
+            self._file.setnchannels(channels)
+            self._file.setsampwidth(2)
+            self._file.setframerate(rate)
+        elif (rate, channels) != (self._file.getframerate(), self._file.getnchannels()):
+            raise ValueError(f"{self.path} is being recorded at {self._file.getframerate()} Hz, not {rate} Hz")
+        return VirtualStream(rate, channels, output=True, on_write=self._file.writeframesraw,
+                             frames_per_buffer=frames_per_buffer, stream_callback=stream_callback, start=start)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+SOURCES = {
+    "pyaudio": PyAudioSource,
+    "tone": lambda: ToneSource("tone"),
+    "bursts": lambda: ToneSource("bursts"),
+    "null": NullSource,
+    "silence": NullSource,
+    "wav": WavSource,
+}
+
+SINKS = {
+    "pyaudio": PyAudioSink,
+    "null": NullSink,
+    "discard": lambda: NullSink(paced=False),
+    "wav": WavSink,
+}
+
+
+def _create(spec, kinds, what):
+    name, _, arg = spec.partition(":")
+    if name not in kinds:
+        raise ValueError(f"Unknown audio {what} '{spec}'; expected one of {', '.join(kinds)}")
+    if name == "wav" and not arg:
+        raise ValueError(f"Audio {what} 'wav' needs a path, e.g. wav:question.wav")
+    device = kinds[name](arg) if arg else kinds[name]()
+    logger.info(f"Audio {what}: {device.name}")
+    return device
+
+
+def create_source(spec):
+    return _create(spec, SOURCES, "source")
+
+
+def create_sink(spec):
+    return _create(spec, SINKS, "sink")
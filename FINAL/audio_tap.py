@@ -0,0 +1,103 @@
+"""
+## Session audio tap
+Optional recorder for diagnosing choppy audio (AI_TUTOR_AUDIO_TAP_DIR). Each
+tapped stream goes to a fixed-size WAV file used as a ring, memory-mapped so a
+write is a memcpy into the page cache: no allocation of audio-sized buffers,
+no file I/O on the audio path (the kernel writes pages back on its own).
+
+Next to each `<track>.wav` is `<track>.wav.idx`, a ring of (stream byte
+position, perf_counter, source position, reply) records, one per chunk, plus a
+header with the totals needed to unroll both rings. The source position places
+model audio in the playback queue (AudioBuffer) and the reply numbers model
+audio as it arrives, so tap_report can tell which arriving chunk, and so which
+reply, each played block came from. The WAV header claims the whole ring, so the file
+plays as-is, just starting at an arbitrary point once it has wrapped;
+tap_report.py unrolls and aligns the tracks.
+"""
+
+import mmap
+import os
+import struct
+import time
+
+WAV_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+# magic, rate, data capacity, record capacity, bytes written, records written, perf_counter and wall clock at start
+INDEX_HEADER = struct.Struct("<4sIqqqqdd")
+# Stream byte position of the chunk, perf_counter() when it was tapped (or played), playback queue position or -1,
+# and the model reply it belongs to or -1
+INDEX_RECORD = struct.Struct("<qdqq")
+INDEX_MAGIC = b"TAP2"
+
+
+def _wav_header(rate, data_bytes, channels=1, sample_bytes=2):
+    return WAV_HEADER.pack(b"RIFF", 36 + data_bytes, b"WAVE", b"fmt ", 16, 1, channels, rate,
+                           rate * channels * sample_bytes, channels * sample_bytes, sample_bytes * 8,
+                           b"data", data_bytes)
+
+
+def _mapped_file(path, size):
+    with open(path, "w+b") as f:
+        f.truncate(size)
+        return mmap.mmap(f.fileno(), size)
+
+
+class WavRingTap:
+    """One tapped stream of mono int16 PCM; `write(chunk)` is safe to call on the audio path."""
+
+    def __init__(self, path, rate, seconds=300, chunks_per_second=50):
+        self.path = path
+        self.rate = rate
+        self.capacity = int(rate * seconds) * 2
+        self.record_capacity = int(seconds * chunks_per_second)
+        self._wav = _mapped_file(path, WAV_HEADER.size + self.capacity)
+        self._wav[:WAV_HEADER.size] = _wav_header(rate, self.capacity)
+        self._index = _mapped_file(path + ".idx", INDEX_HEADER.size + self.record_capacity * INDEX_RECORD.size)
+        self._started = time.perf_counter()
+        self._wall_started = time.time()
+        self.bytes_written = 0
+        self.records_written = 0
+        self._write_header()
+
+    def _write_header(self):
+        INDEX_HEADER.pack_into(self._index, 0, INDEX_MAGIC, self.rate, self.capacity, self.record_capacity,
+                               self.bytes_written, self.records_written, self._started, self._wall_started)
+
+    def write(self, data, at=None, source=-1, reply=-1):
+        """Append a chunk, stamped `at` (perf_counter(), by default now), with its `source` position and `reply`."""
+        size = len(data)
+        start = self.bytes_written % self.capacity
+        offset = WAV_HEADER.size + start
+        if start + size <= self.capacity:
+            self._wav[offset:offset + size] = data
+        else:
+            view = memoryview(data)
+            first = self.capacity - start
+            self._wav[offset:] = view[:first]
+            self._wav[WAV_HEADER.size:WAV_HEADER.size + size - first] = view[first:]
+        record = INDEX_HEADER.size + (self.records_written % self.record_capacity) * INDEX_RECORD.size
+        INDEX_RECORD.pack_into(self._index, record, self.bytes_written, time.perf_counter() if at is None else at,
+                               source, reply)
+        self.bytes_written += size
+        self.records_written += 1
+        self._write_header()
+
+    def close(self):
+        self._wav.close()
+        self._index.close()
+
+
+class SessionTap:
+    """The host's tapped streams under one directory per run: mic, model_in and speaker."""
+
+    def __init__(self, directory, mic_rate, model_rate, seconds=300):
+        self.directory = os.path.join(directory, time.strftime("%Y%m%d-%H%M%S"))
+        os.makedirs(self.directory, exist_ok=True)
+        # Mic as captured (before echo suppression and the voice gate), model audio as it arrives, and as the
+        # speaker's callback hands it to the device
+        self.mic = WavRingTap(os.path.join(self.directory, "mic.wav"), mic_rate, seconds)
+        self.model_in = WavRingTap(os.path.join(self.directory, "model_in.wav"), model_rate, seconds)
+        self.speaker = WavRingTap(os.path.join(self.directory, "speaker.wav"), model_rate, seconds)
+
+    def close(self):
+        for track in (self.mic, self.model_in, self.speaker):
+            track.close()
@@ -8,6 +8,10 @@ let offscreenDocumentPath = 'offscreen.html';
 let isAiProcessing = false; 
 let lastCroppedImageData = null;
 let isExtensionOpen = false;
+let isCapturePending = false; // Selection in progress; keep the (prewarmed) host alive
+let capturePendingTimer = null;
+// Backstop for selections that end without a word to us (tab closed, page navigated away)
+const CAPTURE_PENDING_TIMEOUT_MS = 120000;
 
 console.log("AI Tutor Background Script Loaded.");
 
@@ -96,18 +100,36 @@ function sendToNativeHost(message) {
     }
 }
 
+function setCapturePending(pending) {
+    isCapturePending = pending;
+    clearTimeout(capturePendingTimer);
+    capturePendingTimer = pending ? setTimeout(() => cancelCapture("timed out"), CAPTURE_PENDING_TIMEOUT_MS) : null;
+}
+
+function cancelCapture(reason) {
+    if (!isCapturePending) return;
+    console.log(`Background: Selection ${reason}, no capture coming.`);
+    setCapturePending(false);
+    // The popup closes when the page is clicked; it kept the host up only for this capture
+    if (!isExtensionOpen && !isAiProcessing) {
+        disconnectNativeHost();
+    }
+}
+
 // --- Connection Management ---
 chrome.runtime.onConnect.addListener((port) => {
     if (port.name === 'popup') {
         console.log("Popup connected");
         isExtensionOpen = true;
+        // Open a Live session in the host now so the next capture skips the handshake
+        sendToNativeHost({ type: "prewarm_session" });
         
         port.onDisconnect.addListener(() => {
             console.log("Popup disconnected");
             isExtensionOpen = false;
             
-            // Only disconnect native host if AI is not processing
-            if (!isAiProcessing) {
+            // Only disconnect native host if AI is not processing or about to be
+            if (!isAiProcessing && !isCapturePending) {
                 disconnectNativeHost();
             }
         });
@@ -158,9 +180,16 @@ chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
             handleCaptureArea(request, sender, sendResponse);
             return true;
 
+        case "capture_cancelled":
+            // Escape or a too-small box in the content script
+            cancelCapture("cancelled");
+            sendResponse({ success: true });
+            return false;
+
         case "mute_mic":
         case "unmute_mic":
         case "interrupt_playback":  // Add handling for interrupt_playback
+        case "get_metrics":  // Host replies with a "metrics" message, forwarded to the popup
             console.log(`Background: Forwarding ${request.type} to native host.`);
             sendToNativeHost({ type: request.type });
             sendResponse({ success: true });
@@ -226,12 +255,16 @@ async function handleStartScreenshot(sender, sendResponse) {
             return;
         }
 
+        sendToNativeHost({ type: "prewarm_session" });
+        setCapturePending(true);
+
         console.log(`Background: Injecting content script into tab ${activeTab.id}`);
         chrome.scripting.executeScript({
             target: { tabId: activeTab.id },
             files: ['content_script.js']
         }, (injectionResults) => {
             if (chrome.runtime.lastError) {
+                setCapturePending(false);
                 console.error(`Background: Script injection failed: ${chrome.runtime.lastError.message}`);
                 sendResponse({ success: false, error: chrome.runtime.lastError.message });
             } else if (injectionResults && injectionResults.length > 0) {
@@ -251,6 +284,9 @@ async function handleStartScreenshot(sender, sendResponse) {
 
 async function handleCaptureArea(request, sender, sendResponse) {
     console.log("Background: Received capture_area request with rect:", request.rect);
+    // Trace this capture through the host so time-to-first-audio can be broken down per stage
+    const traceId = crypto.randomUUID();
+    const capturedAt = Date.now();
     const targetRect = request.rect;
     const dpr = request.dpr || 1; // Get DPR from the message
     
@@ -261,6 +297,7 @@ async function handleCaptureArea(request, sender, sendResponse) {
         return true;
     }
     const targetTabId = sender.tab.id;
+    setCapturePending(false);
     
     // Ensure the offscreen document is ready for cropping
     ensureOffscreenDocument().then(() => {
@@ -307,7 +344,9 @@ async function handleCaptureArea(request, sender, sendResponse) {
                     if(nativePort) { // Check connection success before sending
                         sendToNativeHost({
                             type: "image_data",
-                            imageData: lastCroppedImageData // Send base64 data URL
+                            imageData: lastCroppedImageData, // Send base64 data URL
+                            traceId: traceId,
+                            capturedAt: capturedAt
                         });
                         isAiProcessing = true; // Mark as processing
                         sendResponse({ success: true, message: "Image sent to host" });
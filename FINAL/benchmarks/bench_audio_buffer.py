@@ -0,0 +1,112 @@
+"""
+## Model audio store: asyncio.Queue of chunks vs AudioBuffer
+Queues a long reply the way receive_audio does (40 ms chunks of 24 kHz audio,
+all of it ahead of playback, as when the model streams faster than real
+time), then reports for the old queue and for AudioBuffer:
+
+- memory held once it's all buffered and the peak on the way (tracemalloc),
+  and the allocated blocks (objects) holding it
+- clear: time to drop it all on an interruption
+- read: time to drain it in device-period blocks (the queue hands out whole
+  chunks, whatever the period)
+
+    python benchmarks/bench_audio_buffer.py --reply-seconds 300 --period-frames 512
+"""
+
+import argparse
+import asyncio
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+FINAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FINAL_DIR)
+
+from audio_buffer import AudioBuffer
+from virtual_audio import tone_pcm
+
+RATE = 24000
+CHUNK_MS = 40
+
+
+def reply_chunks(pcm, seconds):
+    """A new bytes object per chunk of `pcm` (looped), as each server message is decoded."""
+    size = RATE * CHUNK_MS // 1000 * 2
+    for i in range(int(seconds * 1000 / CHUNK_MS)):
+        offset = i * size % (len(pcm) - size)
+        yield pcm[offset:offset + size]
+
+
+class QueueStore:
+    """The previous audio_in_queue: put_nowait each chunk, drain one get_nowait at a time."""
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    async def put(self, data):
+        self.queue.put_nowait(data)
+
+    async def read(self, max_bytes):
+        data = await self.queue.get()
+        self.queue.task_done()
+        return data
+
+    def clear(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.queue.task_done()
+
+    def __len__(self):
+        return self.queue.qsize()
+
+
+async def fill(make_store, seconds):
+    """A new store with the whole reply in it; what it holds counts from before it was made (its own allocations too)."""
+    pcm = tone_pcm(RATE, seconds=1.0) # Made before tracing: only the store's memory is measured
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    blocks = sys.getallocatedblocks()
+    store = make_store()
+    for chunk in reply_chunks(pcm, seconds):
+        await store.put(chunk)
+    del chunk # What's left is held by the store
+    gc.collect()
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return store, held - baseline, peak - baseline, sys.getallocatedblocks() - blocks
+
+
+async def measure(name, make_store, args):
+    store, held, peak, objects = await fill(make_store, args.reply_seconds)
+    start = time.perf_counter()
+    store.clear()
+    clear_ms = (time.perf_counter() - start) * 1000
+
+    store, *_ = await fill(make_store, args.reply_seconds)
+    period_bytes = args.period_frames * 2
+    reads = 0
+    start = time.perf_counter()
+    while len(store):
+        await store.read(period_bytes)
+        reads += 1
+    read_ms = (time.perf_counter() - start) * 1000
+    print(f"{name:<13} held {held / 2**20:6.2f} MiB (peak {peak / 2**20:6.2f}), {objects:>6} blocks, "
+          f"clear {clear_ms:7.3f} ms, drain {reads:>6} reads in {read_ms:7.1f} ms")
+
+
+async def main(args):
+    payload = int(args.reply_seconds * RATE * 2)
+    print(f"{args.reply_seconds:.0f} s reply ({payload / 2**20:.2f} MiB of PCM) in {CHUNK_MS} ms chunks, "
+          f"reads of {args.period_frames} frames")
+    await measure("asyncio.Queue", QueueStore, args)
+    await measure("AudioBuffer", lambda: AudioBuffer(payload), args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the old model audio queue with AudioBuffer")
+    parser.add_argument("--reply-seconds", type=float, default=120.0)
+    parser.add_argument("--period-frames", type=int, default=2048, help="Bytes per read / 2; play_audio reads 4 periods")
+    asyncio.run(main(parser.parse_args()))
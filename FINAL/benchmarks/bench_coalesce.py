@@ -0,0 +1,70 @@
+"""
+## Upstream audio coalescing: window size vs messages, CPU and added latency
+Runs the native host against fake_live_server.py once per coalescing window
+(AI_TUTOR_AUDIO_COALESCE_MS), streams the virtual mic upstream for a few
+seconds, and reports websocket messages per second, host CPU and wakeups per
+second while streaming, and how long send_realtime held audio back to fill
+each window (get_metrics "send_coalescing").
+
+    python benchmarks/bench_coalesce.py --windows 0 50 100 200 --seconds 5
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_e2e import ProcActivity, make_image_data_url, send_image, start_host
+from fake_live_server import FakeLiveServer
+
+
+async def measure(window_ms, args):
+    server = await FakeLiveServer(reply_seconds=0.5, realtime_factor=1.0).start()
+    host = await start_host(server, "tone", extra_env={"AI_TUTOR_AUDIO_COALESCE_MS": str(window_ms)})
+    try:
+        sent = time.perf_counter()
+        await send_image(host, make_image_data_url())
+        first = await server.wait_for_event("first_audio_out", after=sent, timeout=args.timeout)
+        await server.wait_for_event("turn_complete", after=first, timeout=args.timeout)
+        chunks_before = server.counters["audio_chunks_in"]
+        bytes_before = server.counters["audio_bytes_in"]
+        await host.send({"type": "unmute_mic"})
+        start = time.perf_counter()
+        activity = await ProcActivity(host.proc.pid).track(args.seconds)
+        elapsed = time.perf_counter() - start
+        await host.send({"type": "mute_mic"})
+        await host.send({"type": "get_metrics"})
+        metrics = await host.expect("metrics", timeout=args.timeout)
+    finally:
+        await host.close()
+        await server.stop()
+    messages = (server.counters["audio_chunks_in"] - chunks_before) / elapsed
+    kib = (server.counters["audio_bytes_in"] - bytes_before) / 1024 / elapsed
+    line = f"{window_ms:>9.0f} {messages:>9.1f} {kib:>8.1f}"
+    if activity:
+        line += f" {activity[1]:>9.2f} {activity[0]:>10.1f}"
+    else:
+        line += f" {'-':>9} {'-':>10}"
+    wait = metrics["send_coalescing"]["wait"]
+    line += f" {wait['p50_ms']:>8.1f} {wait['p95_ms']:>8.1f}" if wait["count"] else f" {0:>8.1f} {0:>8.1f}"
+    print(line)
+
+
+async def main(args):
+    print(f"{args.seconds:.0f} s of mic audio per window, {args.frames_per_buffer} frames per buffer")
+    print(f"{'window ms':>9} {'msgs/s':>9} {'KiB/s':>8} {'CPU ms/s':>9} {'wakeups/s':>10} {'held p50':>8} {'held p95':>8}")
+    os.environ["AI_TUTOR_FRAMES_PER_BUFFER"] = str(args.frames_per_buffer)
+    for window_ms in args.windows:
+        await measure(window_ms, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep upstream audio coalescing windows")
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 20, 50, 100, 200])
+    parser.add_argument("--seconds", type=float, default=5.0, help="Unmuted streaming time per window")
+    parser.add_argument("--frames-per-buffer", type=int, default=1024)
+    parser.add_argument("--timeout", type=float, default=15.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,395 @@
+"""
+## Headless end-to-end benchmark
+Runs the real native host as a subprocess against fake_live_server.py, with
+virtual audio devices, and drives it over framed stdin/stdout exactly as
+Chrome would. Needs no network, API key, sound card or PyAudio.
+
+Measures:
+- time to first audio: image_data sent -> first model audio chunk leaves the server,
+  plus the host's own capture -> first speaker write trace (get_metrics), split
+  by whether the image reused the live session (--switch-mode) or reconnected
+- playback: speaker underruns mid-reply and the jitter buffer's depth, target
+  and added latency, with the server's reply chunks delayed by --jitter-ms;
+  and the speaker's flush -> silence time on each interruption
+- barge-in latency: unmute_mic sent -> server hears speech -> reply interrupted,
+  and interrupt_playback sent -> server stops the reply; with the host's count
+  of stale reply audio dropped on arrival and how long it kept coming
+- sustained throughput: unpaced model audio down, live mic audio up
+- reconnect: connection dropped mid-reply -> replacement session set up, and
+  -> mic audio spoken during the outage arrives
+- idle cost: host context switches (wakeups) and CPU per second with a session
+  open, the mic muted and nothing playing (Linux /proc)
+
+    python benchmarks/bench_e2e.py --captures 10 --barge-ins 5
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+
+import PIL.Image
+
+FINAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FINAL_DIR)
+
+from fake_live_server import FakeLiveServer
+from native_messaging import HEADER, encode_message
+
+
+def make_image_data_url(width=640, height=360):
+    img = PIL.Image.new("RGB", (width, height), (250, 250, 250))
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(out.getvalue()).decode()
+
+
+class HostDriver:
+    """Talks to the native host subprocess the way Chrome does."""
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.inbox = asyncio.Queue()
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        try:
+            while True:
+                length = HEADER.unpack(await self.proc.stdout.readexactly(HEADER.size))[0]
+                await self.inbox.put(json.loads(await self.proc.stdout.readexactly(length)))
+        except asyncio.IncompleteReadError:
+            pass
+
+    async def send(self, message):
+        body = encode_message(message)
+        self.proc.stdin.write(HEADER.pack(len(body)) + body)
+        await self.proc.stdin.drain()
+
+    async def expect(self, message_type, timeout=10.0):
+        deadline = time.perf_counter() + timeout
+        while True:
+            message = await asyncio.wait_for(self.inbox.get(), max(0.0, deadline - time.perf_counter()))
+            if message.get("type") == message_type:
+                return message
+
+    async def close(self, timeout=10.0):
+        self.proc.stdin.close()
+        try:
+            await asyncio.wait_for(self.proc.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.proc.kill()
+            await self.proc.wait()
+        self._reader_task.cancel()
+
+
+async def start_host(server, source, sink="null", switch_mode=True, preroll_ms=0, extra_env=None):
+    env = dict(os.environ)
+    env.update({
+        "GOOGLE_API_KEY": env.get("GOOGLE_API_KEY", "fake-key-for-local-server"),
+        "GEMINI_BASE_URL": server.base_url,
+        "GEMINI_CA_FILE": server.cert_path,
+        "AI_TUTOR_AUDIO_SOURCE": source,
+        "AI_TUTOR_AUDIO_SINK": sink,
+        "AI_TUTOR_SWITCH_MODE": "1" if switch_mode else "0",
+        "AI_TUTOR_PREROLL_MS": str(preroll_ms),
+        # measure_reconnect drops sessions seconds apart, each after it has served a reply: every drop should start
+        # from the first attempt, not carry on the previous one's backoff
+        "AI_TUTOR_RECONNECT_STABLE_S": "1",
+    })
+    env.update(extra_env or {})
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(FINAL_DIR, "native_host.py"),
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, env=env, cwd=FINAL_DIR)
+    return HostDriver(proc)
+
+
+async def send_image(host, image):
+    await host.send({"type": "image_data", "imageData": image, "traceId": f"bench-{time.perf_counter_ns()}",
+                     "capturedAt": time.time() * 1000})
+
+
+async def measure_time_to_first_audio(host, server, image, captures, timeout, prewarm_ms=None):
+    results = []
+    for _ in range(captures):
+        if prewarm_ms is not None:
+            # Like the popup opening / selection starting, then the student drawing the box
+            await host.send({"type": "prewarm_session"})
+            await asyncio.sleep(prewarm_ms / 1000)
+        sent = time.perf_counter()
+        await send_image(host, image)
+        first_audio = await server.wait_for_event("first_audio_out", after=sent, timeout=timeout)
+        results.append((first_audio - sent) * 1000)
+        await server.wait_for_event("turn_complete", after=first_audio, timeout=timeout + server.reply_seconds * 2)
+    return results
+
+
+async def measure_barge_in(host, server, image, rounds, timeout):
+    heard, interrupted = [], []
+    for _ in range(rounds):
+        sent = time.perf_counter()
+        await send_image(host, image)
+        await server.wait_for_event("first_audio_out", after=sent, timeout=timeout)
+        await asyncio.sleep(0.3) # Let the tutor get a few words in
+        unmuted = time.perf_counter()
+        await host.send({"type": "unmute_mic"})
+        speech = await server.wait_for_event("speech_start", after=unmuted, timeout=timeout)
+        stopped = await server.wait_for_event("interrupted", after=unmuted, timeout=timeout)
+        heard.append((speech - unmuted) * 1000)
+        interrupted.append((stopped - unmuted) * 1000)
+        await host.send({"type": "mute_mic"})
+        # The fake replies to the "question" once the mic goes quiet; let that play out
+        await server.wait_for_event("turn_complete", after=stopped, timeout=timeout + server.reply_seconds * 2)
+    return heard, interrupted
+
+
+async def measure_stop(host, server, image, rounds, timeout):
+    """interrupt_playback (the extension's stop button) sent mid-reply -> the server stops generating."""
+    stopped = []
+    for _ in range(rounds):
+        sent = time.perf_counter()
+        await send_image(host, image)
+        await server.wait_for_event("first_audio_out", after=sent, timeout=timeout)
+        await asyncio.sleep(0.3)
+        requested = time.perf_counter()
+        await host.send({"type": "interrupt_playback"})
+        interrupted = await server.wait_for_event("interrupted", after=requested, timeout=timeout)
+        stopped.append((interrupted - requested) * 1000)
+    return stopped
+
+
+async def measure_reconnect(host, server, image, drops, rejects, timeout):
+    recovered, mic_flushed = [], []
+    for _ in range(drops):
+        sent = time.perf_counter()
+        await send_image(host, image)
+        await server.wait_for_event("first_audio_out", after=sent, timeout=timeout)
+        await asyncio.sleep(0.3)
+        server.reject_next = rejects # Makes the host back off before it gets back in
+        dropped = time.perf_counter()
+        await server.drop_connections()
+        # The student keeps talking through the outage
+        await host.send({"type": "unmute_mic"})
+        setup = await server.wait_for_event("setup_complete", after=dropped, timeout=timeout)
+        heard = await server.wait_for_event("audio_in", after=setup, timeout=timeout)
+        recovered.append((setup - dropped) * 1000)
+        mic_flushed.append((heard - dropped) * 1000)
+        await host.send({"type": "mute_mic"})
+        muted = time.perf_counter()
+        await server.wait_for_event("turn_complete", after=muted, timeout=timeout + server.reply_seconds * 2)
+    return recovered, mic_flushed
+
+
+async def measure_downstream(host, server, image, seconds, timeout):
+    server.realtime_factor = 0
+    server.reply_seconds = seconds
+    before = server.counters["audio_bytes_out"]
+    sent = time.perf_counter()
+    await send_image(host, image)
+    first = await server.wait_for_event("first_audio_out", after=sent, timeout=timeout)
+    done = await server.wait_for_event("turn_complete", after=first, timeout=timeout + seconds * 10)
+    return (server.counters["audio_bytes_out"] - before) / (done - first)
+
+
+async def measure_upstream(host, server, seconds):
+    before = server.counters["audio_bytes_in"]
+    await host.send({"type": "unmute_mic"})
+    start = time.perf_counter()
+    await asyncio.sleep(seconds)
+    await host.send({"type": "mute_mic"})
+    return (server.counters["audio_bytes_in"] - before) / (time.perf_counter() - start)
+
+
+class ProcActivity:
+    """Running context switch and CPU totals of a process, over all its threads.
+
+    For this process getrusage counts every thread, exited ones included. Another
+    process's threads come from /proc, which only lists live ones, so each thread's
+    last count is kept after it exits; `track` samples through a window so that a
+    short-lived thread is seen close to its end.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self._threads = {} # tid -> context switches last seen
+        self._retired = 0 # Counts of earlier threads whose tid was reused
+
+    def sample(self):
+        """(context switches, CPU seconds) so far; None for another process without /proc."""
+        if self.pid == os.getpid():
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            return usage.ru_nvcsw + usage.ru_nivcsw, usage.ru_utime + usage.ru_stime
+        task_dir = f"/proc/{self.pid}/task"
+        if not os.path.isdir(task_dir):
+            return None
+        for tid in os.listdir(task_dir):
+            switches = 0
+            try:
+                with open(os.path.join(task_dir, tid, "status")) as f:
+                    for line in f:
+                        if line.startswith(("voluntary_ctxt_switches", "nonvoluntary_ctxt_switches")):
+                            switches += int(line.split()[1])
+            except FileNotFoundError:
+                continue # Thread exited while we were looking; its last sample stands
+            if switches < self._threads.get(tid, 0):
+                self._retired += self._threads[tid]
+            self._threads[tid] = switches
+        # Process-wide utime + stime, which include exited threads
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        return self._retired + sum(self._threads.values()), cpu_seconds
+
+    async def track(self, seconds, interval=0.1):
+        """Sleep for `seconds`, sampling as it goes. (wakeups/s, CPU ms/s) over the window, or None."""
+        before = self.sample()
+        if before is None:
+            return None
+        start = time.perf_counter()
+        end = start + seconds
+        while (now := time.perf_counter()) < end:
+            await asyncio.sleep(min(interval, end - now))
+            after = self.sample()
+        elapsed = time.perf_counter() - start
+        return (after[0] - before[0]) / elapsed, (after[1] - before[1]) * 1000 / elapsed
+
+
+async def measure_idle(host, seconds, settle_seconds=3.0):
+    """Wakeups/s and CPU ms/s of the host while it sits idle.
+
+    Waits `settle_seconds` first: the last reply is still playing when the server's turn completes, and the speaker
+    only stops itself 2 s after its last audio (AI_TUTOR_PLAYBACK_IDLE_STOP_S).
+    """
+    await asyncio.sleep(settle_seconds)
+    return await ProcActivity(host.proc.pid).track(seconds)
+
+
+def summarize(name, values):
+    if not values:
+        return f"{name:<34} {'-':>8}"
+    ordered = sorted(values)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"{name:<34} {statistics.median(ordered):>8.1f} {p95:>8.1f} {ordered[-1]:>8.1f}   (n={len(values)})"
+
+
+async def main(args):
+    server = await FakeLiveServer(reply_seconds=args.reply_seconds, realtime_factor=1.0,
+                                  setup_delay_ms=args.setup_delay_ms, resumable=not args.no_resumption,
+                                  jitter_ms=args.jitter_ms).start()
+    host = await start_host(server, args.source, args.sink, switch_mode=args.switch_mode == "on",
+                            preroll_ms=args.preroll_ms, extra_env={"AI_TUTOR_JITTER_MS": str(args.jitter_buffer_ms)})
+    image = make_image_data_url()
+    try:
+        # The first capture also pays interpreter start-up and imports in the host
+        await measure_time_to_first_audio(host, server, image, args.warmup, args.timeout)
+        idle = await measure_idle(host, args.idle_seconds)
+        ttfa = await measure_time_to_first_audio(host, server, image, args.captures, args.timeout, args.prewarm_ms)
+        heard, interrupted = await measure_barge_in(host, server, image, args.barge_ins, args.timeout)
+        stopped = await measure_stop(host, server, image, args.stops, args.timeout)
+        recovered, mic_flushed = await measure_reconnect(host, server, image, args.drops, args.rejects, args.timeout)
+        upstream = await measure_upstream(host, server, args.upstream_seconds)
+        downstream = await measure_downstream(host, server, image, args.throughput_seconds, args.timeout)
+        await host.send({"type": "get_metrics"})
+        metrics = await host.expect("metrics", timeout=args.timeout)
+        await host.send({"type": "check_mic_status"})
+        mic_status = await host.expect("mic_status", timeout=args.timeout)
+    finally:
+        await host.close()
+        await server.stop()
+
+    print(f"{'':<34} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    print(summarize("time to first audio (server)", ttfa))
+    print(summarize("barge-in: unmute -> speech heard", heard))
+    print(summarize("barge-in: unmute -> interrupted", interrupted))
+    print(summarize("stop button -> server stops reply", stopped))
+    print(summarize("drop -> session set up again", recovered))
+    print(summarize("drop -> outage mic audio arrives", mic_flushed))
+    print()
+    print(f"downstream model audio: {downstream / 1024:,.0f} KiB/s ({downstream / (24000 * 2):.1f}x real time)")
+    print(f"upstream mic audio:     {upstream / 1024:,.1f} KiB/s ({upstream / (16000 * 2):.2f}x real time)")
+    if idle:
+        print(f"idle host, session open: {idle[0]:.1f} wakeups/s, {idle[1]:.2f} ms CPU/s")
+    print()
+    print("host trace (get_metrics):")
+    for stage, stats in metrics["stages"].items():
+        if stats["count"]:
+            print(f"  {stage:<22} p50 {stats['p50_ms']:>8.1f}  p95 {stats['p95_ms']:>8.1f}  p99 {stats['p99_ms']:>8.1f}  (n={stats['count']})")
+    pool = metrics["session_pool"]
+    print(f"session pool: {pool['warm_hits']} warm hits, {pool['cold_connects']} cold connects, "
+          f"handshake p50 {pool['connect_latency']['p50_ms']:.1f} ms, "
+          f"saved p50 {pool['handshake_saved']['p50_ms']:.1f} ms per warm hit")
+    mic = metrics["mic"]
+    print(f"mic restarts: {mic['restarts']}, restart latency p50 {mic['restart_latency']['p50_ms']:.1f} ms "
+          f"max {mic['restart_latency']['max_ms']:.1f} ms, {mic['restarts_over_target']} over target")
+    print(f"mic pre-roll {mic['preroll_ms']} ms: {mic['preroll_frames_sent']} frames sent, "
+          f"unmute -> first audio sent p50 {mic['unmute_to_send']['p50_ms']:.1f} ms "
+          f"max {mic['unmute_to_send']['max_ms']:.1f} ms (n={mic['unmute_to_send']['count']})")
+    devices = metrics["devices"]
+    print(f"audio devices: {devices['input_opens']} mic opens for {devices['input_attaches']} sessions, "
+          f"{devices['output_opens']} speaker opens for {devices['output_attaches']}, "
+          f"open p50 {devices['open_latency']['p50_ms']:.1f} ms, {devices['hot_swaps']} hot swaps "
+          f"({devices['default_changes']} for a new default in {devices['default_polls']} checks)")
+    print(f"voice gate: {metrics['vad']}")
+    print(f"echo suppression: {metrics['echo']}")
+    playback = metrics["playback"]
+    print(f"playback: {playback['underruns']} underruns ({playback['starved_ms']:.0f} ms starved) "
+          f"over {playback['replies']} replies, target {playback['target_ms']} ms "
+          f"({playback['target_grows']} grows, {playback['target_shrinks']} shrinks), "
+          f"depth p50 {playback['depth']['p50_ms']:.0f} ms, "
+          f"added latency p50 {playback['added_latency']['p50_ms']:.1f} ms "
+          f"max {playback['added_latency']['max_ms']:.1f} ms")
+    engine = playback["engine"]
+    print(f"speaker: {engine['flushes']} flushes, flush -> silence p50 {engine['flush_to_silence']['p50_ms']:.1f} ms "
+          f"max {engine['flush_to_silence']['max_ms']:.1f} ms, {engine['callbacks']} callbacks, "
+          f"{engine['starts']} starts, {engine['idle_stops']} idle stops, "
+          f"{engine['output_underflows']} device underflows")
+    store = playback["store"]
+    print(f"model audio store: peak {store['peak_bytes'] / 1024:.0f} KiB buffered, "
+          f"{store['capacity_bytes'] / 1024:.0f} KiB allocated "
+          f"(budget {store['max_bytes'] / 1024:.0f} KiB, {store['budget_waits']} waits), "
+          f"{store['reads']} reads, {store['clears']} clears")
+    stale = playback["stale"]
+    print(f"stale audio: {stale.get('turns_dropped', 0)} replies dropped "
+          f"({stale.get('upstream_stops', 0)} stopped upstream), {stale.get('chunks_dropped', 0)} chunks / "
+          f"{stale.get('bytes_dropped', 0) / 1024:.0f} KiB never queued, "
+          f"drop -> downstream stops p50 {stale['tail']['p50_ms']:.1f} ms max {stale['tail']['max_ms']:.1f} ms")
+    print(f"outbound queue: {mic_status['out_queue']}")
+    print(f"session switch: {metrics['session_switch']}")
+    print(f"reconnect: {metrics['reconnect']}")
+    print(f"server counters: {server.counters}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless end-to-end benchmark against a fake Live server")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured captures before the first measurement")
+    parser.add_argument("--captures", type=int, default=5, help="Images sent for time-to-first-audio")
+    parser.add_argument("--barge-ins", type=int, default=3, help="Interruptions to measure")
+    parser.add_argument("--stops", type=int, default=3, help="Stop-button interruptions to measure")
+    parser.add_argument("--reply-seconds", type=float, default=2.0, help="Length of each canned reply")
+    parser.add_argument("--throughput-seconds", type=float, default=20.0, help="Audio streamed unpaced for throughput")
+    parser.add_argument("--upstream-seconds", type=float, default=2.0, help="Unmuted time for the mic throughput run")
+    parser.add_argument("--source", "--mic", default="tone",
+                        help="Mic audio source: tone, bursts, null or wav:PATH (see audio_devices.py)")
+    parser.add_argument("--sink", default="null", help="Speaker: null (paced), discard (unpaced) or wav:PATH")
+    parser.add_argument("--setup-delay-ms", type=float, default=0, help="Simulated handshake/setup latency on the server")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Random extra delay per reply chunk on the server")
+    parser.add_argument("--jitter-buffer-ms", type=int, default=80,
+                        help="Host's initial playback pre-buffer (AI_TUTOR_JITTER_MS); 0 plays on arrival")
+    parser.add_argument("--prewarm-ms", type=float, default=None,
+                        help="Send prewarm_session this long before each measured capture")
+    parser.add_argument("--switch-mode", default="on", choices=["on", "off"],
+                        help="Reuse the live session for each new image (on) or reconnect every time (off)")
+    parser.add_argument("--preroll-ms", type=int, default=0,
+                        help="Mic pre-roll sent on unmute (300 is a typical value); 0 stops the device while muted")
+    parser.add_argument("--idle-seconds", type=float, default=3.0, help="Idle window for wakeup/CPU counts")
+    parser.add_argument("--drops", type=int, default=2, help="Connection drops to recover from")
+    parser.add_argument("--rejects", type=int, default=1, help="Setups refused after each drop, to exercise backoff")
+    parser.add_argument("--no-resumption", action="store_true",
+                        help="Server hands out no resumption handles, so the host must replay")
+    parser.add_argument("--timeout", type=float, default=15.0)
+    asyncio.run(main(parser.parse_args()))
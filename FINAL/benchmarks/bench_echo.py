@@ -0,0 +1,145 @@
+"""
+## Echo suppression: upstream bytes and false barge-ins
+Replays a mic clip and the speaker clip it was recorded against through
+EchoSuppressor and then VoiceGate in 64 ms chunks, as listen_audio does, with
+each suppression mode, and reports:
+
+- sent: share of captured bytes the voice gate let through
+- false barge-ins: speech segments the gate opened while only the tutor
+  (echo) was audible; each is an interruption the student never made
+- student chunks passed: chunks with the student talking that still got
+  through (double talk must not be suppressed)
+- ERLE: echo return loss enhancement on echo-only chunks, median
+
+By default the clips are synthetic: the tutor's speech-like track played into
+a room (40 ms bulk delay, a 30 ms reverberant tail, about -10 dB), with the student
+talking over it now and then. --mic/--ref take recorded 16-bit WAVs instead,
+both starting at the same instant (--save writes the synthetic ones in that
+form), with --student-wav optional for the truth mask.
+
+    python benchmarks/bench_echo.py --seconds 60
+    python benchmarks/bench_echo.py --save /tmp/echo-clips
+"""
+
+import argparse
+import os
+import sys
+import time
+import wave
+
+import numpy as np
+
+FINAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FINAL_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_vad import synthetic_track
+from echo import EchoReference, EchoSuppressor
+from resample import PolyphaseResampler
+from vad import VoiceGate
+
+RATE = 16000
+CHUNK_SIZE = 1024
+
+
+def room_response(delay_ms=40, tail_ms=30, gain=0.3, seed=3):
+    """Speaker -> mic impulse response: a direct path after delay_ms, then a decaying reverberant tail."""
+    rng = np.random.default_rng(seed)
+    delay = int(delay_ms * RATE / 1000)
+    tail = int(tail_ms * RATE / 1000)
+    h = np.zeros(delay + tail)
+    h[delay] = gain
+    h[delay + 1:] = gain * rng.normal(0, 0.2, tail - 1) * np.exp(-np.arange(1, tail) / (tail / 4))
+    return h
+
+
+def synthetic_clips(seconds):
+    """(mic, ref, student truth mask): the tutor's echo plus the student's occasional speech."""
+    ref, _ = synthetic_track(seconds, seed=1)
+    student, student_truth = synthetic_track(seconds, seed=2)
+    student = np.where(student_truth, student, np.random.default_rng(4).normal(0, 30, len(student)))
+    echo = np.convolve(ref.astype(np.float64), room_response())[:len(ref)]
+    mic = np.clip(echo + student, -32768, 32767).astype("<i2")
+    return mic, ref, student_truth
+
+
+def read_wav(path):
+    with wave.open(path, "rb") as f:
+        rate = f.getframerate()
+        samples = np.frombuffer(f.readframes(f.getnframes()), dtype="<i2")
+        if f.getnchannels() > 1:
+            samples = samples.reshape(-1, f.getnchannels()).mean(axis=1).astype("<i2")
+    if rate != RATE:
+        samples = np.frombuffer(PolyphaseResampler(rate, RATE).process(samples.tobytes()), dtype="<i2")
+    return samples
+
+
+def write_wav(path, samples):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(RATE)
+        f.writeframes(samples.astype("<i2").tobytes())
+
+
+def run(mode, mic, ref, truth):
+    reference = EchoReference(RATE, origin=0.0)
+    suppressor = None if mode == "off" else EchoSuppressor(reference, mode)
+    gate = VoiceGate("energy", rate=RATE)
+    ref_active = np.abs(ref.astype(np.float32)) > 300
+    false_barge_ins = student_chunks = student_passed = 0
+    timings = []
+    for i in range(0, len(mic) - CHUNK_SIZE + 1, CHUNK_SIZE):
+        # The speaker plays this chunk of reference while the mic records the same stretch
+        reference.push(ref[i:i + CHUNK_SIZE].tobytes(), now=i / RATE)
+        chunk = mic[i:i + CHUNK_SIZE].tobytes()
+        start = time.perf_counter()
+        if suppressor is not None:
+            chunk = suppressor.process(chunk, captured_at=(i + CHUNK_SIZE) / RATE)
+        timings.append((time.perf_counter() - start) * 1e6)
+        was_active = gate.active
+        out = gate.process(chunk)
+        student = truth[i:i + CHUNK_SIZE].any()
+        if gate.active and not was_active and not student and ref_active[i:i + CHUNK_SIZE].any():
+            false_barge_ins += 1
+        if student:
+            student_chunks += 1
+            student_passed += any(len(c) == CHUNK_SIZE * 2 for c in out)
+    stats = gate.stats()
+    erle = suppressor.stats()["erle_db"] if suppressor is not None else None
+    delay = f", delay {suppressor.stats()['delay_ms']:.0f} ms" if suppressor is not None else ""
+    print(f"{mode:<5} sent {stats['bytes_sent'] / stats['bytes_captured'] * 100:5.1f}%, "
+          f"false barge-ins {false_barge_ins:>3}, student chunks passed {student_passed}/{student_chunks}, "
+          f"ERLE {'-' if erle is None else f'{erle:.1f} dB'}{delay}, "
+          f"{np.median(timings):.0f} us/chunk p50, {np.percentile(timings, 99):.0f} us p99")
+
+
+def main(args):
+    if args.mic:
+        mic, ref = read_wav(args.mic), read_wav(args.ref)
+        n = min(len(mic), len(ref))
+        mic, ref = mic[:n], ref[:n]
+        truth = read_wav(args.student_wav)[:n] != 0 if args.student_wav else np.zeros(n, dtype=bool)
+        print(f"{args.mic} against {args.ref}, {n / RATE:.0f} s")
+    else:
+        mic, ref, truth = synthetic_clips(args.seconds)
+        print(f"{args.seconds:.0f} s synthetic clips, tutor talking {np.mean(np.abs(ref) > 300) * 100:.0f}%, "
+              f"student {truth.mean() * 100:.0f}% of the time")
+        if args.save:
+            os.makedirs(args.save, exist_ok=True)
+            write_wav(os.path.join(args.save, "mic.wav"), mic)
+            write_wav(os.path.join(args.save, "ref.wav"), ref)
+            write_wav(os.path.join(args.save, "student.wav"), truth.astype(np.int16))
+            print(f"clips written to {args.save}")
+    for mode in ("off", "duck", "nlms"):
+        run(mode, mic, ref, truth)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Echo suppression: upstream bytes and false barge-ins")
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--mic", help="Recorded mic WAV (needs --ref)")
+    parser.add_argument("--ref", help="What the speaker played during --mic, same start")
+    parser.add_argument("--student-wav", help="Non-zero wherever the student was actually talking")
+    parser.add_argument("--save", help="Write the synthetic clips here as WAVs")
+    main(parser.parse_args())
@@ -0,0 +1,136 @@
+"""
+## Image transport benchmark
+Compares the original data URL path (JSON message -> split -> base64 decode ->
+base64 string handed to the SDK, which decodes and re-encodes it), the host's
+data URL fallback (one ASCII copy, decoded from a view past the comma, bytes to
+the SDK) and the binary frame path (raw frame read into a preallocated buffer
+-> bytes handed to the SDK, which encodes it once for the wire).
+
+Reports bytes copied and milliseconds spent per MB of image.
+
+    python benchmarks/bench_image_transport.py --width 2880 --height 1800
+"""
+
+import argparse
+import base64
+import binascii
+import io
+import json
+import os
+import sys
+import time
+
+import PIL.Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from native_messaging import FrameBuffer, HEADER, encode_binary_image, read_binary_frame, read_exactly
+
+
+def make_png(width, height):
+    """Noisy PNG so compression doesn't make the capture unrealistically small."""
+    img = PIL.Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    out = io.BytesIO()
+    img.save(out, format="PNG", compress_level=1)
+    return out.getvalue()
+
+
+def verify(image_bytes):
+    img = PIL.Image.open(io.BytesIO(image_bytes))
+    img.verify()
+
+
+def data_url_path(stream):
+    """Mirror of the original host: returns bytes copied."""
+    copied = 0
+    length = HEADER.unpack(read_exactly(stream, HEADER.size))[0]
+    message_bytes = read_exactly(stream, length)
+    copied += len(message_bytes)
+    message_json = message_bytes.decode('utf-8')
+    copied += len(message_json)
+    data_url = json.loads(message_json)["imageData"]
+    copied += len(data_url)
+    header, encoded = data_url.split(',', 1)
+    copied += len(encoded)
+    image_bytes = base64.b64decode(encoded)
+    copied += len(image_bytes)
+    verify(image_bytes)
+    # The SDK validates the base64 string back into bytes, then encodes it for the wire
+    sdk_bytes = base64.b64decode(encoded)
+    copied += len(sdk_bytes)
+    wire = base64.b64encode(sdk_bytes)
+    copied += len(wire)
+    return copied
+
+
+def data_url_fallback_path(stream):
+    """Mirror of the host's _prepare_image_from_data_url: returns bytes copied."""
+    copied = 0
+    length = HEADER.unpack(read_exactly(stream, HEADER.size))[0]
+    message_bytes = read_exactly(stream, length)
+    copied += len(message_bytes)
+    data_url = json.loads(message_bytes)["imageData"]
+    copied += len(data_url)
+    comma = data_url.index(',')
+    encoded = data_url.encode('ascii')
+    copied += len(encoded)
+    image_bytes = binascii.a2b_base64(memoryview(encoded)[comma + 1:])
+    copied += len(image_bytes)
+    verify(image_bytes)
+    wire = base64.b64encode(image_bytes)
+    copied += len(wire)
+    return copied
+
+
+def binary_path(stream, frame_buffer):
+    """Binary frame path: returns bytes copied."""
+    copied = 0
+    length = HEADER.unpack(read_exactly(stream, HEADER.size))[0]
+    header = json.loads(read_exactly(stream, length))
+    copied += length
+    image_bytes = read_binary_frame(stream, frame_buffer)
+    copied += 2 * len(image_bytes) # Into the frame buffer, then out to the caller's bytes
+    verify(image_bytes)
+    wire = base64.b64encode(image_bytes)
+    copied += len(wire)
+    return copied
+
+
+def run(name, payload, path, iterations, *args):
+    total_ms = 0.0
+    copied = 0
+    for _ in range(iterations):
+        stream = io.BufferedReader(io.BytesIO(payload))
+        start = time.perf_counter()
+        copied = path(stream, *args)
+        total_ms += (time.perf_counter() - start) * 1000
+    return name, total_ms / iterations, copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark data URL vs binary image transport")
+    parser.add_argument("--width", type=int, default=2880)
+    parser.add_argument("--height", type=int, default=1800)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    image = make_png(args.width, args.height)
+    image_mb = len(image) / (1024 * 1024)
+    data_url = "data:image/png;base64," + base64.b64encode(image).decode()
+    message = json.dumps({"type": "image_data", "imageData": data_url}).encode('utf-8')
+    data_url_payload = HEADER.pack(len(message)) + message
+    binary_payload = encode_binary_image(image, "image/png")
+
+    print(f"Image: {args.width}x{args.height} PNG, {image_mb:.2f} MB ({len(data_url_payload) / (1024 * 1024):.2f} MB as data URL message)")
+    results = [
+        run("data_url", data_url_payload, data_url_path, args.iterations),
+        run("fallback", data_url_payload, data_url_fallback_path, args.iterations),
+        run("binary", binary_payload, binary_path, args.iterations, FrameBuffer()),
+    ]
+    print(f"{'path':<10} {'ms/image':>10} {'ms/MB':>8} {'bytes copied':>14} {'copies/image':>13}")
+    for name, ms, copied in results:
+        print(f"{name:<10} {ms:>10.2f} {ms / image_mb:>8.2f} {copied:>14,} {copied / len(image):>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
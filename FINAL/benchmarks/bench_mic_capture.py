@@ -0,0 +1,91 @@
+"""
+## Microphone capture: blocking reads in the thread pool vs callback ring buffer
+Reads CHUNK_SIZE chunks from a virtual microphone for a few seconds each way
+and reports chunks per second, wakeups (context switches across all threads)
+and CPU per second of audio. A second run stalls the event loop to show that
+the ring buffer counts the audio lost to the stall.
+
+    python benchmarks/bench_mic_capture.py --seconds 5 --frames-per-buffer 512
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+FINAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FINAL_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from audio_capture import MicCapture
+from audio_devices import ToneSource
+from bench_e2e import ProcActivity
+
+RATE = 16000
+CHUNK_SIZE = 1024
+
+
+async def blocking_reads(source, seconds, frames_per_buffer, stall_ms):
+    stream = source.open_stream(rate=RATE, frames_per_buffer=frames_per_buffer)
+    chunks = 0
+    end = time.perf_counter() + seconds
+    try:
+        while time.perf_counter() < end:
+            await asyncio.to_thread(stream.read, CHUNK_SIZE, exception_on_overflow=False)
+            chunks += 1
+            if stall_ms and chunks == 10:
+                time.sleep(stall_ms / 1000) # Something hogging the event loop
+    finally:
+        stream.close()
+    return chunks, {}
+
+
+async def callback_ring(source, seconds, frames_per_buffer, stall_ms):
+    mic = MicCapture(rate=RATE, frames_per_buffer=frames_per_buffer, buffer_seconds=0.5)
+    await mic.open(source)
+    chunks = 0
+    end = time.perf_counter() + seconds
+    try:
+        while time.perf_counter() < end:
+            await mic.read(CHUNK_SIZE)
+            chunks += 1
+            if stall_ms and chunks == 10:
+                time.sleep(stall_ms / 1000)
+    finally:
+        await mic.close()
+    return chunks, mic.stats()
+
+
+async def measure(name, capture, seconds, frames_per_buffer, stall_ms):
+    source = ToneSource("tone")
+    activity = ProcActivity(os.getpid())
+    before = activity.sample()
+    start = time.perf_counter()
+    chunks, stats = await capture(source, seconds, frames_per_buffer, stall_ms)
+    elapsed = time.perf_counter() - start
+    after = activity.sample()
+    line = f"{name:<26} {chunks / elapsed:>8.1f} chunks/s"
+    if before and after:
+        line += f" {(after[0] - before[0]) / elapsed:>8.1f} wakeups/s {(after[1] - before[1]) * 1000 / elapsed:>7.2f} ms CPU/s"
+    print(line)
+    if stats:
+        print(f"{'':<26} overflows={stats['input_overflows']} ring_overrun_frames={stats['ring_overrun_frames']} "
+              f"callbacks={stats['callbacks']}")
+
+
+async def main(args):
+    print(f"steady capture, {args.seconds:.0f} s, frames_per_buffer={args.frames_per_buffer}")
+    await measure("blocking read + to_thread", blocking_reads, args.seconds, args.frames_per_buffer, 0)
+    await measure("callback + ring buffer", callback_ring, args.seconds, args.frames_per_buffer, 0)
+    print(f"\nwith a {args.stall_ms:.0f} ms event loop stall")
+    await measure("blocking read + to_thread", blocking_reads, args.seconds, args.frames_per_buffer, args.stall_ms)
+    await measure("callback + ring buffer", callback_ring, args.seconds, args.frames_per_buffer, args.stall_ms)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare blocking and callback microphone capture")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--frames-per-buffer", type=int, default=1024)
+    parser.add_argument("--stall-ms", type=float, default=800, help="Event loop stall for the overflow run")
+    asyncio.run(main(parser.parse_args()))
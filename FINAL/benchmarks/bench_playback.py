@@ -0,0 +1,165 @@
+"""
+## Playback: blocking writes per chunk vs callback ring (PlaybackEngine)
+Plays model-sized chunks (40 ms of 24 kHz audio, delivered faster than real
+time as the Live API does) to a paced virtual speaker and interrupts each
+reply part-way, the old way and through PlaybackEngine, and reports:
+
+- interrupt -> silence: from the interruption to the last sample of the old
+  reply leaving the speaker. The old loop only notices between writes, and
+  stopping a blocking stream plays out what the device already holds; the
+  engine's next callback after flush() is silent.
+- CPU per chunk and wakeups per second of audio (all threads, getrusage)
+
+    python benchmarks/bench_playback.py --rounds 10 --frames-per-buffer 256
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+FINAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FINAL_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from audio_devices import NullSink
+from bench_e2e import ProcActivity
+from playback import PlaybackEngine
+from virtual_audio import tone_pcm
+
+RATE = 24000
+CHUNK_MS = 40
+
+
+async def deliver(queue, pcm, delivery_factor):
+    """Queue a reply in CHUNK_MS chunks, delivery_factor times faster than it plays."""
+    size = RATE * CHUNK_MS // 1000 * 2
+    for offset in range(0, len(pcm), size):
+        queue.put_nowait(pcm[offset:offset + size])
+        await asyncio.sleep(CHUNK_MS / 1000 / delivery_factor)
+
+
+def drain(queue):
+    while not queue.empty():
+        queue.get_nowait()
+
+
+class BlockingPlayer:
+    """The previous play_audio loop: a get task and an interrupt task per chunk, then to_thread(stream.write)."""
+
+    def __init__(self, frames_per_buffer):
+        self.stream = NullSink().open_stream(rate=RATE, frames_per_buffer=frames_per_buffer)
+        self.queue = asyncio.Queue()
+        self.interrupt = asyncio.Event()
+        self.chunks = 0
+        self.silent_at = None
+
+    async def run(self):
+        while True:
+            get_task = asyncio.create_task(self.queue.get())
+            interrupt_task = asyncio.create_task(self.interrupt.wait())
+            done, pending = await asyncio.wait([get_task, interrupt_task], return_when=asyncio.FIRST_COMPLETED)
+            if interrupt_task in done:
+                self.interrupt.clear()
+                await asyncio.to_thread(self.stream.stop_stream)
+                # Stopping lets the device play out what it already holds
+                now = time.perf_counter()
+                self.silent_at = now + max(0.0, self.stream._clock - now)
+                drain(self.queue)
+                get_task.cancel()
+                continue
+            interrupt_task.cancel()
+            data = get_task.result()
+            if data is None:
+                break
+            if not self.stream.is_active():
+                await asyncio.to_thread(self.stream.start_stream)
+            await asyncio.to_thread(self.stream.write, data)
+            self.chunks += 1
+
+    async def interrupt_and_wait(self):
+        start = time.perf_counter()
+        self.silent_at = None
+        self.interrupt.set()
+        while self.silent_at is None:
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(max(0.0, self.silent_at - time.perf_counter()))
+        return (self.silent_at - start) * 1000
+
+    async def close(self):
+        self.stream.close()
+
+
+class EnginePlayer:
+    """The current play_audio loop: await queue.get(), await engine.write(); interrupting is flush() and a drain."""
+
+    def __init__(self, frames_per_buffer):
+        self.engine = PlaybackEngine(RATE, frames_per_buffer=frames_per_buffer)
+        self.queue = asyncio.Queue()
+        self.chunks = 0
+
+    async def run(self):
+        await self.engine.open(NullSink())
+        while True:
+            data = await self.queue.get()
+            if data is None:
+                break
+            await self.engine.write(data)
+            self.chunks += 1
+
+    async def interrupt_and_wait(self):
+        histogram = self.engine.flush_to_silence
+        recorded, total_ms = histogram.count, histogram.total_ms
+        self.engine.flush()
+        drain(self.queue)
+        while histogram.count == recorded:
+            await asyncio.sleep(0.001)
+        return histogram.total_ms - total_ms
+
+    async def close(self):
+        await self.engine.close()
+
+
+async def measure(name, player, args):
+    pcm = tone_pcm(RATE, seconds=args.reply_seconds)
+    runner = asyncio.create_task(player.run())
+    latencies = []
+    activity = ProcActivity(os.getpid())
+    before = activity.sample()
+    cpu_start, start = time.process_time(), time.perf_counter()
+    for _ in range(args.rounds):
+        delivery = asyncio.create_task(deliver(player.queue, pcm, args.delivery_factor))
+        await asyncio.sleep(args.interrupt_after)
+        delivery.cancel()
+        latencies.append(await player.interrupt_and_wait())
+        await asyncio.sleep(0.2) # A moment of silence before the next reply
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    after = activity.sample()
+    player.queue.put_nowait(None)
+    await runner
+    await player.close()
+    line = (f"{name:<22} interrupt -> silence p50 {statistics.median(latencies):6.1f} ms "
+            f"max {max(latencies):6.1f} ms, {cpu * 1e6 / max(player.chunks, 1):6.0f} us CPU/chunk")
+    if before and after:
+        line += f", {(after[0] - before[0]) / elapsed:6.1f} wakeups/s"
+    print(line)
+
+
+async def main(args):
+    print(f"{args.rounds} replies interrupted after {args.interrupt_after * 1000:.0f} ms, {CHUNK_MS} ms chunks "
+          f"delivered {args.delivery_factor:.0f}x real time, frames_per_buffer={args.frames_per_buffer}")
+    await measure("blocking write", BlockingPlayer(args.frames_per_buffer), args)
+    await measure("PlaybackEngine", EnginePlayer(args.frames_per_buffer), args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare blocking-write playback with the callback PlaybackEngine")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--reply-seconds", type=float, default=3.0)
+    parser.add_argument("--interrupt-after", type=float, default=1.0, help="Seconds into each reply")
+    parser.add_argument("--delivery-factor", type=float, default=2.0, help="How much faster than real time chunks arrive")
+    parser.add_argument("--frames-per-buffer", type=int, default=512)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,98 @@
+"""
+## Resampler: CPU per second of audio and quality against a reference
+Pushes a few seconds of audio through PolyphaseResampler in CHUNK_SIZE blocks,
+for the device rate conversions the host does, and compares with linear
+interpolation (np.interp), the cheap alternative. Quality is measured against
+the exact reference signal evaluated at the output rate:
+
+- SNR: a mix of in-band tones, resampled vs the same tones computed directly
+- alias: a tone above the output Nyquist (would fold back into the speech
+  band), output level relative to full scale; lower is better
+
+    python benchmarks/bench_resample.py --seconds 10
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+FINAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FINAL_DIR)
+
+from resample import PolyphaseResampler
+
+CHUNK_SIZE = 1024
+CONVERSIONS = [(48000, 16000), (44100, 16000), (24000, 48000), (24000, 44100)]
+TONES_HZ = (220, 1234, 3100, 6000)
+AMPLITUDE = 6000
+
+
+class LinearResampler:
+    """np.interp per block; no anti-alias filter. Baseline only."""
+
+    def __init__(self, in_rate, out_rate):
+        self.in_rate, self.out_rate = in_rate, out_rate
+        self.delay_seconds = 0.0
+        self._consumed = 0 # Input frames seen
+        self._produced = 0 # Output frames made
+
+    def process(self, block):
+        x = np.frombuffer(block, dtype="<i2").astype(np.float32)
+        end = self._consumed + len(x)
+        t = np.arange(self._produced, int(end * self.out_rate / self.in_rate)) * self.in_rate / self.out_rate
+        out = np.interp(t - self._consumed, np.arange(len(x)), x)
+        self._consumed = end
+        self._produced += len(t)
+        return np.clip(np.rint(out), -32768, 32767).astype("<i2").tobytes()
+
+
+def tones(rate, seconds, freqs, delay=0.0):
+    t = np.arange(int(rate * seconds)) / rate - delay
+    return sum(AMPLITUDE * np.sin(2 * np.pi * f * t) for f in freqs)
+
+
+def run(resampler, signal):
+    pcm = np.rint(signal).astype("<i2").tobytes()
+    block = CHUNK_SIZE * 2
+    out = []
+    start = time.process_time()
+    for i in range(0, len(pcm), block):
+        out.append(resampler.process(pcm[i:i + block]))
+    cpu = time.process_time() - start
+    return np.frombuffer(b"".join(out), dtype="<i2").astype(np.float64), cpu
+
+
+def measure(name, make, in_rate, out_rate, seconds):
+    nyquist = min(in_rate, out_rate) / 2
+    in_band = [f for f in TONES_HZ if f < 0.9 * nyquist]
+    y, cpu = run(make(in_rate, out_rate), tones(in_rate, seconds, in_band))
+    r = make(in_rate, out_rate)
+    ref = tones(out_rate, len(y) / out_rate, in_band, delay=r.delay_seconds)
+    edge = int(0.05 * out_rate) # Skip filter start-up at both ends
+    err = y[edge:-edge] - ref[edge:-edge]
+    snr = 10 * np.log10(np.mean(ref[edge:-edge] ** 2) / np.mean(err ** 2))
+    line = f"{in_rate:>6} -> {out_rate:<6} {name:<10} {cpu * 1000 / seconds:>8.3f} {snr:>8.1f}"
+    if in_rate > out_rate:
+        # Above the output Nyquist: must be filtered out, not folded down to 0.4 * out_rate
+        alias_in = tones(in_rate, 1.0, [0.6 * out_rate])
+        alias_out, _ = run(make(in_rate, out_rate), alias_in)
+        level = np.sqrt(np.mean(alias_out[edge:-edge] ** 2)) / (AMPLITUDE / np.sqrt(2))
+        line += f" {20 * np.log10(max(level, 1e-9)):>9.1f}"
+    print(line)
+
+
+def main(args):
+    print(f"{args.seconds:.0f} s per conversion, {CHUNK_SIZE}-frame blocks")
+    print(f"{'conversion':<16} {'method':<10} {'CPU ms/s':>8} {'SNR dB':>8} {'alias dB':>9}")
+    for in_rate, out_rate in CONVERSIONS:
+        measure("polyphase", PolyphaseResampler, in_rate, out_rate, args.seconds)
+        measure("linear", LinearResampler, in_rate, out_rate, args.seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resampler CPU cost and quality")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    main(parser.parse_args())
@@ -0,0 +1,155 @@
+"""
+## Native messaging reader benchmark
+Compares the old per-message thread hop (`asyncio.to_thread(read_native_message)`)
+with the asyncio-native `NativeMessageReader` over a real OS pipe.
+
+- burst: writer pushes messages as fast as it can -> messages/sec
+- paced: writer sends one control message every --interval-ms -> per-message latency
+- cancel: how long a pending read takes to give up once cancelled, and whether
+  the message after the cancel is swallowed by an orphaned worker thread
+- images: binary image frames (--image-mb each) -> ms per MB read
+
+    python benchmarks/bench_stdin_reader.py --messages 20000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from native_messaging import HEADER, NativeMessageReader, encode_binary_image, read_native_message
+
+
+def frame(message):
+    body = json.dumps(message).encode('utf-8')
+    return HEADER.pack(len(body)) + body
+
+
+def writer(fd, count, interval):
+    with os.fdopen(fd, 'wb', buffering=0) as out:
+        for i in range(count):
+            out.write(frame({"type": "unmute_mic", "seq": i, "sent": time.perf_counter()}))
+            if interval:
+                time.sleep(interval)
+
+
+class ThreadedReader:
+    """The original approach: one worker-thread hop per message."""
+
+    def __init__(self, pipe):
+        self._stream = getattr(pipe, 'buffer', pipe)
+
+    async def start(self):
+        return self
+
+    async def read_message(self):
+        return await asyncio.to_thread(read_native_message, self._stream)
+
+    def close(self):
+        pass
+
+
+async def measure(reader_cls, count, interval):
+    read_fd, write_fd = os.pipe()
+    pipe = os.fdopen(read_fd, 'rb', buffering=1 << 16)
+    reader = await reader_cls(pipe).start()
+    thread = threading.Thread(target=writer, args=(write_fd, count, interval), daemon=True)
+    latencies = []
+    start = time.perf_counter()
+    thread.start()
+    while (message := await reader.read_message()) is not None:
+        latencies.append((time.perf_counter() - message["sent"]) * 1000)
+    elapsed = time.perf_counter() - start
+    thread.join()
+    reader.close()
+    pipe.close()
+    return len(latencies) / elapsed, latencies
+
+
+async def measure_cancel(reader_cls):
+    """Cancel a read waiting on an idle pipe, then check the next message still arrives."""
+    read_fd, write_fd = os.pipe()
+    pipe = os.fdopen(read_fd, 'rb', buffering=0)
+    reader = await reader_cls(pipe).start()
+    task = asyncio.create_task(reader.read_message())
+    await asyncio.sleep(0.05)
+    start = time.perf_counter()
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    cancel_ms = (time.perf_counter() - start) * 1000
+    # A worker thread stuck in read() survives the cancel and swallows the next message
+    os.write(write_fd, frame({"type": "mute_mic", "sent": time.perf_counter()}))
+    try:
+        await asyncio.wait_for(reader.read_message(), timeout=0.5)
+        lost = False
+    except asyncio.TimeoutError:
+        lost = True
+    os.close(write_fd)
+    await asyncio.sleep(0.05)
+    reader.close()
+    pipe.close()
+    return cancel_ms, lost
+
+
+async def measure_images(reader_cls, count, image_mb):
+    """Time reading `count` binary image frames through a pipe, per MB."""
+    image = os.urandom(int(image_mb * 2**20))
+    payload = encode_binary_image(image)
+    read_fd, write_fd = os.pipe()
+    pipe = os.fdopen(read_fd, 'rb', buffering=1 << 16)
+    reader = await reader_cls(pipe).start()
+
+    def write_images():
+        with os.fdopen(write_fd, 'wb', buffering=0) as out:
+            for _ in range(count):
+                out.write(payload)
+
+    thread = threading.Thread(target=write_images, daemon=True)
+    start = time.perf_counter()
+    thread.start()
+    received = 0
+    while (message := await reader.read_message()) is not None:
+        received += len(message["imageBytes"])
+    elapsed = time.perf_counter() - start
+    thread.join()
+    reader.close()
+    pipe.close()
+    return elapsed * 1000 / (received / 2**20)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def main(args):
+    impls = [("to_thread", ThreadedReader), ("async", NativeMessageReader)]
+    print(f"{'reader':<10} {'burst msg/s':>12} {'paced p50 ms':>13} {'p95 ms':>8} {'p99 ms':>8} {'cancel ms':>10} "
+          f"{'msg lost':>9} {'image ms/MB':>12}")
+    for name, impl in impls:
+        rate, _ = await measure(impl, args.messages, 0)
+        _, latencies = await measure(impl, args.paced_messages, args.interval_ms / 1000)
+        cancel_ms, lost = await measure_cancel(impl)
+        image_ms = await measure_images(impl, args.images, args.image_mb)
+        print(f"{name:<10} {rate:>12,.0f} {statistics.median(latencies):>13.3f} "
+              f"{percentile(latencies, 95):>8.3f} {percentile(latencies, 99):>8.3f} {cancel_ms:>10.3f} {str(lost):>9} "
+              f"{image_ms:>12.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark native messaging stdin readers")
+    parser.add_argument("--messages", type=int, default=20000, help="Messages in the burst run")
+    parser.add_argument("--paced-messages", type=int, default=500, help="Messages in the paced run")
+    parser.add_argument("--interval-ms", type=float, default=2.0, help="Gap between paced messages")
+    parser.add_argument("--images", type=int, default=20, help="Binary image frames in the image run")
+    parser.add_argument("--image-mb", type=float, default=8.0, help="Size of each image frame")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,89 @@
+"""
+## Voice gate: uplink saved and cost per chunk
+Runs VoiceGate over a synthetic mic track (speech-like tone bursts between
+stretches of room noise, hiss and mains hum) in 64 ms chunks, and reports how
+much audio would have been sent, how much speech got through, and the time
+spent classifying each chunk.
+
+    python benchmarks/bench_vad.py --seconds 60
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+FINAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FINAL_DIR)
+
+from vad import VAD_BACKENDS, VoiceGate
+
+RATE = 16000
+CHUNK_SIZE = 1024
+
+
+def synthetic_track(seconds, seed=0):
+    """int16 track plus a per-sample "is speech" truth mask."""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * RATE)
+    t = np.arange(n) / RATE
+    track = rng.normal(0, 30, n) # Quiet room
+    truth = np.zeros(n, dtype=bool)
+    pos = 0
+    while pos < n:
+        # 0.5-2 s of "speech": a vibrato tone with harmonics, then 1-4 s of background
+        length = int(rng.uniform(0.5, 2.0) * RATE)
+        end = min(n, pos + length)
+        f0 = rng.uniform(110, 240) * (1 + 0.05 * np.sin(2 * np.pi * 5 * t[pos:end]))
+        phase = 2 * np.pi * np.cumsum(f0) / RATE
+        track[pos:end] += 4000 * (np.sin(phase) + 0.5 * np.sin(2 * phase) + 0.25 * np.sin(3 * phase))
+        truth[pos:end] = True
+        pos = end + int(rng.uniform(1.0, 4.0) * RATE)
+    # Background events the gate should ignore
+    hiss = slice(int(0.3 * n), int(0.35 * n))
+    track[hiss] += rng.normal(0, 2500, hiss.stop - hiss.start) * ~truth[hiss]
+    hum = slice(int(0.6 * n), int(0.65 * n))
+    track[hum] += 6000 * np.sin(2 * np.pi * 50 * t[hum]) * ~truth[hum]
+    return np.clip(track, -32768, 32767).astype("<i2"), truth
+
+
+def run(backend, track, truth, hangover_ms, pre_padding_ms):
+    gate = VoiceGate(backend, rate=RATE, hangover_ms=hangover_ms, pre_padding_ms=pre_padding_ms)
+    chunk_bytes = CHUNK_SIZE * 2
+    data = track.tobytes()
+    speech_chunks = speech_sent = 0
+    timings = []
+    for i in range(0, len(data) - chunk_bytes + 1, chunk_bytes):
+        has_speech = truth[i // 2:i // 2 + CHUNK_SIZE].any()
+        start = time.perf_counter()
+        out = gate.process(data[i:i + chunk_bytes])
+        timings.append((time.perf_counter() - start) * 1e6)
+        if has_speech:
+            speech_chunks += 1
+            speech_sent += any(len(c) == chunk_bytes for c in out)
+    stats = gate.stats()
+    print(f"{backend:<8} sent {stats['bytes_sent'] / stats['bytes_captured'] * 100:5.1f}% of captured bytes "
+          f"(saved {stats['saved_pct']:.1f}%), speech chunks passed {speech_sent}/{speech_chunks}, "
+          f"{stats['speech_segments']} segments, {stats['keepalives_sent']} keepalives, "
+          f"{np.median(timings):.1f} us/chunk p50, {np.percentile(timings, 99):.1f} us p99")
+
+
+def main(args):
+    track, truth = synthetic_track(args.seconds)
+    print(f"{args.seconds:.0f} s track, {truth.mean() * 100:.0f}% speech, "
+          f"hangover {args.hangover_ms} ms, pre-padding {args.pre_padding_ms} ms")
+    for backend in VAD_BACKENDS:
+        try:
+            run(backend, track, truth, args.hangover_ms, args.pre_padding_ms)
+        except ImportError as e:
+            print(f"{backend:<8} unavailable ({e})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Voice gate savings and cost")
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--hangover-ms", type=int, default=500)
+    parser.add_argument("--pre-padding-ms", type=int, default=200)
+    main(parser.parse_args())
@@ -92,6 +92,7 @@
             });
         } else {
             console.log("AI Tutor: Selection too small, cancelling.");
+            notifyCancelled();
         }
     }
 
@@ -99,9 +100,15 @@
         if (e.key === 'Escape') {
             console.log("AI Tutor: Escape key pressed, cleaning up.");
             cleanup();
+            notifyCancelled();
         }
     }
 
+    // Lets the background release the native host it kept up for this selection
+    function notifyCancelled() {
+        chrome.runtime.sendMessage({ type: "capture_cancelled" }).catch(() => {});
+    }
+
     function cleanup() {
         console.log("AI Tutor: Cleaning up overlay and selection box.");
         window.aiTutorActive = false; // Reset flag
@@ -0,0 +1,184 @@
+"""
+## Audio devices that outlive sessions
+Opening a PortAudio device can take hundreds of milliseconds, and a new Live
+session used to pay it twice: listen_audio and play_audio opened the mic and
+speaker at the start of every session and closed them when it was cancelled.
+DeviceManager opens each one the first time a session asks for it and keeps it
+open for the host's lifetime; later sessions just attach. The mic keeps the
+MicCapture pause/pre-roll behaviour while no session is attached, and the
+speaker stops itself when idle (PlaybackEngine).
+
+Hot swap: `watch()` checks the open streams every `check_seconds`. A stream
+that is running but has had no callback for `stall_seconds` has lost its
+device (unplugged headphones, a Bluetooth drop, the OS moving the default).
+Both streams are closed, the backends re-enumerate devices (PortAudio only
+sees a new default after re-initialising, which takes every stream with it),
+and whatever was open is reopened on the current default, at its own rate.
+
+A new default whose predecessor still works (headphones plugged in) never
+stalls anything, so every `default_poll_seconds`, while both streams are
+stopped (mic muted, nothing playing), `watch()` also asks the backends which
+device they would open now and swaps the same way if it moved. Swapping only
+then keeps a reply or the student's speech from being cut.
+"""
+
+import asyncio
+import logging
+import time
+
+from metrics import LatencyHistogram
+from resample import PolyphaseResampler
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceManager:
+    """The host's mic (MicCapture) and speaker (PlaybackEngine), opened lazily and reopened if their device goes."""
+
+    def __init__(self, source, sink, mic, playback, mic_rate=16000, speaker_rate=24000, native_rates=True,
+                 check_seconds=1.0, stall_seconds=2.0, default_poll_seconds=5.0):
+        self.source = source
+        self.sink = sink
+        self.mic = mic
+        self.playback = playback
+        self.mic_rate = mic_rate # What the pipeline wants
+        self.speaker_rate = speaker_rate
+        self.native_rates = native_rates
+        self.check_seconds = check_seconds
+        self.stall_seconds = stall_seconds
+        self.default_poll_seconds = default_poll_seconds # 0: only swap on a stall
+        self.mic_info = None # Device info; looked up on open since enumeration is slow
+        self.speaker_info = None
+        self.capture_rate = None # Rates the devices were opened at
+        self.playback_rate = None
+        self.mic_resampler = None # Device rate -> mic_rate, when they differ
+        self.speaker_resampler = None # speaker_rate -> device rate, when they differ
+        self._lock = asyncio.Lock() # Opens and swaps happen one at a time
+        self.open_latency = LatencyHistogram() # Per device open, including the info lookup
+        self.counters = {"input_opens": 0, "input_attaches": 0, "output_opens": 0, "output_attaches": 0,
+                         "hot_swaps": 0, "swap_failures": 0, "default_polls": 0, "default_changes": 0}
+
+    async def attach_input(self, start=True):
+        """Open the mic if it isn't yet (started or not); otherwise reuse it as it is, minus stale audio."""
+        async with self._lock:
+            self.counters["input_attaches"] += 1
+            if self.mic.stream is None:
+                await self._open_input(start)
+            else:
+                self.mic.discard()
+
+    async def attach_output(self):
+        """Open the speaker if it isn't yet."""
+        async with self._lock:
+            self.counters["output_attaches"] += 1
+            if self.playback.stream is None:
+                await self._open_output()
+
+    async def detach_input(self):
+        """The session is done with the mic; without a pre-roll to keep, stop it until the next one."""
+        if self.mic.stream is not None:
+            await self.mic.mute()
+
+    async def _open_input(self, start):
+        opened = time.perf_counter()
+        self.mic_info = await asyncio.to_thread(self.source.device_info)
+        rate = int(self.mic_info["defaultSampleRate"]) if self.native_rates else self.mic_rate
+        if rate != self.capture_rate:
+            self.mic_resampler = PolyphaseResampler(rate, self.mic_rate) if rate != self.mic_rate else None
+        self.capture_rate = rate
+        await self.mic.open(self.source, start=start, rate=rate)
+        self.open_latency.record_since(opened)
+        self.counters["input_opens"] += 1
+        logger.info(f"Using microphone: {self.mic_info['name']} at {rate} Hz")
+
+    async def _open_output(self):
+        opened = time.perf_counter()
+        self.speaker_info = await asyncio.to_thread(self.sink.device_info)
+        rate = int(self.speaker_info["defaultSampleRate"]) if self.native_rates else self.speaker_rate
+        if rate != self.playback_rate:
+            self.speaker_resampler = PolyphaseResampler(self.speaker_rate, rate) if rate != self.speaker_rate else None
+        self.playback_rate = rate
+        await self.playback.open(self.sink, rate=rate)
+        self.open_latency.record_since(opened)
+        self.counters["output_opens"] += 1
+        logger.info(f"Using speaker: {self.speaker_info['name']} at {rate} Hz")
+
+    def _stalled(self, now):
+        mic_stalled = self.mic.stream is not None and self.mic.active and now - self.mic.called_at > self.stall_seconds
+        speaker_stalled = self.playback.running and now - self.playback.called_at > self.stall_seconds
+        return mic_stalled, speaker_stalled
+
+    def _idle(self):
+        """Devices open but neither stream running: a swap now cuts nothing off."""
+        opened = self.mic.stream is not None or self.playback.stream is not None
+        return opened and not self.mic.active and not self.playback.running
+
+    def _default_moved(self):
+        """Which open devices are no longer the system's default (blocking; run in a thread)."""
+        moved = []
+        if self.mic.stream is not None and self.mic_info:
+            default = self.source.current_default()
+            if default is not None and default != self.mic_info["name"]:
+                moved.append("microphone")
+        if self.playback.stream is not None and self.speaker_info:
+            default = self.sink.current_default()
+            if default is not None and default != self.speaker_info["name"]:
+                moved.append("speaker")
+        return moved
+
+    async def watch(self):
+        """Reopen the devices on the current default when a running stream stops getting callbacks, or when the
+        default moves while they are idle."""
+        next_poll = time.perf_counter() + self.default_poll_seconds
+        while True:
+            await asyncio.sleep(self.check_seconds)
+            now = time.perf_counter()
+            mic_stalled, speaker_stalled = self._stalled(now)
+            if mic_stalled or speaker_stalled:
+                which = " and ".join(name for name, stalled in (("microphone", mic_stalled),
+                                                                  ("speaker", speaker_stalled)) if stalled)
+                logger.warning(f"No audio callbacks from the {which} for {self.stall_seconds:g} s; "
+                               f"reopening on the current default device")
+                await self.swap()
+            elif self.default_poll_seconds and now >= next_poll and self._idle():
+                next_poll = now + self.default_poll_seconds
+                self.counters["default_polls"] += 1
+                moved = await asyncio.to_thread(self._default_moved)
+                if moved and self._idle(): # Audio may have started while we looked
+                    logger.info(f"Default {' and '.join(moved)} changed; reopening on the new default")
+                    self.counters["default_changes"] += 1
+                    await self.swap()
+
+    async def swap(self):
+        """Close both streams, re-enumerate devices and reopen whatever was open."""
+        async with self._lock:
+            reopen_mic = self.mic.stream is not None
+            mic_started = self.mic.active
+            reopen_speaker = self.playback.stream is not None
+            await self.mic.close()
+            await self.playback.close()
+            try:
+                await asyncio.to_thread(self.source.refresh)
+                await asyncio.to_thread(self.sink.refresh)
+                if reopen_mic:
+                    await self._open_input(mic_started)
+                if reopen_speaker:
+                    await self._open_output()
+                self.counters["hot_swaps"] += 1
+            except Exception as e:
+                # Left closed; the next session's attach tries again
+                self.counters["swap_failures"] += 1
+                logger.error(f"Could not reopen audio devices: {e}")
+
+    async def close(self):
+        async with self._lock:
+            await self.mic.close()
+            await self.playback.close()
+
+    def stats(self):
+        return dict(self.counters,
+                    microphone=self.mic_info["name"] if self.mic_info else None,
+                    speaker=self.speaker_info["name"] if self.speaker_info else None,
+                    capture_rate=self.capture_rate,
+                    playback_rate=self.playback_rate,
+                    open_latency=self.open_latency.snapshot())
@@ -0,0 +1,209 @@
+"""
+## Echo suppression for the upstream mic stream
+When the student unmutes while the tutor is talking, the speaker leaks into the
+mic. Without this stage that echo is sent upstream, where it costs bandwidth
+and the server takes it for the student barging in.
+
+play_audio pushes what it writes into an EchoReference, a 16 kHz timeline of
+what the speaker is playing. Each mic chunk is then matched against the stretch
+of that timeline it was captured over:
+
+- "nlms": a frequency-domain block NLMS filter (overlap-save, FFT blocks of
+  `taps` samples, step normalized per frequency bin so speech's uneven
+  spectrum doesn't slow or destabilize it) models the speaker -> mic path and
+  subtracts the predicted echo. Adaptation
+  freezes during double talk (Geigel detector) so the student's voice doesn't
+  train the filter. Whatever is left that is still mostly echo is gated.
+- "duck": no filter; the chunk is gated whenever it is not clearly louder
+  than the speaker would make it. Cheap, but half-duplex.
+
+The bulk speaker -> mic delay (output plus input latency) is estimated by
+cross-correlation while the tutor talks, so the filter's taps only need to
+cover the room's reverberation.
+"""
+
+import collections
+import time
+
+import numpy as np
+
+
+class EchoReference:
+    """What the speaker has played, on a 16 kHz timeline indexed by perf_counter()."""
+
+    def __init__(self, rate=16000, seconds=3.0, origin=None):
+        self.rate = rate
+        self._ring = np.zeros(int(rate * seconds), dtype=np.float32)
+        self._origin = time.perf_counter() if origin is None else origin
+        self.end = 0 # Timeline index just past the last queued playback sample
+
+    def index(self, t):
+        return int(round((t - self._origin) * self.rate))
+
+    def _write(self, start, samples):
+        size = len(self._ring)
+        if len(samples) >= size:
+            start, samples = start + len(samples) - size, samples[-size:]
+        positions = (start + np.arange(len(samples))) % size
+        self._ring[positions] = samples
+
+    def push(self, pcm, now=None):
+        """Queue int16 audio just written to the speaker; it plays after anything still queued."""
+        samples = np.frombuffer(pcm, dtype="<i2").astype(np.float32)
+        start = max(self.end, self.index(time.perf_counter() if now is None else now))
+        if start > self.end:
+            # Silence since the speaker last ran dry
+            self._write(self.end, np.zeros(min(start - self.end, len(self._ring)), dtype=np.float32))
+        self._write(start, samples)
+        self.end = start + len(samples)
+
+    def flush(self, now=None):
+        """Playback was cut off: nothing queued after `now` will be heard."""
+        cut = self.index(time.perf_counter() if now is None else now)
+        if cut < self.end:
+            self._write(cut, np.zeros(min(self.end - cut, len(self._ring)), dtype=np.float32))
+            self.end = cut
+
+    def get(self, start, end):
+        """Samples [start, end) of the timeline; zeros outside what is held."""
+        out = np.zeros(end - start, dtype=np.float32)
+        lo, hi = max(start, self.end - len(self._ring)), min(end, self.end)
+        if lo < hi:
+            out[lo - start:hi - start] = self._ring[np.arange(lo, hi) % len(self._ring)]
+        return out
+
+
+def _rms(x):
+    return float(np.sqrt(np.mean(x * x))) if len(x) else 0.0
+
+
+class EchoSuppressor:
+    """`process(chunk, captured_at)` returns the mic chunk with the speaker's echo removed."""
+
+    def __init__(self, reference, mode="nlms", taps=512, mu=0.5, delay_ms=None, max_delay_ms=300,
+                 active_dbfs=-50.0, duck_ratio=3.0, residual_ratio=0.5, geigel=0.6):
+        self.reference = reference
+        self.rate = reference.rate
+        self.mode = mode
+        self.taps = taps
+        self.mu = mu
+        self.weights = np.zeros(taps + 1, dtype=np.complex128) # Echo path, as rfft bins of 2 * taps
+        self._power = np.zeros(taps + 1) # Smoothed reference power per bin, the "N" in NLMS
+        self.auto_delay = delay_ms is None
+        self.delay = 0 if delay_ms is None else int(delay_ms * self.rate / 1000) # Bulk delay, samples
+        self.max_delay = int(max_delay_ms * self.rate / 1000)
+        self.active_level = 10 ** (active_dbfs / 20) * 32768 # Reference quieter than this isn't echo-worthy
+        self.duck_ratio = duck_ratio # "duck": mic must be this much louder than the reference to pass
+        self.residual_ratio = residual_ratio # "nlms": gate if what's left is below this fraction of the echo
+        self.geigel = geigel # Double talk when the mic peaks above this fraction of the reference peak
+        self._history = collections.deque() # Last ~1 s of mic audio, contiguous, for the delay estimate
+        self._history_len = 0
+        self._candidate = None # Last delay estimate, samples
+        self.coupling = 1.0 # "duck": mic level / reference level when only the echo is heard
+        self._erle = collections.deque(maxlen=200) # ERLE (dB) of recent echo chunks, for stats()
+        self.counters = {"chunks": 0, "echo_chunks": 0, "suppressed_chunks": 0, "double_talk_chunks": 0,
+                         "filter_resets": 0, "delay_updates": 0}
+
+    def reset(self):
+        self.weights[:] = 0
+        self._power[:] = 0
+
+    def process(self, chunk, captured_at=None):
+        self.counters["chunks"] += 1
+        d = np.frombuffer(chunk, dtype="<i2").astype(np.float32)
+        n = len(d)
+        captured = self.reference.index(time.perf_counter() if captured_at is None else captured_at)
+        if self.auto_delay:
+            self._track_delay(d, captured)
+        end = captured - self.delay
+        x = self.reference.get(end - n - self.taps, end) # Chunk plus the filter's history
+        recent = x[self.taps:]
+        if _rms(recent) < self.active_level:
+            return chunk # Speaker quiet: nothing to remove
+        self.counters["echo_chunks"] += 1
+        if self.mode == "duck":
+            ratio = _rms(d) / _rms(recent)
+            if ratio < self.coupling:
+                self.coupling += 0.5 * (ratio - self.coupling) # Quieter than expected: that's the echo level
+            elif ratio < self.duck_ratio * self.coupling:
+                self.coupling += 0.02 * (ratio - self.coupling)
+            else:
+                return chunk # Clearly louder than the echo: the student is talking
+            self.counters["suppressed_chunks"] += 1
+            return bytes(len(chunk))
+        if n < self.taps:
+            return chunk # Shorter than one filter block; doesn't happen with CHUNK_SIZE reads
+        double_talk = np.max(np.abs(d)) > self.geigel * np.max(np.abs(x))
+        if double_talk:
+            self.counters["double_talk_chunks"] += 1
+        echo = np.empty(n, dtype=np.float32)
+        # Blocks of `taps` samples; the last one is aligned to the chunk's end and may overlap the one before
+        for start in sorted({*range(0, n - self.taps + 1, self.taps), n - self.taps}):
+            echo[start:start + self.taps] = self._block(x[start:start + 2 * self.taps], d[start:start + self.taps],
+                                                        adapt=not double_talk)
+        e = d - echo
+        if _rms(e) > 2 * _rms(d):
+            # Filter diverged (e.g. the echo path changed); start over rather than add noise
+            self.counters["filter_resets"] += 1
+            self.reset()
+            e = d
+        if not double_talk:
+            self._erle.append(10 * np.log10((_rms(d) ** 2 + 1e-9) / (_rms(e) ** 2 + 1e-9)))
+            if _rms(e) < self.residual_ratio * _rms(echo):
+                self.counters["suppressed_chunks"] += 1
+                return bytes(len(chunk))
+        return np.clip(np.rint(e), -32768, 32767).astype("<i2").tobytes()
+
+    def _block(self, x, d, adapt):
+        """One overlap-save step: `x` is 2 * taps reference samples ending with `d`'s; returns the echo estimate."""
+        X = np.fft.rfft(x)
+        echo = np.fft.irfft(X * self.weights)[self.taps:]
+        if adapt:
+            E = np.fft.rfft(np.concatenate((np.zeros(self.taps), d - echo)))
+            # Rises at once when the tutor starts talking, decays slowly: too small a power at an onset
+            # would scale the step up and throw the filter off
+            self._power = np.maximum(0.9 * self._power, np.abs(X) ** 2)
+            gradient = np.fft.irfft(np.conj(X) * E / (self._power + 1e-3 * self._power.mean() + 1.0))[:self.taps]
+            # Keep the filter causal and `taps` long (constrained FDAF)
+            self.weights += self.mu * np.fft.rfft(np.concatenate((gradient, np.zeros(self.taps))))
+        return echo
+
+    def _track_delay(self, d, captured):
+        """Re-estimate the bulk delay from ~1 s of mic and reference, by cross-correlation (GCC-PHAT)."""
+        self._history.append(d)
+        self._history_len += len(d)
+        if self._history_len < self.rate:
+            return
+        chunks = list(self._history)
+        mic = np.concatenate(chunks)
+        self._history.clear()
+        self._history_len = 0
+        ref = self.reference.get(captured - len(mic) - self.max_delay, captured)
+        if _rms(ref) < self.active_level:
+            return
+        # Skip windows with the student talking: their voice correlates with the tutor's at the wrong lag
+        start = 0
+        for chunk in chunks:
+            segment = np.abs(ref[start:start + self.max_delay + len(chunk)])
+            if _rms(chunk) > self.active_level and np.max(np.abs(chunk)) > self.geigel * np.max(segment):
+                return
+            start += len(chunk)
+        size = 1 << (len(ref) + len(mic)).bit_length()
+        cross = np.fft.rfft(ref, size) * np.conj(np.fft.rfft(mic, size))
+        corr = np.fft.irfft(cross / (np.abs(cross) + 1e-9), size)
+        # corr[k] peaks where the mic matches the reference from max_delay - k samples earlier
+        lags = corr[:self.max_delay + 1][::-1]
+        best = int(np.argmax(np.abs(lags)))
+        if np.abs(lags[best]) > 8 * np.mean(np.abs(lags)):
+            delay = max(0, best - self.taps // 8) # Leave a little room for the direct path inside the taps
+            # Move only when two estimates in a row agree: one window of double talk can fool it
+            if abs(delay - self.delay) > self.taps // 8 and self._candidate is not None \
+                    and abs(delay - self._candidate) <= self.taps // 16:
+                self.delay = delay
+                self.counters["delay_updates"] += 1
+                self.reset()
+            self._candidate = delay
+
+    def stats(self):
+        return dict(self.counters, mode=self.mode, coupling=round(self.coupling, 3), delay_ms=round(self.delay * 1000 / self.rate, 1),
+                    erle_db=round(float(np.median(self._erle)), 1) if self._erle else None)
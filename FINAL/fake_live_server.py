@@ -0,0 +1,380 @@
+"""
+## Local stand-in for the Gemini Live API
+Speaks enough of the BidiGenerateContent websocket protocol for the native
+host to run end to end without network access or an API key:
+
+- acknowledges `setup` with `setupComplete`
+- accepts `realtime_input` audio/image chunks and `client_content` turns
+- answers with canned 24 kHz PCM in `serverContent.modelTurn` chunks, paced at
+  a configurable multiple of real time (optionally with random network jitter),
+  then `turnComplete`
+- treats loud mic audio, or any client content (even an empty, incomplete
+  turn), during a reply as barge-in and sends `interrupted`
+- hands out `sessionResumptionUpdate` handles and restores state when a new
+  connection presents one; `drop_connections()`, `reject_next` and
+  `drop_next` simulate outages
+
+A turn starts when the client completes a turn, sends text after an image
+(the host's "Please analyze the image" kick-off), or stops talking.
+
+Point the host at it with GEMINI_BASE_URL / GEMINI_CA_FILE (the SDK always
+uses wss://, so the server runs TLS with a throwaway self-signed cert):
+
+    python fake_live_server.py --port 8765
+"""
+
+import argparse
+import array
+import asyncio
+import base64
+import datetime
+import ipaddress
+import json
+import logging
+import math
+import os
+import random
+import ssl
+import tempfile
+import time
+import uuid
+
+import websockets
+
+from virtual_audio import tone_pcm
+
+logger = logging.getLogger(__name__)
+
+RECEIVE_SAMPLE_RATE = 24000
+BYTES_PER_SAMPLE = 2
+
+
+def make_self_signed_cert(directory):
+    """Write a localhost cert/key pair into `directory`. Returns (cert_path, key_path)."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([
+            x509.DNSName("localhost"),
+            x509.IPAddress(ipaddress.ip_address("127.0.0.1")),
+        ]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, "fake_live_cert.pem")
+    key_path = os.path.join(directory, "fake_live_key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+def pcm_rms(data):
+    """RMS of 16-bit little-endian PCM, on a subsample to keep the server cheap."""
+    samples = array.array('h')
+    samples.frombytes(data[:len(data) - len(data) % 2])
+    if not samples:
+        return 0.0
+    step = max(1, len(samples) // 256)
+    picked = samples[::step]
+    return math.sqrt(sum(s * s for s in picked) / len(picked))
+
+
+def _get(d, snake, camel):
+    return d.get(snake, d.get(camel))
+
+
+class FakeLiveServer:
+    """In-process fake Live server. Timestamps (perf_counter) land in `events`."""
+
+    def __init__(self, host="127.0.0.1", port=0, reply_seconds=3.0, chunk_ms=40, realtime_factor=1.0,
+                 speech_rms=500.0, end_of_speech_ms=300, reply_pcm=None, setup_delay_ms=0, resumable=True,
+                 jitter_ms=0.0):
+        self.host = host
+        self.port = port
+        self.reply_seconds = reply_seconds
+        self.chunk_ms = chunk_ms
+        self.realtime_factor = realtime_factor # 1.0 = real time, 0 = as fast as the socket allows
+        self.speech_rms = speech_rms
+        self.end_of_speech_ms = end_of_speech_ms
+        self.reply_pcm = reply_pcm
+        self.setup_delay_ms = setup_delay_ms # Stands in for real handshake/setup latency
+        self.resumable = resumable # Hand out session resumption handles when the client asks
+        self.jitter_ms = jitter_ms # Each paced chunk goes out up to this much late, as over a jittery network
+        self.rng = random.Random(0)
+        self.reject_next = 0 # Refuse this many upcoming setups, as an overloaded server would
+        self.drop_next = 0 # Accept this many upcoming setups, then close them straight away
+        self.resume_states = {} # Resumption handle -> session state to restore
+        self.events = []
+        self.counters = {"sessions": 0, "turns": 0, "interruptions": 0, "audio_bytes_in": 0,
+                         "audio_chunks_in": 0, "images_in": 0, "texts_in": 0, "audio_bytes_out": 0,
+                         "dropped": 0, "rejected": 0, "dropped_after_setup": 0, "resumed": 0}
+        self._sessions = set()
+        self.cert_path = None
+        self._server = None
+        self._tempdir = None
+
+    def record(self, name, **fields):
+        self.events.append((name, time.perf_counter(), fields))
+
+    def last_event(self, name, after=0.0):
+        for event_name, at, fields in reversed(self.events):
+            if event_name == name and at >= after:
+                return at
+        return None
+
+    async def wait_for_event(self, name, after=0.0, timeout=10.0):
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            at = self.last_event(name, after)
+            if at is not None:
+                return at
+            await asyncio.sleep(0.002)
+        raise asyncio.TimeoutError(f"No {name} event within {timeout}s")
+
+    @property
+    def base_url(self):
+        return f"https://127.0.0.1:{self.port}"
+
+    async def start(self):
+        self._tempdir = tempfile.TemporaryDirectory(prefix="fake_live_")
+        self.cert_path, key_path = make_self_signed_cert(self._tempdir.name)
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(self.cert_path, key_path)
+        self._server = await websockets.serve(self._handle, self.host, self.port, ssl=ssl_context,
+                                              max_size=None, compression=None)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Fake Live server listening on {self.base_url}")
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._tempdir is not None:
+            self._tempdir.cleanup()
+            self._tempdir = None
+
+    async def drop_connections(self):
+        """Cut every open connection without a close handshake, like a network drop."""
+        for session in list(self._sessions):
+            self.counters["dropped"] += 1
+            self.record("dropped")
+            session.ws.transport.abort()
+
+    async def _handle(self, ws):
+        session = _FakeSession(self, ws)
+        self.counters["sessions"] += 1
+        self.record("connect")
+        self._sessions.add(session)
+        try:
+            await session.run()
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._sessions.discard(session)
+            await session.stop_reply()
+            self.record("disconnect")
+
+
+class _FakeSession:
+    """State for one websocket connection."""
+
+    def __init__(self, server, ws):
+        self.server = server
+        self.ws = ws
+        self.has_image = False
+        self.reply_task = None
+        self.speaking = False
+        self.speech_timer = None
+        self.resumable = False
+
+    async def run(self):
+        setup = json.loads(await self.ws.recv())
+        if "setup" not in setup:
+            await self.ws.close(1007, "Expected setup message")
+            return
+        if self.server.setup_delay_ms:
+            await asyncio.sleep(self.server.setup_delay_ms / 1000)
+        if self.server.reject_next:
+            self.server.reject_next -= 1
+            self.server.counters["rejected"] += 1
+            self.server.record("rejected")
+            await self.ws.close(1013, "Try again later")
+            return
+        resumption = _get(setup["setup"], "session_resumption", "sessionResumption")
+        self.resumable = resumption is not None and self.server.resumable
+        handle = (resumption or {}).get("handle")
+        if self.resumable and handle in self.server.resume_states:
+            self.has_image = self.server.resume_states[handle]["has_image"]
+            self.server.counters["resumed"] += 1
+            self.server.record("resumed")
+        await self.ws.send(json.dumps({"setupComplete": {}}))
+        self.server.record("setup_complete")
+        if self.server.drop_next:
+            # Like a server that takes the connection but then rejects what the client replays on it
+            self.server.drop_next -= 1
+            self.server.counters["dropped_after_setup"] += 1
+            self.server.record("dropped_after_setup")
+            await self.ws.close(1011, "Internal error")
+            return
+        await self._send_resumption_update()
+        async for raw in self.ws:
+            message = json.loads(raw)
+            realtime = _get(message, "realtime_input", "realtimeInput")
+            content = _get(message, "client_content", "clientContent")
+            if realtime is not None:
+                await self._on_realtime(realtime)
+            if content is not None:
+                await self._on_content(content)
+
+    async def _on_realtime(self, realtime):
+        chunks = list(_get(realtime, "media_chunks", "mediaChunks") or [])
+        for key in ("audio", "video", "media"):
+            if realtime.get(key):
+                chunks.append(realtime[key])
+        for chunk in chunks:
+            mime_type = _get(chunk, "mime_type", "mimeType") or ""
+            # The SDK may send URL-safe base64; altchars accepts both alphabets
+            data = base64.b64decode(chunk.get("data", ""), altchars=b'-_')
+            if mime_type.startswith("image/"):
+                self.has_image = True
+                self.server.counters["images_in"] += 1
+                self.server.record("image_in", bytes=len(data))
+                await self._send_resumption_update()
+            elif mime_type.startswith("audio/"):
+                self.server.counters["audio_bytes_in"] += len(data)
+                self.server.counters["audio_chunks_in"] += 1
+                self.server.record("audio_in", bytes=len(data))
+                if pcm_rms(data) >= self.server.speech_rms:
+                    await self._on_speech()
+
+    async def _on_content(self, content):
+        turns = content.get("turns") or []
+        texts = [part["text"] for turn in turns for part in turn.get("parts", []) if "text" in part]
+        self.server.counters["texts_in"] += len(texts)
+        if texts:
+            self.server.record("text_in")
+        # Like the real API, any client content cuts off the reply in progress
+        await self._interrupt_reply()
+        if _get(content, "turn_complete", "turnComplete") or (texts and self.has_image):
+            self._start_reply()
+
+    async def _on_speech(self):
+        if not self.speaking:
+            self.speaking = True
+            self.server.record("speech_start")
+            await self._interrupt_reply()
+        # Reply once the speaker has been quiet for end_of_speech_ms
+        if self.speech_timer:
+            self.speech_timer.cancel()
+        self.speech_timer = asyncio.get_running_loop().call_later(
+            self.server.end_of_speech_ms / 1000, self._on_speech_end)
+
+    async def _send_resumption_update(self):
+        if not self.resumable:
+            return
+        handle = uuid.uuid4().hex
+        self.server.resume_states[handle] = {"has_image": self.has_image}
+        await self.ws.send(json.dumps({"sessionResumptionUpdate": {"newHandle": handle, "resumable": True}}))
+
+    async def _interrupt_reply(self):
+        if self.reply_task and not self.reply_task.done():
+            await self.stop_reply()
+            self.server.counters["interruptions"] += 1
+            await self.ws.send(json.dumps({"serverContent": {"interrupted": True}}))
+            self.server.record("interrupted")
+
+    def _on_speech_end(self):
+        self.speaking = False
+        self.server.record("speech_end")
+        self._start_reply()
+
+    def _start_reply(self):
+        if self.reply_task and not self.reply_task.done():
+            return
+        self.reply_task = asyncio.create_task(self._reply())
+
+    async def stop_reply(self):
+        if self.speech_timer:
+            self.speech_timer.cancel()
+        if self.reply_task and not self.reply_task.done():
+            self.reply_task.cancel()
+            try:
+                await self.reply_task
+            except asyncio.CancelledError:
+                pass
+
+    async def _reply(self):
+        server = self.server
+        server.counters["turns"] += 1
+        pcm = server.reply_pcm or tone_pcm(RECEIVE_SAMPLE_RATE, 220.0, server.reply_seconds)
+        chunk_bytes = int(RECEIVE_SAMPLE_RATE * server.chunk_ms / 1000) * BYTES_PER_SAMPLE
+        server.record("turn_start")
+        await self.ws.send(json.dumps({"serverContent": {"outputTranscription": {
+            "text": f"Let's work through problem {server.counters['turns']} together."}}}))
+        started = time.perf_counter()
+        for offset in range(0, len(pcm), chunk_bytes):
+            chunk = pcm[offset:offset + chunk_bytes]
+            if server.realtime_factor:
+                # Pace against the audio clock; realtime_factor 2.0 streams twice as fast as playback
+                due = started + (offset / BYTES_PER_SAMPLE / RECEIVE_SAMPLE_RATE) / server.realtime_factor
+                due += server.rng.uniform(0, server.jitter_ms) / 1000
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await self.ws.send(json.dumps({"serverContent": {"modelTurn": {"parts": [{"inlineData": {
+                "mimeType": f"audio/pcm;rate={RECEIVE_SAMPLE_RATE}",
+                "data": base64.b64encode(chunk).decode(),
+            }}]}}}))
+            server.counters["audio_bytes_out"] += len(chunk)
+            if offset == 0:
+                server.record("first_audio_out")
+        await self.ws.send(json.dumps({"serverContent": {"turnComplete": True}}))
+        server.record("turn_complete")
+        await self._send_resumption_update()
+
+
+async def _serve_forever(args):
+    server = FakeLiveServer(port=args.port, reply_seconds=args.reply_seconds, chunk_ms=args.chunk_ms,
+                            realtime_factor=args.realtime_factor, setup_delay_ms=args.setup_delay_ms,
+                            resumable=not args.no_resumption, jitter_ms=args.jitter_ms)
+    await server.start()
+    print(f"GEMINI_BASE_URL={server.base_url}")
+    print(f"GEMINI_CA_FILE={server.cert_path}")
+    try:
+        await asyncio.Future()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake Gemini Live API server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--reply-seconds", type=float, default=3.0, help="Length of each canned reply")
+    parser.add_argument("--chunk-ms", type=int, default=40, help="Audio per serverContent message")
+    parser.add_argument("--realtime-factor", type=float, default=1.0, help="Reply pacing, 0 = unpaced")
+    parser.add_argument("--setup-delay-ms", type=float, default=0, help="Delay before setupComplete")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Random extra delay per reply chunk, up to this")
+    parser.add_argument("--no-resumption", action="store_true", help="Never hand out resumption handles")
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_serve_forever(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
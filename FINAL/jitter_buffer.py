@@ -0,0 +1,142 @@
+"""
+## Adaptive jitter buffer for model audio
+Model audio arrives in bursts; written to the speaker the moment it arrives,
+every late chunk is an underrun (a click, or a gap mid-word). JitterBuffer
+holds the start of each reply until `target_ms` of it has arrived, so later
+chunks have that much slack to be late by.
+
+The target adapts: an underrun mid-reply grows it by `grow_ms` (and playback
+waits for the bigger pre-buffer before going on); `stable_seconds` of playback
+with at least `shrink_ms` of slack to spare shrinks it by `shrink_ms`. Every
+millisecond of target is a millisecond added to time to first audio, so the
+stats report both sides: underruns and starved time, depth, and the latency
+the pre-buffer added.
+
+receive_audio reports arrivals and turn ends, play_audio calls `before_write`
+ahead of each write to the PlaybackEngine, and an interruption calls `flush`. Sizes are in bytes of 16-bit mono PCM at `rate`.
+"""
+
+import asyncio
+import collections
+import time
+
+from metrics import LatencyHistogram
+
+
+class JitterBuffer:
+    """Pre-buffer policy for one output stream; the audio itself stays in play_audio's queue."""
+
+    def __init__(self, rate, initial_ms=80, min_ms=40, max_ms=500, grow_ms=60, shrink_ms=20, stable_seconds=10.0):
+        self.bytes_per_ms = rate * 2 / 1000
+        self.target_ms = initial_ms
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.grow_ms = grow_ms
+        self.shrink_ms = shrink_ms
+        self.stable_seconds = stable_seconds
+        self._arrived = 0 # Stream byte positions: arrived from the server, handed to the speaker
+        self._written = 0
+        self._turn_ends = collections.deque() # Positions where a reply ended
+        self._played_until = None # perf_counter() when the speaker runs out of what it was given
+        self._priming = True
+        self._ready = asyncio.Event()
+        self._flushes = 0 # A before_write waiting across a flush() gives up
+        self._stable_since = None # Start of the current run of playback without underruns
+        self._min_slack_ms = None # Least slack seen in that run
+        self.depth = LatencyHistogram() # Audio queued and in the device, in ms, at each write
+        self.added_latency = LatencyHistogram() # Time spent waiting for the pre-buffer
+        self.counters = {"replies": 0, "underruns": 0, "starved_ms": 0.0, "target_grows": 0, "target_shrinks": 0,
+                         "prebuffer_timeouts": 0}
+
+    def _ms(self, nbytes):
+        return nbytes / self.bytes_per_ms
+
+    def _reply_complete(self):
+        return any(end > self._written for end in self._turn_ends)
+
+    def _check_ready(self):
+        if self._ms(self._arrived - self._written) >= self.target_ms or self._reply_complete():
+            self._ready.set()
+
+    def arrived(self, nbytes):
+        """A chunk of model audio came in from the server."""
+        if not self._arrived or (self._turn_ends and self._turn_ends[-1] == self._arrived):
+            self.counters["replies"] += 1
+        self._arrived += nbytes
+        self._check_ready()
+
+    def end_turn(self):
+        """The server finished the reply: whatever has arrived is all there will be."""
+        if not self._turn_ends or self._turn_ends[-1] != self._arrived:
+            self._turn_ends.append(self._arrived)
+        self._ready.set()
+
+    def flush(self):
+        """Playback was interrupted and everything queued discarded."""
+        self._written = self._arrived
+        self._turn_ends.clear()
+        self._turn_ends.append(self._arrived)
+        self._played_until = None
+        self._priming = True
+        self._flushes += 1
+        self._ready.set() # Wakes a waiting before_write, which sees the flush
+
+    async def before_write(self, nbytes):
+        """Wait, if need be, until the pre-buffer is full; then account for `nbytes` going to the speaker.
+
+        Returns False, without accounting for them, if flush() was called meanwhile.
+        """
+        flushes = self._flushes
+        now = time.perf_counter()
+        while self._turn_ends and self._turn_ends[0] < self._written:
+            self._turn_ends.popleft()
+        reply_start = not self._written or (self._turn_ends and self._turn_ends[0] == self._written)
+        if self._played_until is None or now > self._played_until:
+            if self._played_until is not None and not reply_start:
+                # Ran dry mid-reply: the audio was later than the buffer allowed for
+                self.counters["underruns"] += 1
+                self.counters["starved_ms"] += (now - self._played_until) * 1000
+                if self.target_ms < self.max_ms:
+                    self.target_ms = min(self.max_ms, self.target_ms + self.grow_ms)
+                    self.counters["target_grows"] += 1
+                self._stable_since = None
+            self._priming = True
+        if self._priming:
+            self._priming = False
+            self._ready.clear()
+            self._check_ready()
+            if not self._ready.is_set():
+                try:
+                    # Never hold longer than max_ms: beyond that, delivery is slower than playback anyway
+                    await asyncio.wait_for(self._ready.wait(), self.max_ms / 1000)
+                except asyncio.TimeoutError:
+                    self.counters["prebuffer_timeouts"] += 1
+                if self._flushes != flushes:
+                    return False
+                self.added_latency.record_since(now)
+            else:
+                self.added_latency.record(0.0)
+            now = time.perf_counter()
+            self._played_until = now
+        slack_ms = (self._played_until - now) * 1000 + self._ms(self._arrived - self._written)
+        self.depth.record(slack_ms)
+        self._written += nbytes
+        self._played_until += self._ms(nbytes) / 1000
+        self._adapt_down(now, slack_ms)
+        return True
+
+    def _adapt_down(self, now, slack_ms):
+        if self._stable_since is None:
+            self._stable_since, self._min_slack_ms = now, slack_ms
+            return
+        self._min_slack_ms = min(self._min_slack_ms, slack_ms)
+        if now - self._stable_since >= self.stable_seconds:
+            if self._min_slack_ms > 2 * self.shrink_ms and self.target_ms > self.min_ms:
+                self.target_ms = max(self.min_ms, self.target_ms - self.shrink_ms)
+                self.counters["target_shrinks"] += 1
+            self._stable_since, self._min_slack_ms = now, slack_ms
+
+    def stats(self):
+        return dict(self.counters, starved_ms=round(self.counters["starved_ms"], 1), target_ms=self.target_ms,
+                    queued_ms=round(self._ms(self._arrived - self._written), 1), depth=self.depth.snapshot(),
+                    added_latency=self.added_latency.snapshot())
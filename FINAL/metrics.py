@@ -0,0 +1,135 @@
+"""
+## Lightweight latency metrics for the native host
+Fixed log-spaced histograms: recording is O(1) with no allocation, and
+percentiles are read from bucket counts, so they're cheap enough to keep on
+every hot path and to report back to the extension on request.
+"""
+
+import bisect
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+# 0.01 ms .. ~100 s, 20 buckets per decade (~12% bucket width)
+_BUCKETS_PER_DECADE = 20
+_MIN_MS = 0.01
+_BUCKET_BOUNDS = [_MIN_MS * 10 ** (i / _BUCKETS_PER_DECADE) for i in range(7 * _BUCKETS_PER_DECADE + 1)]
+
+
+class LatencyHistogram:
+    """Histogram of latencies in milliseconds."""
+
+    def __init__(self):
+        self.reset()
+
+    def record(self, ms):
+        self.counts[bisect.bisect_left(_BUCKET_BOUNDS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def record_since(self, start):
+        """Record the time elapsed since a `time.perf_counter()` stamp."""
+        self.record((time.perf_counter() - start) * 1000)
+
+    def percentile(self, pct):
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * pct / 100)
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                if index >= len(_BUCKET_BOUNDS):
+                    return self.max_ms
+                # Report the bucket's upper bound, capped by the largest value seen
+                return min(_BUCKET_BOUNDS[index], self.max_ms)
+        return self.max_ms
+
+    def reset(self):
+        self.counts = [0] * (len(_BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50), 3),
+            "p95_ms": round(self.percentile(95), 3),
+            "p99_ms": round(self.percentile(99), 3),
+            "max_ms": round(self.max_ms, 3),
+        }
+
+
+class LatencyTracer:
+    """Per-capture trace from the extension's capture to the first audible sample.
+
+    `start()` opens a trace when an image arrives; pipeline stages call `mark()`
+    and only the first mark of each stage counts. Stages are taken in order: a
+    mark is ignored until the stage before it has been marked, so audio from an
+    earlier reply can't close the trace early. Each stage is recorded as the
+    time since the previous stage, so the histograms show where time goes.
+    """
+
+    STAGES = (
+        "received",        # Capture in the extension -> message read by the host
+        "image_prepared",  # Decode + verify
+        "connected",       # client.aio.live.connect handshake + setup
+        "first_send",      # First session.send completed
+        "first_response",  # First response.data from the model
+        "first_audio",     # First stream.write to the output device
+    )
+
+    def __init__(self):
+        self.histograms = {stage: LatencyHistogram() for stage in self.STAGES}
+        self.histograms["host_total"] = LatencyHistogram() # Message read -> first audio
+        self.histograms["end_to_end"] = LatencyHistogram() # Capture -> first audio
+        self.trace_id = None
+        self.label = None
+        self._marks = {}
+        self._last_mark = None
+        self._captured_at = None
+
+    def start(self, trace_id=None, captured_at_ms=None):
+        """Begin a trace. `captured_at_ms` is the extension's Date.now() at capture."""
+        now = time.perf_counter()
+        self.trace_id = trace_id
+        self.label = None
+        self._marks = {"received": now}
+        self._last_mark = now
+        self._captured_at = None
+        if captured_at_ms is not None:
+            # Chrome and the host share a wall clock; convert the capture time onto perf_counter
+            waited_ms = max(0.0, time.time() * 1000 - captured_at_ms)
+            self._captured_at = now - waited_ms / 1000
+            self.histograms["received"].record(waited_ms)
+
+    def tag(self, label):
+        """Label the current trace (e.g. which session path it took); host_total is also kept per label."""
+        self.label = label
+
+    def mark(self, stage):
+        if not self._marks or stage in self._marks:
+            return
+        if self.STAGES[self.STAGES.index(stage) - 1] not in self._marks:
+            return
+        now = time.perf_counter()
+        self._marks[stage] = now
+        self.histograms[stage].record((now - self._last_mark) * 1000)
+        self._last_mark = now
+        if stage == self.STAGES[-1]:
+            self.histograms["host_total"].record((now - self._marks["received"]) * 1000)
+            if self.label:
+                self.histograms.setdefault(f"host_total:{self.label}", LatencyHistogram()).record(
+                    (now - self._marks["received"]) * 1000)
+            if self._captured_at is not None:
+                self.histograms["end_to_end"].record((now - self._captured_at) * 1000)
+            logger.info(f"Trace {self.trace_id}: first audio {(now - self._marks['received']) * 1000:.1f} ms after image arrived")
+
+    def snapshot(self):
+        return {stage: histogram.snapshot() for stage, histogram in self.histograms.items()}
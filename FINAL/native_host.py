@@ -7,27 +7,45 @@ and uses Gemini's real-time API to provide interactive audio tutoring.
 Based on Gemini LiveAPI Quickstart: https://github.com/google-gemini/cookbook/blob/main/quickstarts/Get_started_LiveAPI.py
 
 ## Setup
-Install dependencies: pip install google-genai pyaudio pillow python-dotenv
+Install dependencies: pip install google-genai pyaudio pillow python-dotenv numpy
 Create .env file: GOOGLE_API_KEY=YOUR_API_KEY_HERE
 Register native host manifest (see documentation).
+Headless runs: AI_TUTOR_AUDIO=virtual, and GEMINI_BASE_URL/GEMINI_CA_FILE to use fake_live_server.py.
 """
 
 import asyncio
-import base64
+import binascii
+import collections
+import contextlib
 import io
+import random
 import traceback
 import os
 import sys
-import json
 import logging
-import struct # For native messaging length prefix
+import ssl
+import time
 from dotenv import load_dotenv
 
-import pyaudio
 import PIL.Image
 from google import genai
 from google.genai import types
 
+from audio_buffer import AudioBuffer
+from audio_capture import MicCapture
+from audio_devices import create_sink, create_source
+from audio_tap import SessionTap
+from device_manager import DeviceManager
+from echo import EchoReference, EchoSuppressor
+from jitter_buffer import JitterBuffer
+from metrics import LatencyHistogram, LatencyTracer
+from native_messaging import NativeMessageReader, NativeMessageWriter
+from outbound_queue import OutboundQueue, message_kind
+from playback import PlaybackEngine
+from resample import PolyphaseResampler
+from session_pool import LiveSessionPool, SessionLifecycle, SessionUsage, Transcript, is_session_open
+from vad import VoiceGate
+
 # --- Native Messaging Helpers ---\n
 
 # Configure logging to a file for debugging native host
@@ -38,41 +56,6 @@ logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Function to read a message from standard input
-def read_native_message():
-    try:
-        text_length_bytes = sys.stdin.buffer.read(4)
-        if not text_length_bytes:
-            logger.info("No more data from stdin, exiting read loop.")
-            return None # End of stream
-        text_length = struct.unpack('@I', text_length_bytes)[0]
-        message_bytes = sys.stdin.buffer.read(text_length)
-        message_json = message_bytes.decode('utf-8')
-        message = json.loads(message_json)
-        logger.info(f"Received message: Type={message.get('type', 'N/A')}, Length={text_length}")
-        return message
-    except struct.error as e:
-        logger.error(f"Error unpacking message length: {e}")
-        return None
-    except json.JSONDecodeError as e:
-        logger.error(f"Error decoding JSON message: {e} - Received: {message_bytes.decode('utf-8', errors='ignore')}")
-        return None
-    except Exception as e:
-         logger.error(f"Unexpected error reading native message: {e}", exc_info=True)
-         return None
-
-# Function to send a message to standard output (optional for now)
-def send_native_message(message):
-    try:
-        message_json = json.dumps(message).encode('utf-8')
-        message_length = len(message_json)
-        sys.stdout.buffer.write(struct.pack('@I', message_length))
-        sys.stdout.buffer.write(message_json)
-        sys.stdout.buffer.flush()
-        logger.info(f"Sent message: {message}")
-    except Exception as e:
-         logger.error(f"Error sending native message: {e}", exc_info=True)
-
 # --- End Native Messaging Helpers ---\n
 
 
@@ -82,13 +65,78 @@ load_dotenv()
 # Settings
 API_KEY = os.getenv("GOOGLE_API_KEY")
 MODEL_NAME = "models/gemini-2.0-flash-live-001"
+# Overrides for running against fake_live_server.py instead of Google
+BASE_URL = os.getenv("GEMINI_BASE_URL")
+CA_FILE = os.getenv("GEMINI_CA_FILE")
+# Idle prewarmed sessions are recycled after this many seconds
+PREWARM_TTL = float(os.getenv("AI_TUTOR_PREWARM_TTL", "60"))
+# "Switch problem" mode: new images go into the live session instead of reconnecting
+SWITCH_MODE = os.getenv("AI_TUTOR_SWITCH_MODE", "1") != "0"
+SWITCH_MAX_TOKENS = int(os.getenv("AI_TUTOR_SWITCH_MAX_TOKENS", "24000")) # Reconnect before the context fills
+SWITCH_MAX_AGE = float(os.getenv("AI_TUTOR_SWITCH_MAX_AGE", "600")) # Seconds; stay clear of session time limits
+# Reconnecting after a dropped connection
+RECONNECT_ATTEMPTS = int(os.getenv("AI_TUTOR_RECONNECT_ATTEMPTS", "6"))
+RECONNECT_BASE_DELAY = 0.25 # Seconds before the second attempt; doubles each time, with jitter
+RECONNECT_MAX_DELAY = 8.0
+# Attempts and backoff carry over from one drop to the next until a session stays up this long (seconds)
+RECONNECT_STABLE_SECONDS = float(os.getenv("AI_TUTOR_RECONNECT_STABLE_S", "15"))
 
 # Audio settings
-FORMAT = pyaudio.paInt16
+AUDIO_BACKEND = os.getenv("AI_TUTOR_AUDIO", "pyaudio") # "virtual": shorthand for a virtual mic and speaker
+VIRTUAL_MIC = os.getenv("AI_TUTOR_VIRTUAL_MIC", "tone") # "tone", "bursts" or "null"
+# Where mic audio comes from and model audio goes, as audio_devices.py specs (e.g. "wav:question.wav")
+AUDIO_SOURCE = os.getenv("AI_TUTOR_AUDIO_SOURCE", VIRTUAL_MIC if AUDIO_BACKEND == "virtual" else "pyaudio")
+AUDIO_SINK = os.getenv("AI_TUTOR_AUDIO_SINK", "null" if AUDIO_BACKEND == "virtual" else "pyaudio")
 CHANNELS = 1
 SEND_SAMPLE_RATE = 16000
 RECEIVE_SAMPLE_RATE = 24000
+# Open the mic and speaker at their own sample rates and resample here, rather than
+# forcing 16/24 kHz on devices that may refuse it or resample slowly in the driver
+NATIVE_RATES = os.getenv("AI_TUTOR_NATIVE_RATES", "1") != "0"
+# A running mic or speaker stream without callbacks for this long lost its device; both are reopened on the default
+AUDIO_STALL_SECONDS = float(os.getenv("AI_TUTOR_AUDIO_STALL_S", "2"))
+# While the mic is muted and nothing plays, check this often whether the system's default devices moved; 0 = never
+AUDIO_DEFAULT_POLL_SECONDS = float(os.getenv("AI_TUTOR_AUDIO_DEFAULT_POLL_S", "5"))
 CHUNK_SIZE = 1024
+# PortAudio callback period; independent of CHUNK_SIZE, the size of each chunk sent upstream
+FRAMES_PER_BUFFER = int(os.getenv("AI_TUTOR_FRAMES_PER_BUFFER", str(CHUNK_SIZE)))
+# The input stream is stopped while muted; restarting it should take no longer than this
+MIC_RESTART_TARGET_MS = float(os.getenv("AI_TUTOR_MIC_RESTART_TARGET_MS", "120"))
+# Audio kept from just before unmute and sent ahead of live audio. Opt-in: keeping it means the device runs for as
+# long as the mic is muted; at 0 (the default) the device is stopped while muted instead
+PREROLL_MS = int(os.getenv("AI_TUTOR_PREROLL_MS", "0"))
+# send_realtime joins queued mic chunks into one message for up to this long / this many bytes; 0 ms sends each chunk
+AUDIO_COALESCE_MS = float(os.getenv("AI_TUTOR_AUDIO_COALESCE_MS", "0"))
+AUDIO_COALESCE_BYTES = int(os.getenv("AI_TUTOR_AUDIO_COALESCE_BYTES", "16384"))
+# Byte bounds for the outbound lanes; only audio is dropped (oldest first), the others make put() wait
+OUT_QUEUE_MAX_BYTES = {
+    "control": int(os.getenv("AI_TUTOR_OUT_CONTROL_BYTES", str(256 * 1024))),
+    "image": int(os.getenv("AI_TUTOR_OUT_IMAGE_BYTES", str(8 * 1024 * 1024))),
+    "audio": int(os.getenv("AI_TUTOR_OUT_AUDIO_MS", "1000")) * SEND_SAMPLE_RATE * 2 // 1000,
+}
+# Adaptive pre-buffer ahead of the speaker (jitter_buffer.py), ms of audio; AI_TUTOR_JITTER_MS=0 plays on arrival
+# (underruns are still counted)
+JITTER_INITIAL_MS = int(os.getenv("AI_TUTOR_JITTER_MS", "80"))
+JITTER_MIN_MS = int(os.getenv("AI_TUTOR_JITTER_MIN_MS", "40"))
+JITTER_MAX_MS = int(os.getenv("AI_TUTOR_JITTER_MAX_MS", "500"))
+# Speaker callback period at 24 kHz (scaled to the device rate): a barge-in is silent within one period of it
+PLAYBACK_FRAMES_PER_BUFFER = int(os.getenv("AI_TUTOR_PLAYBACK_FRAMES_PER_BUFFER", "512"))
+# Model audio held ahead of the speaker (audio_buffer.py), in ms; past it, receive_audio waits for playback
+PLAYBACK_BUFFER_MS = int(os.getenv("AI_TUTOR_PLAYBACK_BUFFER_MS", "30000"))
+PLAYBACK_READ_PERIODS = 4 # play_audio moves this many speaker periods per pass
+PLAYBACK_IDLE_STOP_SECONDS = float(os.getenv("AI_TUTOR_PLAYBACK_IDLE_STOP_S", "2")) # Stop the stream when idle this long
+# Remove the speaker's echo from the mic before the voice gate (echo.py): "nlms", "duck" or "off"
+ECHO_SUPPRESSION = os.getenv("AI_TUTOR_ECHO", "nlms")
+ECHO_DELAY_MS = os.getenv("AI_TUTOR_ECHO_DELAY_MS") # Speaker -> mic delay; unset = estimate it while the tutor talks
+# Voice-activity gate on the mic stream: "energy", "webrtc" or "off"
+VAD_BACKEND = os.getenv("AI_TUTOR_VAD", "energy")
+VAD_HANGOVER_MS = int(os.getenv("AI_TUTOR_VAD_HANGOVER_MS", "500"))
+VAD_PRE_PADDING_MS = int(os.getenv("AI_TUTOR_VAD_PRE_PADDING_MS", "200"))
+VAD_SILENCE = os.getenv("AI_TUTOR_VAD_SILENCE", "keepalive") # "keepalive" or "drop"
+# Record mic and model audio to memory-mapped WAV rings under this directory (see tap_report.py); unset = off
+AUDIO_TAP_DIR = os.getenv("AI_TUTOR_AUDIO_TAP_DIR")
+AUDIO_TAP_SECONDS = int(os.getenv("AI_TUTOR_AUDIO_TAP_SECONDS", "300")) # Ring length per track
+GAP_BUFFER_CHUNKS = int(5 * SEND_SAMPLE_RATE / CHUNK_SIZE) # ~5 s of mic audio kept while reconnecting
 
 # Define tutor prompt for direct interaction
 TUTOR_PROMPT = """
@@ -107,7 +155,20 @@ You are an intelligent, engaging, and compassionate AI tutor with expertise in m
 Start by carefully analyzing the image in front of you. Offer an initial audio explanation that describes the problem, suggests possible approaches, and invites the student to engage by asking, “What do you think might be the best way to start?”.
 """
 
+# Replayed into a new session when a dropped one can't be resumed
+RESUME_PROMPT = """
+We got disconnected for a moment. This is what was said so far about the problem in the image:
+{transcript}
+Carry on from where we left off, without repeating your introduction.
+"""
+
+# Sent with each new image when the session is reused for the next problem
+SWITCH_PROMPT = """
+The student has moved on to a new problem, shown in the image just sent. Stop discussing the previous problem and set it aside completely. Follow the same tutoring approach as before: analyze the new image, describe what you see, and start guiding me via audio.
+"""
 
+# An empty, unfinished client turn: any client content makes the Live API stop the reply it is generating
+STOP_GENERATION = types.LiveClientContent(turn_complete=False)
 
 # Configuration for the Live API
 LIVE_CONFIG = types.LiveConnectConfig(
@@ -117,6 +178,11 @@ LIVE_CONFIG = types.LiveConnectConfig(
             prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name="Puck")
         )
     ),
+    # Lets a dropped connection be resumed with its context
+    session_resumption=types.SessionResumptionConfig(),
+    # Transcripts are kept so a session that can't be resumed can be replayed
+    input_audio_transcription=types.AudioTranscriptionConfig(),
+    output_audio_transcription=types.AudioTranscriptionConfig(),
 )
 
 class GeminiTutorNativeHost:
@@ -124,20 +190,102 @@ class GeminiTutorNativeHost:
         if not api_key:
             raise ValueError("API key is required.")
         self.api_key = api_key
-        self.pya = pyaudio.PyAudio()
-        self.session = None
-        self.audio_in_queue = asyncio.Queue() # Incoming audio from Gemini
-        self.out_queue = asyncio.Queue()  # Remove maxsize limit for testing
+        self.audio_source = create_source(AUDIO_SOURCE)
+        self.audio_sink = create_sink(AUDIO_SINK)
+        self.lifecycle = SessionLifecycle() # Pipeline stages wait on this rather than polling for a session
+        self.mic = MicCapture(rate=SEND_SAMPLE_RATE, channels=CHANNELS, frames_per_buffer=FRAMES_PER_BUFFER,
+                              restart_target_ms=MIC_RESTART_TARGET_MS, preroll_ms=PREROLL_MS)
+        self.tap = SessionTap(AUDIO_TAP_DIR, SEND_SAMPLE_RATE, RECEIVE_SAMPLE_RATE, AUDIO_TAP_SECONDS) \
+            if AUDIO_TAP_DIR else None
+        if self.tap:
+            logger.info(f"Recording session audio to {self.tap.directory}")
+        # What the speaker played, at the mic's rate, for the echo canceller to subtract
+        self.echo_reference = EchoReference(SEND_SAMPLE_RATE)
+        self.echo_reference_resampler = PolyphaseResampler(RECEIVE_SAMPLE_RATE, SEND_SAMPLE_RATE)
+        self.echo = None if ECHO_SUPPRESSION == "off" else EchoSuppressor(
+            self.echo_reference, ECHO_SUPPRESSION, delay_ms=float(ECHO_DELAY_MS) if ECHO_DELAY_MS else None
+        )
+        self.vad = None if VAD_BACKEND == "off" else VoiceGate(
+            VAD_BACKEND, rate=SEND_SAMPLE_RATE, hangover_ms=VAD_HANGOVER_MS,
+            pre_padding_ms=VAD_PRE_PADDING_MS, silence=VAD_SILENCE
+        )
+        self.audio_in = AudioBuffer(PLAYBACK_BUFFER_MS * RECEIVE_SAMPLE_RATE * 2 // 1000) # Incoming audio from Gemini
+        # Model replies are numbered as they arrive; chunks of a reply at or below dropped_turn are never queued
+        self.model_turn = 0
+        self.model_turn_open = False # Between a reply's first chunk and its turn_complete / interrupted
+        self.dropped_turn = 0
+        self.superseded_at = None # perf_counter() when the open reply was dropped, until its end arrives
+        self.stale_counters = collections.Counter()
+        self.stale_tail = LatencyHistogram() # Reply dropped -> server stopped sending it
+        self.jitter = JitterBuffer(RECEIVE_SAMPLE_RATE, JITTER_INITIAL_MS, min(JITTER_MIN_MS, JITTER_INITIAL_MS),
+                                   JITTER_MAX_MS if JITTER_INITIAL_MS else 0)
+        self.out_queue = OutboundQueue(OUT_QUEUE_MAX_BYTES) # Control, image and audio lanes, in priority order
         self.initial_image_sent = False
+        self._mic_unmuted = asyncio.Event() # Wakes listen_audio on unmute
         self.is_mic_muted = True # Start muted by default
-        self.current_image_data = None # Store received image data
+        self.current_image_data = None # Store received image data (data URL or raw bytes)
+        self.current_image_mime_type = None # Set for binary image frames
         self.gemini_task_group = None # To manage Gemini interaction tasks
-        self.interrupt_playback_event = asyncio.Event()
-        self.is_playback_active = False # Track if playback stream is writing
+        # Speaker, fed by its callback; its ring only needs to cover loop hiccups, the reply waits in audio_in
+        self.playback = PlaybackEngine(RECEIVE_SAMPLE_RATE, CHANNELS, PLAYBACK_FRAMES_PER_BUFFER, buffer_seconds=1.0,
+                                       idle_stop_seconds=PLAYBACK_IDLE_STOP_SECONDS,
+                                       on_played=self._tap_played if self.tap else None)
+        self._speaker_tap_end = None # Where the last tapped speaker block ends on the device's clock
+        # Opens the mic and speaker on first use and keeps them for the host's lifetime, across sessions
+        self.devices = DeviceManager(self.audio_source, self.audio_sink, self.mic, self.playback, SEND_SAMPLE_RATE,
+                                     RECEIVE_SAMPLE_RATE, NATIVE_RATES, stall_seconds=AUDIO_STALL_SECONDS,
+                                     default_poll_seconds=AUDIO_DEFAULT_POLL_SECONDS)
+        self.writer = NativeMessageWriter() # Outbound messages to the extension
+        self.gemini_session_task = None
+        self._session_lock = asyncio.Lock() # Serializes session switches/resets
+        self.handler_tasks = set() # Supervised tasks for handlers that have to wait
+        self.handler_latency = collections.defaultdict(LatencyHistogram) # Per message type
+        self.tracer = LatencyTracer() # Capture -> first audible sample, per stage
+        self.session_usage = SessionUsage(SEND_SAMPLE_RATE * 2, RECEIVE_SAMPLE_RATE * 2)
+        self.session_end_reason = None # Set when the live session errors or the server says goodbye
+        self.switch_counters = collections.Counter() # "switch" plus one "reconnect:<reason>" per reconnect
+        self.resume_handle = None # Latest session resumption handle from the server
+        self.last_image_part = None # Replayed if a dropped session can't be resumed
+        self.transcript = Transcript()
+        self.reconnecting = False
+        self.reconnect_attempt = 0 # Connects tried since the last session that stayed up
+        self.gap_audio = collections.deque(maxlen=GAP_BUFFER_CHUNKS) # Mic audio captured while reconnecting
+        self.recovery_latency = LatencyHistogram() # Connection lost -> replacement session open
+        self.unmuted_at = None # perf_counter() of the last unmute, until its first audio is sent
+        self.unmute_to_send = LatencyHistogram() # unmute_mic received -> first mic audio sent
+        self.held_msg = None # Non-audio message that ended a coalescing window; sent next
+        self.coalesce_counters = collections.Counter()
+        self.coalesce_wait = LatencyHistogram() # First chunk taken -> coalesced message sent
+        self.reconnect_counters = collections.Counter()
+        self._register_handlers()
         
-        self.client = genai.Client(http_options={"api_version": "v1alpha"}, api_key=self.api_key)
+        http_options = {"api_version": "v1alpha"}
+        if BASE_URL:
+            http_options["base_url"] = BASE_URL
+        if CA_FILE:
+            http_options["async_client_args"] = {"ssl": ssl.create_default_context(cafile=CA_FILE)}
+        self.client = genai.Client(http_options=http_options, api_key=self.api_key)
+        self.session_pool = LiveSessionPool(
+            lambda: self.client.aio.live.connect(model=MODEL_NAME, config=LIVE_CONFIG),
+            ttl=PREWARM_TTL
+        )
         logger.info("Gemini tutor native host initialized successfully")
 
+    @property
+    def session(self):
+        return self.lifecycle.session
+
+    @property
+    def is_mic_muted(self):
+        return not self._mic_unmuted.is_set()
+
+    @is_mic_muted.setter
+    def is_mic_muted(self, muted):
+        if muted:
+            self._mic_unmuted.clear()
+        else:
+            self._mic_unmuted.set()
+
     def _prepare_image_from_data_url(self, data_url):
         """Decode base64 data URL and prepare image part for API."""
         try:
@@ -145,27 +293,42 @@ class GeminiTutorNativeHost:
                 logger.error("Invalid image data URL format.")
                 return None
 
-            header, encoded = data_url.split(',', 1)
-            mime_type = header.split(';')[0].split(':')[1]
-            image_bytes = base64.b64decode(encoded)
-            logger.info(f"Image decoded successfully ({len(image_bytes)} bytes, {mime_type})")
-            
-            # Verify image data (optional but recommended)
-            try:
-                 img = PIL.Image.open(io.BytesIO(image_bytes))
-                 img.verify() # Verify image header
-                 logger.info(f"Image verified: format={img.format}")
-            except Exception as img_err:
-                 logger.error(f"Image verification failed: {img_err}")
-                 # Decide if you want to proceed anyway or return None
-                 return None
-
-            # API expects base64 string in the dict
-            return {"mime_type": mime_type, "data": encoded}
+            comma = data_url.index(',')
+            mime_type = data_url[5:comma].split(';')[0]
+            # Decode once; the raw bytes are what goes to the session. json gives us a str, which can't be
+            # viewed, so it's encoded to ASCII once and decoded from a view past the comma (no slice copy)
+            encoded = data_url.encode('ascii')
+            image_bytes = binascii.a2b_base64(memoryview(encoded)[comma + 1:])
+            return self._prepare_image_from_bytes(image_bytes, mime_type)
         except Exception as e:
             logger.error(f"Error processing image data URL: {e}", exc_info=True)
             return None
 
+    def _prepare_image_from_bytes(self, image_bytes, mime_type):
+        """Verify raw image bytes and prepare image part for API."""
+        logger.info(f"Image received ({len(image_bytes)} bytes, {mime_type})")
+        # Verify image data (optional but recommended)
+        try:
+            # BytesIO shares the bytes object's buffer, so this doesn't copy the image
+            img = PIL.Image.open(io.BytesIO(image_bytes))
+            img.verify() # Verify image header
+            logger.info(f"Image verified: format={img.format}")
+        except Exception as img_err:
+            logger.error(f"Image verification failed: {img_err}")
+            return None
+
+        # Raw bytes are base64 encoded exactly once, by the SDK, on the way to the wire.
+        # Passing a base64 string makes it decode and re-encode the whole image.
+        return {"mime_type": mime_type, "data": image_bytes}
+
+    async def _prepare_current_image(self):
+        # Decoding and verifying a large capture is CPU bound; keep it off the event loop
+        if isinstance(self.current_image_data, str):
+            return await asyncio.to_thread(self._prepare_image_from_data_url, self.current_image_data)
+        return await asyncio.to_thread(
+            self._prepare_image_from_bytes, self.current_image_data, self.current_image_mime_type
+        )
+
     async def start_gemini_session(self):
         """Connects to Gemini and queues initial image/prompt if available."""
         if not self.current_image_data:
@@ -175,63 +338,162 @@ class GeminiTutorNativeHost:
             logger.info("Gemini session already started for the current image.")
             return
             
-        prepared_image_part = self._prepare_image_from_data_url(self.current_image_data)
+        prepared_image_part = await self._prepare_current_image()
         if not prepared_image_part:
             logger.error("Failed to prepare image data for Gemini.")
             return
+        self.tracer.mark("image_prepared")
             
+        self.last_image_part = prepared_image_part
+        self.resume_handle = None
+        self.reconnect_attempt = 0
+        self.transcript.clear()
+
+        tasks = []
         try:
             logger.info("Starting Gemini session and sending initial data...")
-            async with self.client.aio.live.connect(model=MODEL_NAME, config=LIVE_CONFIG) as session:
-                self.session = session
-                logger.info("Live API session connected successfully.")
-                
-                # Put initial prompt and image into the queue
-                await self.out_queue.put(TUTOR_PROMPT)
-                await self.out_queue.put(prepared_image_part)
-                await self.out_queue.put(
-                    "Please analyze the image and start guiding me via audio."
-                )
-                self.initial_image_sent = True
-                logger.info("Initial image and prompt queued for sending.")
-                
-                # Create and gather tasks
-                tasks = [
-                    asyncio.create_task(self.send_realtime()),
-                    asyncio.create_task(self.listen_audio()),
-                    asyncio.create_task(self.receive_audio()),
-                    asyncio.create_task(self.play_audio())
-                ]
-                
-                try:
-                    # Wait for all tasks to complete or until cancelled
-                    await asyncio.gather(*tasks)
-                except asyncio.CancelledError:
-                    logger.info("Session tasks cancelled, cleaning up...")
-                    for task in tasks:
-                        if not task.done():
-                            task.cancel()
-                    # Wait for tasks to finish cleanup
-                    await asyncio.gather(*[t for t in tasks if not t.done()], return_exceptions=True)
-                    raise
-                finally:
-                    # Ensure all tasks are properly cancelled
-                    for task in tasks:
-                        if not task.done():
-                            task.cancel()
+            # Uses the prewarmed session when there is one, otherwise connects now
+            session, stack = await self.session_pool.acquire()
+            resumed = None
+            while True:
+                async with stack:
+                    if resumed is None:
+                        self.session_usage.reset()
+                        self.audio_in.reset_peaks()
+                        self.tracer.mark("connected")
+                        logger.info("Live API session connected successfully.")
+
+                        # Put initial prompt and image into the queue
+                        await self.out_queue.put(TUTOR_PROMPT)
+                        await self.out_queue.put(prepared_image_part)
+                        await self.out_queue.put(
+                            "Please analyze the image and start guiding me via audio."
+                        )
+                        self.initial_image_sent = True
+                        logger.info("Initial image and prompt queued for sending.")
+
+                        # Mic, sending and playback outlive a dropped connection
+                        tasks = [
+                            asyncio.create_task(self.send_realtime()),
+                            asyncio.create_task(self.listen_audio()),
+                            asyncio.create_task(self.play_audio())
+                        ]
+                    else:
+                        self._requeue_after_reconnect(resumed)
+                    self.session_end_reason = None
+                    self.lifecycle.open(session)
+                    opened_at = time.perf_counter()
+                    try:
+                        # Returns once the connection is lost
+                        await self.receive_audio()
+                    finally:
+                        self.lifecycle.close()
+                        self._end_model_turn() # Whatever the server was sending stops with the connection
+
+                reconnected = await self._reconnect(time.perf_counter() - opened_at >= RECONNECT_STABLE_SECONDS)
+                if reconnected is None:
+                    break
+                session, stack, resumed = reconnected
 
         except asyncio.CancelledError:
             logger.info("Gemini session task cancelled.")
             raise
         except Exception as e:
             logger.error(f"Error during Gemini session: {e}", exc_info=True)
-            self.session = None
-            self.initial_image_sent = False
         finally:
             logger.info("Gemini session attempt finished.")
-            self.session = None
+            self.lifecycle.close()
             self.initial_image_sent = False
-                
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _reconnect(self, stable):
+        """Open a replacement session after a drop, backing off exponentially between attempts.
+
+        A session that connects but drops again before it was `stable` (up for
+        RECONNECT_STABLE_SECONDS) doesn't start the count over: a server that
+        accepts and then closes straight away gets the same backoff, and the
+        same limit, as one that refuses.
+
+        Returns (session, exit_stack, resumed), or None once the attempts run out.
+        """
+        lost_at = time.perf_counter()
+        self.reconnecting = True
+        self.reconnect_counters["drops"] += 1
+        if stable:
+            self.reconnect_attempt = 0
+        elif self.reconnect_attempt:
+            self.reconnect_counters["quick_drops"] += 1
+        logger.warning(f"Live session lost ({self.session_end_reason or 'closed'}); reconnecting...")
+        await self.writer.send({"type": "session_status", "status": "reconnecting"})
+        try:
+            while self.reconnect_attempt < RECONNECT_ATTEMPTS:
+                attempt = self.reconnect_attempt
+                self.reconnect_attempt += 1
+                if attempt:
+                    delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** (attempt - 1))
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.0)) # Jitter, so clients don't retry in lockstep
+                if self.resume_handle and attempt >= RECONNECT_ATTEMPTS // 2:
+                    # The server may be rejecting the handle itself (refusing it, or dropping the session it
+                    # resumes); fall back to replaying
+                    self.resume_handle = None
+                handle = self.resume_handle
+                config = LIVE_CONFIG
+                if handle:
+                    config = LIVE_CONFIG.model_copy(
+                        update={"session_resumption": types.SessionResumptionConfig(handle=handle)}
+                    )
+                stack = contextlib.AsyncExitStack()
+                try:
+                    session = await stack.enter_async_context(
+                        self.client.aio.live.connect(model=MODEL_NAME, config=config)
+                    )
+                except Exception as e:
+                    await stack.aclose()
+                    self.reconnect_counters["failed_attempts"] += 1
+                    logger.warning(f"Reconnect attempt {attempt + 1}/{RECONNECT_ATTEMPTS} failed: {e}")
+                    continue
+                recovery_ms = (time.perf_counter() - lost_at) * 1000
+                self.recovery_latency.record(recovery_ms)
+                self.reconnect_counters["resumed" if handle else "replayed"] += 1
+                logger.info(f"Live session {'resumed' if handle else 'reopened'} after {recovery_ms:.0f} ms")
+                await self.writer.send({"type": "session_status", "status": "reconnected", "resumed": bool(handle)})
+                return session, stack, bool(handle)
+            self.reconnect_counters["gave_up"] += 1
+            logger.error("Could not reconnect the Live session; waiting for the next capture.")
+            await self.writer.send({"type": "session_status", "status": "lost"})
+            return None
+        finally:
+            self.reconnecting = False
+
+    def _requeue_after_reconnect(self, resumed):
+        """Queue what the new connection needs ahead of anything still waiting to be sent."""
+        pending = []
+        if self.held_msg is not None:
+            pending.append(self.held_msg)
+            self.held_msg = None
+            self.out_queue.task_done()
+        while not self.out_queue.empty():
+            pending.append(self.out_queue.get_nowait())
+            self.out_queue.task_done()
+        if not resumed:
+            # A fresh session knows nothing: give it the problem and where we had got to
+            self.session_usage.reset()
+            pending[:0] = [
+                TUTOR_PROMPT,
+                self.last_image_part,
+                RESUME_PROMPT.format(transcript=self.transcript.summary() or "(nothing yet)"),
+            ]
+        # What the student said while we were disconnected
+        pending.extend({"data": data, "mime_type": "audio/pcm"} for data in self.gap_audio)
+        self.reconnect_counters["gap_chunks_flushed"] += len(self.gap_audio)
+        self.gap_audio.clear()
+        # All of it was admitted once already (or is the problem itself); a lane's bound must not end the session here
+        for msg in pending:
+            self.out_queue.put_nowait(msg, force=True)
+
     async def send_text(self): # Removed as text input comes via native messaging now
         pass
 
@@ -239,77 +501,123 @@ class GeminiTutorNativeHost:
         """Sends data (audio/image) from the out_queue via session.send."""
         while True:
             try:
-                if not self.session:
-                    await asyncio.sleep(0.1)
-                    continue
-                msg = await self.out_queue.get()
+                await self.lifecycle.wait_ready()
+                if self.held_msg is not None:
+                    msg, self.held_msg = self.held_msg, None
+                else:
+                    msg = await self.out_queue.get()
                 logger.debug(f"out_queue size after get: {self.out_queue.qsize()}") # Log queue size
                 if msg is None: 
                      logger.info("Received stop signal for send_realtime.")
                      break
+                taken = time.perf_counter()
+                if AUDIO_COALESCE_MS > 0 and message_kind(msg) == "audio":
+                    msg = await self._coalesce_audio(msg)
                 logger.debug(f"Sending message type: {type(msg)}")
-                await self.session.send(input=msg)
+                # The session may have been replaced while we waited on the queue
+                session = await self.lifecycle.wait_ready()
+                await session.send(input=msg)
+                self.tracer.mark("first_send")
                 self.out_queue.task_done()
+                if AUDIO_COALESCE_MS > 0 and message_kind(msg) == "audio":
+                    self.coalesce_wait.record_since(taken)
+                if isinstance(msg, str):
+                    self.session_usage.add_text(msg)
+                elif message_kind(msg) == "control":
+                    pass # The stop-generation signal
+                elif msg["mime_type"].startswith("audio/"):
+                    self.session_usage.add_audio_in(len(msg["data"]))
+                    if self.unmuted_at is not None:
+                        self.unmute_to_send.record_since(self.unmuted_at)
+                        self.unmuted_at = None
+                else:
+                    self.session_usage.add_image()
             except asyncio.CancelledError:
                 logger.info("Send realtime task cancelled.")
                 break
             except Exception as e:
                  logger.error(f"Error in send_realtime: {e}", exc_info=True)
-                 await asyncio.sleep(0.1)
+                 self.session_end_reason = "send_error"
+                 if self.session and not is_session_open(self.session):
+                     # Connection is gone; sleep until receive_audio notices and the session is replaced
+                     await self.lifecycle.wait_closed()
         logger.info("Send realtime task finished.")
 
+    async def _coalesce_audio(self, msg):
+        """Join the mic chunks that follow `msg` into it, within the coalescing window.
+
+        Anything else that turns up (text, an image, the stop signal) ends the
+        window and is kept in held_msg so it goes out right after, in order.
+        """
+        parts = [msg["data"]]
+        size = len(msg["data"])
+        deadline = time.perf_counter() + AUDIO_COALESCE_MS / 1000
+        while size < AUDIO_COALESCE_BYTES:
+            if self.out_queue.empty():
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    nxt = await asyncio.wait_for(self.out_queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                nxt = self.out_queue.get_nowait()
+            if message_kind(nxt) != "audio":
+                self.held_msg = nxt
+                self.coalesce_counters["flushed_early"] += 1
+                break
+            self.out_queue.task_done()
+            parts.append(nxt["data"])
+            size += len(nxt["data"])
+        self.coalesce_counters["messages"] += 1
+        self.coalesce_counters["chunks"] += len(parts)
+        return {"data": b"".join(parts), "mime_type": msg["mime_type"]}
+
     async def listen_audio(self):
         """Capture audio from the microphone and put it into out_queue."""
-        audio_stream = None
         try:
-            mic_info = self.pya.get_default_input_device_info()
-            logger.info(f"Using microphone: {mic_info['name']}")
-            audio_stream = await asyncio.to_thread(
-                self.pya.open,
-                format=FORMAT,
-                channels=CHANNELS,
-                rate=SEND_SAMPLE_RATE,
-                input=True,
-                input_device_index=mic_info["index"],
-                frames_per_buffer=CHUNK_SIZE
-            )
-            logger.info("Microphone stream opened. Listening...")
+            # Opened by the first session and kept; mute/unmute never reopens it
+            await self.devices.attach_input(start=bool(PREROLL_MS) or not self.is_mic_muted)
+            logger.info("Microphone attached. Listening...")
             
             while True:
-                if not self.session:
-                    await asyncio.sleep(0.1)
+                if not self.session and not self.reconnecting:
+                    await self.lifecycle.wait_ready()
                     continue
 
-                if not self.is_mic_muted:
-                    try:
-                        data = await asyncio.to_thread(
-                            audio_stream.read, 
-                            CHUNK_SIZE, 
-                            exception_on_overflow=False
-                        )
-                        
-                        # Only queue if still unmuted (state might have changed)
-                        if not self.is_mic_muted:
-                            try:
-                                await asyncio.wait_for(
-                                    self.out_queue.put({"data": data, "mime_type": "audio/pcm"}),
-                                    timeout=0.1
-                                )
-                            except asyncio.TimeoutError:
-                                logger.warning("Queue full, dropping audio chunk")
-                                # Clear queue on overflow
-                                while not self.out_queue.empty():
-                                    try:
-                                        self.out_queue.get_nowait()
-                                        self.out_queue.task_done()
-                                    except asyncio.QueueEmpty:
-                                        break
-                    except OSError as e:
-                        logger.warning(f"Audio stream overflow (harmless): {e}")
-                        await asyncio.sleep(0.01)
-                else:
-                    # When muted, use a longer sleep to reduce CPU usage
-                    await asyncio.sleep(0.1)
+                if self.is_mic_muted:
+                    # Sleep until unmuted rather than polling; the device only fills the pre-roll meanwhile
+                    await self.mic.mute()
+                    await self._mic_unmuted.wait()
+                    await self.mic.unmute() # Reads start with the pre-roll, then live audio
+                    if self.devices.mic_resampler:
+                        self.devices.mic_resampler.reset()
+                    if self.vad:
+                        self.vad.reset()
+                    continue
+
+                # ~CHUNK_SIZE frames after resampling; the rate can change if the device is swapped
+                data = await self.mic.read(CHUNK_SIZE * self.devices.capture_rate // SEND_SAMPLE_RATE)
+                if self.devices.mic_resampler:
+                    data = self.devices.mic_resampler.process(data)
+                if self.tap:
+                    self.tap.mic.write(data)
+                if self.echo:
+                    # The tutor's voice picked up from the speaker would otherwise read as the student barging in
+                    data = self.echo.process(data, self.mic.captured_at)
+                # Silence is dropped (or thinned to keepalives) before it costs uplink
+                chunks = self.vad.process(data) if self.vad else [data]
+                for data in chunks:
+                    # Only queue if still unmuted (state might have changed)
+                    if not self.is_mic_muted and self.reconnecting:
+                        # Held until the replacement session is open
+                        if len(self.gap_audio) == self.gap_audio.maxlen:
+                            self.reconnect_counters["gap_chunks_dropped"] += 1
+                        self.gap_audio.append(data)
+                    elif not self.is_mic_muted:
+                        # Never blocks: a full audio lane drops its oldest chunks, never prompts or images
+                        self.out_queue.put_nowait({"data": data, "mime_type": "audio/pcm"})
                     
         except asyncio.CancelledError:
             logger.info("Listen audio task cancelled.")
@@ -317,288 +625,449 @@ class GeminiTutorNativeHost:
         except Exception as e:
             logger.error(f"Error in listen_audio: {e}")
         finally:
-            if audio_stream:
-                logger.info("Closing microphone stream.")
-                try:
-                    await asyncio.to_thread(audio_stream.stop_stream)
-                    await asyncio.to_thread(audio_stream.close)
-                except Exception as e:
-                    logger.error(f"Error closing audio stream: {e}")
+            await self.devices.detach_input()
+
 
     async def receive_audio(self):
         """Receive responses from the model via session.receive and queue audio."""
         logger.info("Starting to receive responses...")
         while True:
             try:
-                if not self.session:
-                    logger.warning("Receive loop: Session not ready, waiting...")
-                    await asyncio.sleep(1)
-                    continue
-                turn = self.session.receive()
+                session = await self.lifecycle.wait_ready()
+                turn = session.receive()
                 async for response in turn:
                     if data := response.data: 
                         logger.debug(f"Received audio chunk: {len(data)} bytes")
-                        self.audio_in_queue.put_nowait(data)
+                        arrived_at = time.perf_counter()
+                        if not self.model_turn_open:
+                            self.model_turn += 1
+                            self.model_turn_open = True
+                        self.session_usage.add_audio_out(len(data))
+                        queued = -1 # Position in audio_in, for the tap to match it with what the speaker played
+                        if self.model_turn <= self.dropped_turn:
+                            # The rest of a reply that was interrupted; it must not reach the speaker
+                            self.stale_counters["chunks_dropped"] += 1
+                            self.stale_counters["bytes_dropped"] += len(data)
+                        else:
+                            self.tracer.mark("first_response")
+                            # Waits only when the buffer's budget is spent, leaving the rest on the socket
+                            if await self.audio_in.put(data):
+                                queued = self.audio_in.write_position - len(data)
+                                self.jitter.arrived(len(data))
+                            else:
+                                self.stale_counters["chunks_dropped"] += 1 # Interrupted while waiting for room
+                                self.stale_counters["bytes_dropped"] += len(data)
+                        if self.tap:
+                            self.tap.model_in.write(data, at=arrived_at, source=queued, reply=self.model_turn)
                     if text := response.text: 
                         # Log text for debugging, don't print to stdout
                         logger.info(f"[AI Tutor]: {text.strip()}") 
+                    if content := response.server_content:
+                        if content.interrupted and self.model_turn > self.dropped_turn:
+                            # Generation was cut short (barge-in or a new problem); drop its queued tail
+                            self.interrupt_playback()
+                        if content.input_transcription and content.input_transcription.text:
+                            self.transcript.add("Student", content.input_transcription.text)
+                        if content.output_transcription and content.output_transcription.text:
+                            self.transcript.add("Tutor", content.output_transcription.text)
+                        if content.turn_complete:
+                            self.transcript.end_turn()
+                            self.jitter.end_turn() # Don't hold a short reply's tail for a pre-buffer
+                        if content.interrupted or content.turn_complete:
+                            self._end_model_turn()
+                    if update := response.session_resumption_update:
+                        if update.resumable and update.new_handle:
+                            self.resume_handle = update.new_handle
+                    if response.usage_metadata:
+                        self.session_usage.report(response.usage_metadata.total_token_count)
+                    if response.go_away:
+                        logger.info(f"Server closing session soon (time left: {response.go_away.time_left})")
+                        self.session_end_reason = "go_away"
                     if hasattr(response, 'error') and response.error:
                         logger.error(f"Received error from API in response: {response.error}")
             except asyncio.CancelledError:
                 logger.info("Receive audio task cancelled.")
-                break
+                raise
             except Exception as e:
                 logger.error(f"Error receiving responses: {e}", exc_info=True)
+                self.session_end_reason = "receive_error"
                 break
         logger.info("Receive audio task finished.")
                
     async def play_audio(self):
-        """Play audio received from the model via audio_in_queue, allowing interruption."""
-        stream = None
-        self.is_playback_active = False
+        """Feed audio received from the model via audio_in to the playback engine, a few device periods at a time."""
         try:
-            logger.info("Initializing audio playback stream...")
-            stream = await asyncio.to_thread(
-                self.pya.open, format=FORMAT, channels=CHANNELS, rate=RECEIVE_SAMPLE_RATE, output=True
-            )
-            logger.info("Audio playback stream opened.")
-            self.is_playback_active = True # Stream starts active
-            stream.start_stream() # Explicitly start
+            await self.devices.attach_output() # Opened by the first session and kept
+            logger.info("Speaker attached.")
+            read_bytes = PLAYBACK_READ_PERIODS * PLAYBACK_FRAMES_PER_BUFFER * CHANNELS * 2 # At RECEIVE_SAMPLE_RATE
 
             while True:
-                # Create tasks to wait for audio or interrupt
-                get_audio_task = asyncio.create_task(self.audio_in_queue.get())
-                wait_interrupt_task = asyncio.create_task(self.interrupt_playback_event.wait())
-
-                # Wait for either task to complete
-                done, pending = await asyncio.wait(
-                    [get_audio_task, wait_interrupt_task],
-                    return_when=asyncio.FIRST_COMPLETED
-                )
-
-                interrupted = False
-                if wait_interrupt_task in done:
-                    logger.info("Playback interrupted by user.")
-                    self.interrupt_playback_event.clear()
-                    interrupted = True
-                    if self.is_playback_active:
-                        await asyncio.to_thread(stream.stop_stream)
-                        self.is_playback_active = False
-                    # Clear the queue of any pending audio
-                    while not self.audio_in_queue.empty():
-                        try:
-                            self.audio_in_queue.get_nowait()
-                            self.audio_in_queue.task_done()
-                        except asyncio.QueueEmpty:
-                            break
-                    # Cancel the get_audio_task if it was pending
-                    if get_audio_task in pending:
-                        get_audio_task.cancel()
-                        try: await get_audio_task # Await cancellation
-                        except asyncio.CancelledError: pass 
-
-                if get_audio_task in done:
-                    # Cancel the interrupt wait task if it was pending
-                    if wait_interrupt_task in pending:
-                        wait_interrupt_task.cancel()
-                        try: await wait_interrupt_task
-                        except asyncio.CancelledError: pass
-
-                    try:
-                        bytestream = get_audio_task.result()
-                        if bytestream is None: 
-                            logger.info("Received stop signal (None) for audio playback.")
-                            self.audio_in_queue.task_done()
-                            break 
-                        
-                        # Only play if not interrupted during the wait
-                        if not interrupted:
-                            logger.debug(f"Playing audio chunk: {len(bytestream)} bytes")
-                            if not self.is_playback_active:
-                                await asyncio.to_thread(stream.start_stream)
-                                self.is_playback_active = True
-                            await asyncio.to_thread(stream.write, bytestream)
-                            self.audio_in_queue.task_done()
-                        else:
-                             logger.debug("Discarding audio chunk due to interruption.")
-                             self.audio_in_queue.task_done() # Still mark as done
-                             
-                    except Exception as e:
-                         logger.error(f"Error processing audio chunk: {e}", exc_info=True)
-                         # Ensure task_done is called even on error if item was retrieved
-                         if not self.audio_in_queue.empty() or bytestream is not None:
-                            try: self.audio_in_queue.task_done()
-                            except ValueError: pass # If already done
+                bytestream = await self.audio_in.read(read_bytes)
+                queued = self.audio_in.read_position - len(bytestream) # Where the block starts in audio_in
+                try:
+                    # Holds a reply's start (or its resumption after an underrun) until the pre-buffer fills
+                    if not await self.jitter.before_write(len(bytestream)):
+                        logger.debug("Discarding audio chunk due to interruption.")
+                        continue
+                    logger.debug(f"Playing audio chunk: {len(bytestream)} bytes")
+                    # Tapped when the speaker's callback reaches it (_tap_played), not now
+                    mark = (bytestream, queued) if self.tap else None
+                    if self.echo:
+                        self.echo_reference.push(self.echo_reference_resampler.process(bytestream))
+                    if self.devices.speaker_resampler:
+                        bytestream = self.devices.speaker_resampler.process(bytestream)
+                    if await self.playback.write(bytestream, mark):
+                        self.tracer.mark("first_audio")
+                except Exception as e:
+                    logger.error(f"Error processing audio chunk: {e}", exc_info=True)
 
         except asyncio.CancelledError:
-             logger.info("Play audio task cancelled.")
+            logger.info("Play audio task cancelled.")
         except Exception as e:
             logger.error(f"Error in play_audio setup or main loop: {e}", exc_info=True)
         finally:
-            if stream:
-                logger.info("Closing audio playback stream.")
-                try:
-                    # Ensure stream is stopped before closing
-                    if self.is_playback_active:
-                        await asyncio.to_thread(stream.stop_stream)
-                    await asyncio.to_thread(stream.close)
-                except Exception as e:
-                    logger.error(f"Error closing playback stream: {e}")
-            self.is_playback_active = False # Mark as inactive
             logger.info("Play audio task finished.")
-                    
+
+    def _tap_played(self, mark, played_at, gap_frames):
+        """The speaker's callback reached a block: record it in the tap at the time it went to the device."""
+        data, queued = mark
+        if gap_frames is not None and self._speaker_tap_end is not None:
+            # Played without a break since the last block: on the device's clock, the gap is exactly the silence
+            played_at = self._speaker_tap_end + gap_frames / self.playback.rate
+        self._speaker_tap_end = played_at + len(data) / 2 / RECEIVE_SAMPLE_RATE
+        self.tap.speaker.write(data, at=played_at, source=queued)
+
+    def _end_model_turn(self):
+        if self.model_turn_open and self.superseded_at is not None:
+            self.stale_tail.record_since(self.superseded_at)
+        self.model_turn_open = False
+        self.superseded_at = None
+
+    def interrupt_playback(self, upstream=False):
+        """Silence the speaker at its next period and drop the current reply, including chunks still to come.
+
+        With `upstream`, also tell the model to stop generating it.
+        """
+        logger.info("Playback interrupted.")
+        if self.model_turn > self.dropped_turn:
+            self.dropped_turn = self.model_turn
+            self.stale_counters["turns_dropped"] += 1
+            if self.model_turn_open:
+                self.superseded_at = time.perf_counter()
+                if upstream and self.session:
+                    self.stale_counters["upstream_stops"] += 1
+                    try:
+                        self.out_queue.put_nowait(STOP_GENERATION)
+                    except asyncio.QueueFull:
+                        logger.warning("Control lane full; not sending the stop-generation signal.")
+        self.playback.flush()
+        self.audio_in.clear()
+        self.jitter.flush()
+        if self.devices.speaker_resampler:
+            self.devices.speaker_resampler.reset() # Don't blend the old reply into the next one
+        if self.echo:
+            self.echo_reference.flush() # The rest of the reply won't be heard
+            self.echo_reference_resampler.reset()
+
+    # --- Message Handlers ---
+    # Handlers run synchronously as soon as a message is read, so control messages
+    # (mute/unmute/interrupt) take effect immediately. A handler that needs to wait
+    # on something returns a coroutine, which is run as a supervised task instead
+    # of blocking the read loop.
+
+    def _register_handlers(self):
+        self.handlers = {
+            "unmute_mic": self.handle_unmute_mic,
+            "mute_mic": self.handle_mute_mic,
+            "interrupt_playback": self.handle_interrupt_playback,
+            "image_data": self.handle_image_data,
+            "check_mic_status": self.handle_check_mic_status,
+            "reset_state": self.handle_reset_state,
+            "get_metrics": self.handle_get_metrics,
+            "prewarm_session": self.handle_prewarm_session,
+        }
+
+    def handle_unmute_mic(self, message):
+        logger.info(f"Unmute requested. Current state: muted={self.is_mic_muted}")
+        # Stop any playback, and the reply itself: the student is about to talk
+        self.interrupt_playback(upstream=True)
+        if self.is_mic_muted:
+            self.unmuted_at = time.perf_counter()
+        self.is_mic_muted = False
+        logger.info("Microphone unmuted")
+
+    def handle_mute_mic(self, message):
+        logger.info(f"Mute requested. Current state: muted={self.is_mic_muted}")
+        self.is_mic_muted = True
+        logger.info("Microphone muted")
+
+    def handle_interrupt_playback(self, message):
+        logger.info("Interrupt playback requested")
+        self.interrupt_playback(upstream=True)
+
+    def handle_image_data(self, message):
+        logger.info("Received image data from extension.")
+        # Binary transport delivers raw bytes; the extension sends a data URL
+        received_image_data = message.get("imageBytes") or message.get("imageData")
+        if not received_image_data:
+            logger.warning("Received image_data message with no imageData field.")
+            return None
+        # Mute now rather than after teardown, so an unmute that arrives mid-switch sticks
+        self.is_mic_muted = True
+        # Stop the old reply before the trace opens: its chunks, and mic audio queued for it, must not be taken for
+        # this capture's first response or first send while the image is prepared
+        self.interrupt_playback()
+        self._drain(self.out_queue)
+        self.tracer.start(message.get("traceId"), message.get("capturedAt"))
+        return self._switch_session(received_image_data, message.get("mimeType", "image/png"))
+
+    def handle_check_mic_status(self, message):
+        logger.info("Received request to check mic status.")
+        return self.check_mic_status()
+
+    def handle_prewarm_session(self, message):
+        # Sent when the popup opens or a screenshot starts, ahead of the image
+        if SWITCH_MODE and self._reconnect_reason() is None:
+            logger.info("Prewarm skipped: the next image will reuse the live session.")
+            return
+        logger.info("Prewarm requested.")
+        self.session_pool.prewarm()
+
+    def handle_get_metrics(self, message):
+        return self.send_metrics()
+
+    def handle_reset_state(self, message):
+        logger.info("Received reset_state request, preparing for next question...")
+        self.is_mic_muted = True
+        return self._reset_state()
+
+    def _reconnect_reason(self):
+        """Why the next image can't reuse the live session, or None if it can."""
+        task = self.gemini_session_task
+        if not task or task.done() or self.session is None:
+            return "no_session"
+        if self.session_end_reason:
+            return self.session_end_reason
+        if not is_session_open(self.session):
+            return "closed"
+        if self.session_usage.tokens >= SWITCH_MAX_TOKENS:
+            return "context_limit"
+        if self.session_usage.age >= SWITCH_MAX_AGE:
+            return "max_age"
+        return None
+
+    async def _switch_session(self, image_data, mime_type):
+        # Session changes are serialized; asyncio.Lock wakes waiters in arrival order
+        async with self._session_lock:
+            reason = self._reconnect_reason() if SWITCH_MODE else "switch_mode_off"
+            if reason is None:
+                await self._switch_problem(image_data, mime_type)
+                return
+            logger.info(f"Reconnecting for new image ({reason}).")
+            self.switch_counters[f"reconnect:{reason}"] += 1
+            self.tracer.tag("reconnect")
+            await self._stop_gemini_session()
+            self.current_image_data = image_data
+            self.current_image_mime_type = mime_type
+            self.initial_image_sent = False
+            logger.info("Creating new Gemini session task...")
+            self.gemini_session_task = asyncio.create_task(
+                self.start_gemini_session(),
+                name="GeminiSession"
+            )
+
+    async def _switch_problem(self, image_data, mime_type):
+        """Send the new image into the live session; streams and tasks keep running."""
+        logger.info("Switching problem within the live session.")
+        self.switch_counters["switch"] += 1
+        self.tracer.tag("switch")
+        self.current_image_data = image_data
+        self.current_image_mime_type = mime_type
+        prepared_image_part = await self._prepare_current_image()
+        if not prepared_image_part:
+            logger.error("Failed to prepare image data for Gemini.")
+            return
+        self.last_image_part = prepared_image_part
+        self.transcript.clear()
+        self.tracer.mark("image_prepared")
+        # Already stopped on arrival (handle_image_data); this drops anything the model started while we prepared
+        self.interrupt_playback()
+        self._drain(self.out_queue)
+        self.tracer.mark("connected") # Already connected; keeps the per-stage breakdown comparable
+        # Image first, then one text turn, so the model answers the new problem only
+        await self.out_queue.put(prepared_image_part)
+        await self.out_queue.put(SWITCH_PROMPT)
+
+    async def _reset_state(self):
+        async with self._session_lock:
+            await self._stop_gemini_session()
+            # Reset state but maintain connection
+            self.current_image_data = None
+            self.current_image_mime_type = None
+        # Send acknowledgment back to extension
+        await self.writer.send({"type": "reset_complete", "success": True})
+        logger.info("Reset complete, ready for next question")
+
+    async def _stop_gemini_session(self):
+        """Cancel the running session (if any) and drop everything queued for it."""
+        task = self.gemini_session_task
+        if task and not task.done():
+            logger.info("Cancelling existing Gemini session...")
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                logger.info("Previous session cancelled.")
+            except Exception as e:
+                logger.error(f"Error awaiting previous session cancellation: {e}")
+        self.gemini_session_task = None
+        self.lifecycle.close()
+        self.initial_image_sent = False
+        # Clear queues
+        self._drain(self.out_queue)
+        self.playback.flush()
+        self.audio_in.clear()
+        self.jitter.flush()
+        self.model_turn_open = False # A new session starts on a fresh reply
+        self.superseded_at = None
+        self.gap_audio.clear()
+
+    @staticmethod
+    def _drain(queue):
+        while not queue.empty():
+            try:
+                queue.get_nowait()
+                queue.task_done()
+            except asyncio.QueueEmpty:
+                break
+
+    def dispatch(self, message):
+        """Apply a message's handler, supervising it as a task if it has to wait."""
+        received_at = time.perf_counter()
+        message_type = message.get("type")
+        logger.info(f"Processing message type: {message_type}")
+        handler = self.handlers.get(message_type)
+        if handler is None:
+            logger.warning(f"Unknown message type received: {message_type}")
+            return
+        try:
+            result = handler(message)
+        except Exception as e:
+            logger.error(f"Error handling {message_type}: {e}", exc_info=True)
+            return
+        if asyncio.iscoroutine(result):
+            task = asyncio.create_task(self._supervise(message_type, result, received_at), name=f"Handle-{message_type}")
+            self.handler_tasks.add(task)
+            task.add_done_callback(self.handler_tasks.discard)
+        else:
+            self.handler_latency[message_type].record_since(received_at)
+
+    async def _supervise(self, message_type, coro, received_at):
+        try:
+            await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error handling {message_type}: {e}", exc_info=True)
+        finally:
+            self.handler_latency[message_type].record_since(received_at)
+
     async def main_loop(self):
         """Main loop to read native messages and manage Gemini session."""
         logger.info("Starting native host main loop.")
-        gemini_session_task = None
+        reader = NativeMessageReader()
+        device_watch = asyncio.create_task(self.devices.watch())
         try:
-            while True:
-                message = await asyncio.to_thread(read_native_message)
-                if message is None:
-                    logger.info("Exiting main loop: No more messages from Chrome.")
-                    break
+            await reader.start()
+            self.writer.start()
+            async for message in reader:
+                self.dispatch(message)
 
-                message_type = message.get("type")
-                logger.info(f"Processing message type: {message_type}")
-
-                if message_type == "unmute_mic":
-                    logger.info(f"Unmute requested. Current state: muted={self.is_mic_muted}")
-                    # Clear any pending audio first
-                    self.interrupt_playback_event.set()
-                    await asyncio.sleep(0.1)  # Brief pause to let interruption process
-                    self.is_mic_muted = False
-                    logger.info("Microphone unmuted")
-
-                elif message_type == "mute_mic":
-                    logger.info(f"Mute requested. Current state: muted={self.is_mic_muted}")
-                    self.is_mic_muted = True
-                    logger.info("Microphone muted")
-
-                elif message_type == "interrupt_playback":
-                    logger.info("Interrupt playback requested")
-                    self.interrupt_playback_event.set()
-                    await asyncio.sleep(0.1)  # Brief pause to let interruption process
-                    logger.info("Playback interrupted")
-
-                elif message_type == "image_data":
-                    logger.info("Received image data from extension.")
-                    received_image_data = message.get("imageData")
-                    if received_image_data:
-                        # Handle image data...
-                        if gemini_session_task and not gemini_session_task.done():
-                            logger.info("Cancelling existing Gemini session for new image...")
-                            gemini_session_task.cancel()
-                            try:
-                                await gemini_session_task
-                            except asyncio.CancelledError:
-                                logger.info("Previous session cancelled.")
-                            except Exception as e:
-                                logger.error(f"Error awaiting previous session cancellation: {e}")
-                            self.session = None
-                            self.initial_image_sent = False
-                            self.is_mic_muted = True
-                            # Clear queues
-                            while not self.out_queue.empty(): 
-                                try:
-                                    self.out_queue.get_nowait()
-                                    self.out_queue.task_done()
-                                except asyncio.QueueEmpty:
-                                    break
-                            while not self.audio_in_queue.empty(): 
-                                try:
-                                    self.audio_in_queue.get_nowait()
-                                    self.audio_in_queue.task_done()
-                                except asyncio.QueueEmpty:
-                                    break
-                           
-                        self.current_image_data = received_image_data
-                        self.initial_image_sent = False
-                        logger.info("Creating new Gemini session task...")
-                        gemini_session_task = asyncio.create_task(
-                            self.start_gemini_session(), 
-                            name="GeminiSession"
-                        )
-                    else:
-                        logger.warning("Received image_data message with no imageData field.")
-               
-                elif message_type == "check_mic_status":
-                    logger.info("Received request to check mic status.")
-                    await self.check_mic_status()
-
-                # Add handling for reset_state message
-                elif message_type == "reset_state":
-                    logger.info("Received reset_state request, preparing for next question...")
-                    if gemini_session_task and not gemini_session_task.done():
-                        gemini_session_task.cancel()
-                        try:
-                            await gemini_session_task
-                        except asyncio.CancelledError:
-                            pass
-                        except Exception as e:
-                            logger.error(f"Error cancelling session: {e}")
-                    
-                    # Reset state but maintain connection
-                    self.session = None
-                    self.initial_image_sent = False
-                    self.is_mic_muted = True
-                    self.current_image_data = None
-                    
-                    # Clear queues
-                    while not self.out_queue.empty():
-                        try:
-                            self.out_queue.get_nowait()
-                            self.out_queue.task_done()
-                        except asyncio.QueueEmpty:
-                            break
-                    while not self.audio_in_queue.empty():
-                        try:
-                            self.audio_in_queue.get_nowait()
-                            self.audio_in_queue.task_done()
-                        except asyncio.QueueEmpty:
-                            break
-                            
-                    # Send acknowledgment back to extension
-                    send_native_message({"type": "reset_complete", "success": True})
-                    logger.info("Reset complete, ready for next question")
-
-                else:
-                    logger.warning(f"Unknown message type received: {message_type}")
-                
+            logger.info("Exiting main loop: No more messages from Chrome.")
         except asyncio.CancelledError:
             logger.info("Main loop cancelled externally.")
         except Exception as e:
              logger.error(f"Error in main loop: {e}", exc_info=True)
         finally:
             logger.info("Main loop finished. Cleaning up...")
-            if gemini_session_task and not gemini_session_task.done():
+            reader.close()
+            for task in list(self.handler_tasks):
+                task.cancel()
+            await asyncio.gather(*self.handler_tasks, return_exceptions=True)
+            if self.gemini_session_task and not self.gemini_session_task.done():
                 logger.info("Cancelling active Gemini session task on exit...")
-                gemini_session_task.cancel()
+                self.gemini_session_task.cancel()
                 try:
-                    await gemini_session_task
+                    await self.gemini_session_task
                 except asyncio.CancelledError:
                     pass # Expected
                 except Exception as e:
                      logger.error(f"Error awaiting final session cancellation: {e}")
             
-            # Ensure PyAudio terminates *after* tasks using it are likely stopped
-            if self.pya:
-                logger.info("Terminating PyAudio in main loop finally.")
-                await asyncio.sleep(0.2)  # Small delay to allow audio tasks to clean up
-                await asyncio.to_thread(self.pya.terminate)
-                
+            # Ensure the audio devices close *after* tasks using them are likely stopped
+            logger.info("Closing audio devices in main loop finally.")
+            await asyncio.sleep(0.2)  # Small delay to allow audio tasks to clean up
+            device_watch.cancel()
+            await self.devices.close()
+            await asyncio.to_thread(self.audio_source.close)
+            await asyncio.to_thread(self.audio_sink.close)
+
+            await self.session_pool.close()
+            await self.writer.close()
+            if self.tap:
+                self.tap.close()
             logger.info("Native host cleanup complete.")
 
     async def check_mic_status(self):
         """Send mic status back to extension."""
         try:
-            send_native_message({
+            await self.writer.send({
                 "type": "mic_status",
                 "is_muted": self.is_mic_muted,
-                "queue_size": self.out_queue.qsize()
+                "queue_size": self.out_queue.qsize(),
+                "out_queue": self.out_queue.stats(),
+                "mic": self.mic.stats(),
+                "vad": self.vad.stats() if self.vad else None,
+                "echo": self.echo.stats() if self.echo else None,
+                "writer": self.writer.stats(),
+                "devices": self.devices.stats(),
+                "handler_latency": {
+                    message_type: histogram.snapshot()
+                    for message_type, histogram in self.handler_latency.items()
+                }
             })
         except Exception as e:
             logger.error(f"Error sending mic status: {e}")
 
+    async def send_metrics(self):
+        """Send latency percentiles for each pipeline stage back to extension."""
+        try:
+            await self.writer.send({
+                "type": "metrics",
+                "trace_id": self.tracer.trace_id,
+                "stages": self.tracer.snapshot(),
+                "handler_latency": {
+                    message_type: histogram.snapshot()
+                    for message_type, histogram in self.handler_latency.items()
+                },
+                "writer": self.writer.stats(),
+                "devices": self.devices.stats(),
+                "mic": dict(self.mic.stats(), unmute_to_send=self.unmute_to_send.snapshot()),
+                "vad": self.vad.stats() if self.vad else None,
+                "echo": self.echo.stats() if self.echo else None,
+                "playback": dict(self.jitter.stats(), engine=self.playback.stats(),
+                                 stale=dict(self.stale_counters, tail=self.stale_tail.snapshot()),
+                                 store=self.audio_in.stats()),
+                "send_coalescing": dict(self.coalesce_counters, window_ms=AUDIO_COALESCE_MS,
+                                        max_bytes=AUDIO_COALESCE_BYTES, wait=self.coalesce_wait.snapshot()),
+                "session_pool": self.session_pool.stats(),
+                "session_switch": dict(self.switch_counters, usage=self.session_usage.stats()),
+                "reconnect": dict(self.reconnect_counters, recovery=self.recovery_latency.snapshot(),
+                                  resumable=self.resume_handle is not None)
+            })
+        except Exception as e:
+            logger.error(f"Error sending metrics: {e}")
+
 # --- Main Execution --- 
 if __name__ == "__main__":
     logger.info("Starting AI Tutor Native Host Script.")
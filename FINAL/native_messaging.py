@@ -0,0 +1,393 @@
+"""
+## Native Messaging framing for the AI Tutor native host
+Chrome talks to the host over stdin/stdout using 4-byte native-endian length
+prefixed JSON messages. On top of that, the host understands a binary image
+transport: a JSON header announcing the image is followed by one raw frame
+(same length prefix) that carries the encoded image bytes with no base64.
+
+    {"type": "image_data", "encoding": "binary", "mimeType": "image/png"}
+    <uint32 length><raw PNG bytes>
+
+Chrome's own port can only post JSON, so the extension keeps sending data
+URLs; the binary mode is for local drivers that write to the pipe directly.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import stat
+import struct
+import sys
+import time
+
+try:
+    import orjson # Optional faster encoder for transcript/metrics payloads
+except ImportError:
+    orjson = None
+
+from metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('@I')
+BINARY_ENCODING = "binary"
+
+
+class FrameBuffer:
+    """Preallocated receive buffer that raw binary frames are read into."""
+
+    def __init__(self, initial_size=1 << 20):
+        self._buffer = bytearray(initial_size)
+        self.bytes_read = 0 # Running total, used by benchmarks
+
+    def _ensure_capacity(self, length):
+        if length > len(self._buffer):
+            # Grow geometrically so a run of slightly larger captures doesn't realloc each time
+            self._buffer = bytearray(max(length, 2 * len(self._buffer)))
+
+    def view(self, length):
+        """A memoryview of the first `length` bytes of the buffer, to read a frame into."""
+        self._ensure_capacity(length)
+        return memoryview(self._buffer)[:length]
+
+    def read_frame(self, stream, length):
+        """Fill the buffer with exactly `length` bytes from `stream`. Returns a memoryview or None on EOF."""
+        view = self.view(length)
+        filled = 0
+        while filled < length:
+            count = stream.readinto(view[filled:])
+            if not count:
+                view.release()
+                return None
+            filled += count
+        self.bytes_read += length
+        return view
+
+
+_frame_buffer = FrameBuffer()
+
+
+def read_exactly(stream, length):
+    """Read exactly `length` bytes or return None on EOF."""
+    data = stream.read(length)
+    if len(data) < length:
+        return None
+    return data
+
+
+def decode_message(message_bytes):
+    """Parse a message body. None (logged) if it isn't a JSON object; the framing is intact either way."""
+    try:
+        message = json.loads(message_bytes)
+    except json.JSONDecodeError as e:
+        logger.error(f"Error decoding JSON message: {e} - Received: {bytes(message_bytes[:200]).decode('utf-8', errors='ignore')}")
+        return None
+    if not isinstance(message, dict):
+        logger.error(f"Ignoring message that is not a JSON object: {type(message).__name__}")
+        return None
+    return message
+
+
+def read_native_message(stream=None):
+    """Read one message from Chrome, skipping malformed ones. Binary image frames are attached as `imageBytes`."""
+    stream = stream or sys.stdin.buffer
+    try:
+        while True:
+            text_length_bytes = read_exactly(stream, HEADER.size)
+            if not text_length_bytes:
+                logger.info("No more data from stdin, exiting read loop.")
+                return None # End of stream
+            text_length = HEADER.unpack(text_length_bytes)[0]
+            message_bytes = read_exactly(stream, text_length)
+            if message_bytes is None:
+                logger.info("Stream ended in the middle of a message.")
+                return None
+            message = decode_message(message_bytes)
+            if message is None:
+                continue
+            if message.get("encoding") == BINARY_ENCODING:
+                message["imageBytes"] = read_binary_frame(stream)
+                if message["imageBytes"] is None:
+                    return None
+            logger.info(f"Received message: Type={message.get('type', 'N/A')}, Length={text_length}")
+            return message
+    except struct.error as e:
+        logger.error(f"Error unpacking message length: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"Unexpected error reading native message: {e}", exc_info=True)
+        return None
+
+
+def read_binary_frame(stream, frame_buffer=None):
+    """Read the raw frame that follows a binary header. Returns bytes owned by the caller."""
+    frame_buffer = frame_buffer or _frame_buffer
+    length_bytes = read_exactly(stream, HEADER.size)
+    if not length_bytes:
+        logger.error("Binary header was not followed by a frame.")
+        return None
+    length = HEADER.unpack(length_bytes)[0]
+    view = frame_buffer.read_frame(stream, length)
+    if view is None:
+        logger.error(f"Stream ended inside a {length} byte binary frame.")
+        return None
+    with view:
+        # The one copy out of the shared buffer; the session keeps this object
+        return bytes(view)
+
+
+class NativeMessageReader:
+    """Asyncio-native reader for framed messages on stdin.
+
+    Iterate with `async for message in reader`. The pipe is non-blocking and
+    read on the event loop, so a pending read is cancelled like any other
+    await instead of pinning a worker thread in `sys.stdin.buffer.read`.
+    Messages are parsed out of reads of up to `limit` bytes; a binary image
+    frame is read straight from the pipe into the shared FrameBuffer, so the
+    only copy of the image outside the kernel is the one handed to the caller.
+    """
+
+    def __init__(self, pipe=None, limit=1 << 16, frame_buffer=None):
+        self._pipe = pipe or sys.stdin
+        self._limit = limit
+        self._frame_buffer = frame_buffer or _frame_buffer
+        self._fd = None
+        self._pending = bytearray() # Read from the pipe but not parsed yet
+        self._use_thread = False
+
+    async def start(self):
+        try:
+            if not hasattr(os, 'readv'):
+                raise NotImplementedError("os.readv is not available")
+            fd = self._pipe.fileno()
+            mode = os.fstat(fd).st_mode
+            if not (stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode) or stat.S_ISCHR(mode)):
+                raise ValueError("not a pipe, socket or character device")
+            os.set_blocking(fd, False)
+            self._fd = fd
+        except (ValueError, NotImplementedError, OSError) as e:
+            # Regular files and Windows handles can't be watched by the loop
+            logger.warning(f"Async stdin unavailable ({e}), falling back to threaded reads.")
+            self._use_thread = True
+        return self
+
+    async def _wait_readable(self):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        loop.add_reader(self._fd, ready.set_result, None)
+        try:
+            await ready
+        finally:
+            loop.remove_reader(self._fd)
+
+    async def _fill(self, needed):
+        """Read until at least `needed` bytes are pending. False on EOF."""
+        while len(self._pending) < needed:
+            try:
+                data = os.read(self._fd, self._limit)
+            except BlockingIOError:
+                await self._wait_readable()
+                continue
+            if not data:
+                return False
+            self._pending += data
+        return True
+
+    async def _read_frame(self, length):
+        """Read a `length` byte binary frame into the FrameBuffer. Returns a view of it, or None on EOF."""
+        view = self._frame_buffer.view(length)
+        filled = min(len(self._pending), length)
+        # Whatever arrived along with the header, then the rest directly from the pipe
+        with memoryview(self._pending) as pending:
+            view[:filled] = pending[:filled]
+        del self._pending[:filled]
+        while filled < length:
+            try:
+                count = os.readv(self._fd, [view[filled:]])
+            except BlockingIOError:
+                await self._wait_readable()
+                continue
+            if not count:
+                view.release()
+                return None
+            filled += count
+        self._frame_buffer.bytes_read += length
+        return view
+
+    async def _read_length(self):
+        if not await self._fill(HEADER.size):
+            return None
+        length = HEADER.unpack_from(self._pending)[0]
+        del self._pending[:HEADER.size]
+        return length
+
+    async def read_message(self):
+        """Return the next message, or None once Chrome closes the pipe. Malformed messages are skipped."""
+        if self._fd is None and not self._use_thread:
+            await self.start()
+        if self._use_thread:
+            stream = getattr(self._pipe, 'buffer', self._pipe)
+            return await asyncio.to_thread(read_native_message, stream)
+        while True:
+            length = await self._read_length()
+            if length is None or not await self._fill(length):
+                logger.info("No more data from stdin, exiting read loop.")
+                return None
+            message = decode_message(self._pending[:length])
+            del self._pending[:length]
+            if message is None:
+                continue
+            if message.get("encoding") == BINARY_ENCODING:
+                frame_length = await self._read_length()
+                view = None if frame_length is None else await self._read_frame(frame_length)
+                if view is None:
+                    logger.error("Stream ended inside a binary frame.")
+                    return None
+                with view:
+                    # The one copy out of the shared buffer; the session keeps this object
+                    message["imageBytes"] = bytes(view)
+            logger.info(f"Received message: Type={message.get('type', 'N/A')}, Length={length}")
+            return message
+
+    def close(self):
+        if self._fd is not None:
+            os.set_blocking(self._fd, True)
+            self._fd = None
+        self._pending.clear()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.read_message()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+
+def encode_message(message):
+    """Serialize a message to UTF-8 JSON bytes, using orjson when it's installed."""
+    if orjson is not None:
+        return orjson.dumps(message)
+    return json.dumps(message, separators=(',', ':')).encode('utf-8')
+
+
+class NativeMessageWriter:
+    """Dedicated writer task for messages to Chrome.
+
+    Producers `await send(...)` onto a bounded queue, which is the backpressure:
+    when Chrome stops draining stdout, senders wait instead of the loop blocking
+    inside a write. The writer task drains whatever is queued and hands all the
+    frames to a single `os.writev` call on a non-blocking stdout.
+    """
+
+    def __init__(self, pipe=None, max_queue=256, max_batch=64):
+        self._fd = (pipe or sys.stdout).fileno()
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._max_batch = max_batch
+        self._task = None
+        self.write_latency = LatencyHistogram() # Enqueue -> bytes handed to the OS, per frame
+        self.frames_written = 0
+        self.batches_written = 0
+        self.frames_dropped = 0
+
+    def start(self):
+        if self._task is None:
+            if hasattr(os, 'writev'):
+                os.set_blocking(self._fd, False)
+            self._task = asyncio.create_task(self._run(), name="NativeMessageWriter")
+        return self
+
+    async def send(self, message):
+        """Queue a message, waiting if the outbound queue is full."""
+        body = encode_message(message)
+        await self._queue.put((HEADER.pack(len(body)), body, time.perf_counter()))
+        logger.debug(f"Queued message: Type={message.get('type', 'N/A')}, Length={len(body)}")
+
+    def send_nowait(self, message):
+        """Queue a message without waiting. Returns False (and counts a drop) if the queue is full."""
+        body = encode_message(message)
+        try:
+            self._queue.put_nowait((HEADER.pack(len(body)), body, time.perf_counter()))
+            return True
+        except asyncio.QueueFull:
+            self.frames_dropped += 1
+            logger.warning(f"Outbound queue full, dropped message: Type={message.get('type', 'N/A')}")
+            return False
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self._max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            buffers = []
+            for header, body, _ in batch:
+                buffers.append(header)
+                buffers.append(body)
+            try:
+                await self._write_all(buffers)
+            except Exception as e:
+                logger.error(f"Error sending native message: {e}", exc_info=True)
+            now = time.perf_counter()
+            for _, _, queued_at in batch:
+                self.write_latency.record((now - queued_at) * 1000)
+                self._queue.task_done()
+            self.frames_written += len(batch)
+            self.batches_written += 1
+
+    async def _write_all(self, buffers):
+        buffers = [memoryview(b) for b in buffers]
+        while buffers:
+            try:
+                if hasattr(os, 'writev'):
+                    written = os.writev(self._fd, buffers)
+                else:
+                    written = os.write(self._fd, b''.join(buffers))
+            except BlockingIOError:
+                written = 0
+            while buffers and written >= len(buffers[0]):
+                written -= len(buffers.pop(0))
+            if buffers:
+                if written:
+                    buffers[0] = buffers[0][written:]
+                await self._wait_writable()
+
+    async def _wait_writable(self):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        loop.add_writer(self._fd, ready.set_result, None)
+        try:
+            await ready
+        finally:
+            loop.remove_writer(self._fd)
+
+    def stats(self):
+        return {
+            "frames_written": self.frames_written,
+            "batches_written": self.batches_written,
+            "frames_dropped": self.frames_dropped,
+            "queue_depth": self._queue.qsize(),
+            "write_latency": self.write_latency.snapshot(),
+        }
+
+    async def close(self, timeout=1.0):
+        """Flush what's queued (bounded by `timeout`) and stop the writer task."""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {self._queue.qsize()} unsent messages on shutdown.")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+def encode_binary_image(image_bytes, mime_type="image/png"):
+    """Build the header + raw frame pair for the binary image transport."""
+    header = json.dumps({"type": "image_data", "encoding": BINARY_ENCODING, "mimeType": mime_type}).encode('utf-8')
+    return b''.join([HEADER.pack(len(header)), header, HEADER.pack(len(image_bytes)), image_bytes])
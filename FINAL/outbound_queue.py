@@ -0,0 +1,131 @@
+"""
+## Outbound scheduler for send_realtime
+Replaces the single unbounded out_queue with one lane per kind of message:
+control (text prompts, the stop-generation signal and the stop signal), images and mic audio. `get()`
+serves lanes in that priority order, so a prompt or image never waits behind
+a backlog of audio. Text never overtakes an image that was queued before it
+("Please analyze the image" must follow the image).
+
+Each lane is bounded in bytes. Audio is the only thing ever dropped: a full
+audio lane discards its oldest chunks to make room, since stale speech is
+worth less than current speech. A full control or image lane makes `put()`
+wait instead, and `put_nowait()` raise `asyncio.QueueFull`. `put_nowait(msg,
+force=True)` takes a message past its lane's bound, for what has to be resent
+as-is after a reconnect.
+
+Keeps the asyncio.Queue methods the host already uses (put, put_nowait, get,
+get_nowait, empty, qsize, task_done).
+"""
+
+import asyncio
+import collections
+
+LANES = ("control", "image", "audio") # Highest priority first
+
+
+def message_kind(msg):
+    if not isinstance(msg, dict): # None, text, or a LiveClientContent such as the stop-generation signal
+        return "control"
+    return "audio" if msg["mime_type"].startswith("audio/") else "image"
+
+
+def message_size(msg):
+    if isinstance(msg, str):
+        return len(msg)
+    if not isinstance(msg, dict): # None or a LiveClientContent
+        return 0
+    return len(msg["data"])
+
+
+class OutboundQueue:
+    """Priority lanes with byte bounds; only audio is dropped, oldest first."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = dict(max_bytes) # Lane -> byte bound
+        self._lanes = {lane: collections.deque() for lane in LANES} # (seq, size, msg)
+        self._bytes = dict.fromkeys(LANES, 0)
+        self.peak_bytes = dict.fromkeys(LANES, 0)
+        self._seq = 0
+        self._unfinished = 0
+        self._ready = asyncio.Event()
+        self._space = {lane: asyncio.Event() for lane in LANES}
+        for event in self._space.values():
+            event.set()
+        self.counters = collections.Counter()
+
+    def qsize(self):
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def empty(self):
+        return not any(self._lanes.values())
+
+    def _fits(self, lane, size):
+        # An oversized message still goes into an empty lane rather than blocking forever
+        return not self._lanes[lane] or self._bytes[lane] + size <= self.max_bytes[lane]
+
+    def put_nowait(self, msg, force=False):
+        """Queue `msg` now. With `force` it goes in whatever its lane holds: nothing is dropped or refused."""
+        lane, size = message_kind(msg), message_size(msg)
+        if lane == "audio" and not force:
+            while not self._fits(lane, size):
+                _, dropped, _ = self._lanes[lane].popleft()
+                self._bytes[lane] -= dropped
+                self._unfinished -= 1
+                self.counters["audio_dropped_chunks"] += 1
+                self.counters["audio_dropped_bytes"] += dropped
+        elif not force and not self._fits(lane, size):
+            raise asyncio.QueueFull
+        self._seq += 1
+        self._lanes[lane].append((self._seq, size, msg))
+        self._bytes[lane] += size
+        self.peak_bytes[lane] = max(self.peak_bytes[lane], self._bytes[lane])
+        self._unfinished += 1
+        self.counters[f"{lane}_queued"] += 1
+        self._ready.set()
+
+    async def put(self, msg):
+        """Queue `msg`, waiting for room in its lane; audio never waits, it displaces old audio."""
+        lane = message_kind(msg)
+        if lane != "audio":
+            while not self._fits(lane, message_size(msg)):
+                self.counters[f"{lane}_put_waits"] += 1
+                self._space[lane].clear()
+                await self._space[lane].wait()
+        self.put_nowait(msg)
+
+    def _next_lane(self):
+        control, image = self._lanes["control"], self._lanes["image"]
+        if control and not (image and image[0][0] < control[0][0]):
+            return "control"
+        if image:
+            return "image"
+        return "audio"
+
+    def get_nowait(self):
+        if self.empty():
+            raise asyncio.QueueEmpty
+        lane = self._next_lane()
+        _, size, msg = self._lanes[lane].popleft()
+        self._bytes[lane] -= size
+        if self._bytes[lane] < self.max_bytes[lane]:
+            self._space[lane].set()
+        if self.empty():
+            self._ready.clear()
+        return msg
+
+    async def get(self):
+        while self.empty():
+            await self._ready.wait()
+        return self.get_nowait()
+
+    def task_done(self):
+        if self._unfinished <= 0:
+            raise ValueError("task_done() called too many times")
+        self._unfinished -= 1
+
+    def stats(self):
+        return dict(self.counters, lanes={
+            lane: {"depth": len(self._lanes[lane]), "bytes": self._bytes[lane],
+                   "peak_bytes": self.peak_bytes[lane], "max_bytes": self.max_bytes[lane]}
+            for lane in LANES
+        })
@@ -0,0 +1,248 @@
+"""
+## Callback-driven playback
+The speaker side of MicCapture: PortAudio's output callback pulls audio from
+a preallocated byte ring, and `write` copies into it without touching the
+device or a thread. Interrupting is `flush()`, an O(1) move of the read
+position under the lock, so the next callback (one device period later at
+most) is already silence; the audio queued ahead in the device buffer is all
+that still plays. Stopping a blocking stream instead drains the whole buffer.
+
+The stream is stopped after `idle_stop_seconds` of silence so an idle host
+doesn't wake every period, and `write` starts it again; both happen on the
+event loop, one at a time.
+
+`write(data, mark)` tags the audio's first byte; when the callback hands that
+byte to the device, `on_played(mark, played_at, gap_frames)` is called on the
+event loop (the session audio tap records the speaker this way). Flushed audio
+never reports its marks.
+"""
+
+import asyncio
+import collections
+import logging
+import threading
+import time
+
+from metrics import LatencyHistogram
+from virtual_audio import paContinue, paOutputUnderflow
+
+logger = logging.getLogger(__name__)
+
+BYTES_PER_SAMPLE = 2
+
+
+class PlaybackEngine:
+    """Output stream fed from a ring buffer by the device's callback, written with `await write(data)`."""
+
+    def __init__(self, rate=24000, channels=1, frames_per_buffer=1024, buffer_seconds=10.0, idle_stop_seconds=2.0,
+                 on_played=None):
+        self.rate = rate
+        self.channels = channels
+        self.frames_per_buffer = frames_per_buffer
+        self._frame_bytes = BYTES_PER_SAMPLE * channels
+        self.buffer_seconds = buffer_seconds
+        self.idle_stop_seconds = idle_stop_seconds
+        self._allocate()
+        self._lock = threading.Lock()
+        self._space = asyncio.Event()
+        self._writer_needs = 0 # Room a waiting write needs; the callback wakes the loop once, when it's there
+        self._loop = None
+        self.stream = None
+        self._running = False # Stream started and not stopped for idleness
+        self.called_at = time.perf_counter() # Latest callback, or the start still waiting for one
+        self._state_lock = asyncio.Lock() # Serializes starting and idle-stopping the stream
+        self._stop_requested = False # Callback asked the loop to stop the idle stream
+        self._idle_task = None
+        self._generation = 0 # Bumped by flush(); a write that waited across one is dropped
+        self._flushed_at = None # Set by flush() until the next callback plays silence
+        self._idle_frames = 0 # Silence played since the ring ran dry
+        self._playing = False # The last callback had audio; the next empty one is an underrun
+        self.on_played = on_played
+        self._marks = collections.deque() # (ring byte position, mark) of written audio not yet played
+        self._gap_frames = None # Silence played since the last audio; None until the stream has played some
+        self.flush_to_silence = LatencyHistogram() # flush() -> first callback that plays none of the old audio
+        self.counters = {"callbacks": 0, "frames_played": 0, "ran_dry": 0, "output_underflows": 0, "flushes": 0,
+                         "frames_flushed": 0, "starts": 0, "idle_stops": 0}
+
+    def _allocate(self):
+        self._ring = bytearray(int(self.rate * self.buffer_seconds) * self._frame_bytes)
+        # Monotonic byte positions; the ring index is position % len(ring)
+        self._write_pos = 0
+        self._read_pos = 0
+
+    async def open(self, sink, rate=None):
+        """Open the output stream at `rate` (e.g. the device's native one); the ring keeps its duration."""
+        self._loop = asyncio.get_running_loop()
+        if rate and rate != self.rate:
+            self.frames_per_buffer = self.frames_per_buffer * rate // self.rate
+            self.rate = rate
+            self._allocate()
+        self.stream = await asyncio.to_thread(
+            sink.open_stream, rate=self.rate, channels=self.channels, frames_per_buffer=self.frames_per_buffer,
+            stream_callback=self._callback, start=False)
+        async with self._state_lock:
+            await self._start()
+
+    async def _start(self):
+        self._idle_frames = 0
+        self._gap_frames = None
+        self.called_at = time.perf_counter()
+        self.counters["starts"] += 1
+        await asyncio.to_thread(self.stream.start_stream)
+        self._running = True
+
+    def _request_idle_stop(self):
+        self._idle_task = asyncio.create_task(self._idle_stop())
+
+    async def _idle_stop(self):
+        try:
+            async with self._state_lock:
+                # A write may have landed since the callback asked
+                if self._running and self.stream is not None and not self.buffered_frames:
+                    await asyncio.to_thread(self.stream.stop_stream)
+                    self._running = False
+                    self.counters["idle_stops"] += 1
+        finally:
+            self._stop_requested = False
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def buffered_frames(self):
+        return (self._write_pos - self._read_pos) // self._frame_bytes
+
+    async def write(self, data, mark=None):
+        """Queue audio for playback, waiting only if the ring is full. False if flush() dropped it meanwhile.
+
+        A `mark` is passed to on_played once the first byte of `data` reaches the device.
+        """
+        generation = self._generation
+        view = memoryview(data)
+        while view:
+            with self._lock:
+                size = len(self._ring) # Reallocated if the device is reopened at another rate meanwhile
+                room = size - (self._write_pos - self._read_pos)
+                if room:
+                    count = min(room, len(view))
+                    if mark is not None:
+                        self._marks.append((self._write_pos, mark))
+                        mark = None
+                    start = self._write_pos % size
+                    first = min(count, size - start)
+                    self._ring[start:start + first] = view[:first]
+                    self._ring[:count - first] = view[first:count]
+                    self._write_pos += count
+                    view = view[count:]
+                    continue
+                self._space.clear()
+                self._writer_needs = min(len(view), size)
+            await self._space.wait()
+            if self._generation != generation:
+                return False
+        if not self._running and self.stream is not None:
+            async with self._state_lock:
+                if not self._running:
+                    await self._start()
+        return True
+
+    def flush(self):
+        """Drop everything not yet handed to the device. O(1): only the read position moves."""
+        with self._lock:
+            if self._playing or self._write_pos != self._read_pos:
+                self._flushed_at = time.perf_counter() # Only time flushes that had something to silence
+            self.counters["frames_flushed"] += (self._write_pos - self._read_pos) // self._frame_bytes
+            self._read_pos = self._write_pos
+            self._marks.clear()
+            self._gap_frames = None # The last audio was cut short; on_played starts over from the callback's time
+            self._playing = False
+            self.counters["flushes"] += 1
+            wake, self._writer_needs = self._writer_needs > 0, 0
+        self._generation += 1
+        if wake:
+            self._space.set()
+
+    def _record_flush(self, ms):
+        self.flush_to_silence.record(ms)
+
+    def _report_played(self, played):
+        for mark, played_at, gap_frames in played:
+            self.on_played(mark, played_at, gap_frames)
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        # Runs on PortAudio's thread: copy out of the ring and get out quickly
+        want = frame_count * self._frame_bytes
+        size = len(self._ring)
+        with self._lock:
+            self.called_at = time.perf_counter()
+            count = min(want, self._write_pos - self._read_pos)
+            start = self._read_pos % size
+            first = min(count, size - start)
+            ring = memoryview(self._ring)
+            out = b"".join((ring[start:start + first], ring[:count - first], bytes(want - count)))
+            played = []
+            while self._marks and self._marks[0][0] < self._read_pos + count:
+                position, mark = self._marks.popleft()
+                offset = (position - self._read_pos) // self._frame_bytes
+                # Audio right before it in this period leaves no gap; at its start, the silence played so far
+                played.append((mark, self.called_at + offset / self.rate, self._gap_frames if not offset else 0))
+            if count:
+                self._gap_frames = (want - count) // self._frame_bytes
+            elif self._gap_frames is not None:
+                self._gap_frames += frame_count
+            self._read_pos += count
+            self.counters["callbacks"] += 1
+            self.counters["frames_played"] += count // self._frame_bytes
+            if status & paOutputUnderflow:
+                self.counters["output_underflows"] += 1
+            if count < want and self._playing:
+                self.counters["ran_dry"] += 1 # Mid-reply (an underrun) or at its end; JitterBuffer tells them apart
+            self._playing = count == want
+            self._idle_frames = 0 if count else self._idle_frames + frame_count
+            flushed_at, self._flushed_at = self._flushed_at, None
+            wake = self._writer_needs > 0 and size - (self._write_pos - self._read_pos) >= self._writer_needs
+            if wake:
+                self._writer_needs = 0
+            idle = self._idle_frames >= self.idle_stop_seconds * self.rate and not self._stop_requested
+            if idle:
+                self._stop_requested = True
+        if flushed_at is not None:
+            self._loop.call_soon_threadsafe(self._record_flush, (time.perf_counter() - flushed_at) * 1000)
+        if played and self.on_played:
+            self._loop.call_soon_threadsafe(self._report_played, played)
+        if wake:
+            self._loop.call_soon_threadsafe(self._space.set)
+        if idle:
+            self._loop.call_soon_threadsafe(self._request_idle_stop)
+        return (out, paContinue)
+
+    async def close(self):
+        if self._idle_task:
+            self._idle_task.cancel()
+        self._running = False
+        with self._lock:
+            self._read_pos = self._write_pos # Nothing carries over into the next stream
+            self._marks.clear()
+            self._playing = False
+            wake, self._writer_needs = self._writer_needs > 0, 0
+        self._generation += 1
+        if wake:
+            self._space.set() # A write waiting for room gives up
+        stream, self.stream = self.stream, None
+        if stream is not None:
+            logger.info("Closing playback stream.")
+            try:
+                await asyncio.to_thread(stream.stop_stream)
+                await asyncio.to_thread(stream.close)
+            except Exception as e:
+                logger.error(f"Error closing playback stream: {e}")
+
+    def stats(self):
+        latency = getattr(self.stream, "get_output_latency", None)
+        return dict(self.counters,
+                    rate=self.rate,
+                    frames_per_buffer=self.frames_per_buffer,
+                    buffered_ms=round(self.buffered_frames * 1000 / self.rate, 1),
+                    device_latency_ms=round(latency() * 1000, 1) if latency else None,
+                    flush_to_silence=self.flush_to_silence.snapshot())
@@ -0,0 +1,58 @@
+"""
+## Streaming polyphase resampler
+Converts int16 PCM between the device's native rate and the rates the Live
+API uses (16 kHz up, 24 kHz down), a whole block at a time. The ratio is
+reduced to up/down integers; a Kaiser-windowed sinc low-pass is designed once
+at the upsampled rate and split into `up` phases, so each output sample is
+one dot product of a filter phase with the most recent input samples. All
+output samples of a block are computed in one vectorized NumPy pass.
+
+The last few input samples are carried between blocks, so feeding audio in
+arbitrary block sizes gives the same output as resampling it in one go
+(delayed by the filter's group delay, `delay_seconds`).
+"""
+
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class PolyphaseResampler:
+    """Resamples mono int16 PCM from `in_rate` to `out_rate`; `process(block)` returns the output so far."""
+
+    def __init__(self, in_rate, out_rate, zero_crossings=16, rolloff=0.92, beta=8.6):
+        g = math.gcd(int(in_rate), int(out_rate))
+        self.in_rate, self.out_rate = int(in_rate), int(out_rate)
+        self.up, self.down = self.out_rate // g, self.in_rate // g
+        # Input samples under each output sample; wider when decimating so the cutoff can sit lower
+        self.taps = 2 * zero_crossings * max(1, math.ceil(self.down / self.up))
+        cutoff = rolloff * min(self.in_rate, self.out_rate) / 2 / (self.in_rate * self.up) # Cycles per upsampled sample
+        n = np.arange(self.taps * self.up) - (self.taps * self.up - 1) / 2
+        h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(len(n), beta)
+        h *= self.up / h.sum() # Unity gain once the zero-stuffed samples are accounted for
+        # bank[p, j] multiplies x[i - (taps - 1) + j] for an output at phase p of input sample i
+        self.bank = h.reshape(self.taps, self.up).T[:, ::-1].astype(np.float32).copy()
+        self.delay_seconds = (len(h) - 1) / 2 / (self.in_rate * self.up)
+        self.reset()
+
+    def reset(self):
+        """Forget carried samples, e.g. after playback was flushed."""
+        self._history = np.zeros(self.taps - 1, dtype=np.float32)
+        self._next = 0 # Upsampled position of the next output, relative to the next block's first sample
+
+    def process(self, block):
+        samples = np.frombuffer(block, dtype="<i2").astype(np.float32)
+        x = np.concatenate((self._history, samples))
+        end = len(samples) * self.up
+        positions = np.arange(self._next, end, self.down)
+        if len(positions):
+            index = positions // self.up # Input sample each output lines up with, within the block
+            windows = sliding_window_view(x, self.taps)[index] # x[i - taps + 1 .. i], shifted by the history
+            out = np.einsum("nk,nk->n", windows, self.bank[positions % self.up])
+            self._next = int(positions[-1]) + self.down - end
+        else:
+            out = np.zeros(0, dtype=np.float32)
+            self._next -= end
+        self._history = x[len(x) - (self.taps - 1):]
+        return np.clip(np.rint(out), -32768, 32767).astype("<i2").tobytes()
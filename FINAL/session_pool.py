@@ -0,0 +1,254 @@
+"""
+## Pre-warmed Live sessions
+Opening a Live session costs a TLS + websocket handshake and the setup round
+trip. The pool does that while the student is still drawing the selection box,
+so the image goes out on an already-open session. Idle warm sessions are
+recycled after a TTL so we never hand out one the server has timed out.
+"""
+
+import asyncio
+import collections
+import contextlib
+import logging
+import time
+
+from metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+def is_session_open(session):
+    """Best-effort liveness check; the SDK doesn't expose the connection state."""
+    ws = getattr(session, "_ws", None)
+    state = getattr(ws, "state", None)
+    return state is None or getattr(state, "name", "OPEN") == "OPEN"
+
+
+class _WarmSession:
+    def __init__(self, session, stack, connect_ms):
+        self.session = session
+        self.stack = stack
+        self.connect_ms = connect_ms
+        self.opened_at = time.perf_counter()
+        self.expiry_task = None
+
+
+class LiveSessionPool:
+    """Keeps at most one Live session connected ahead of the next capture."""
+
+    def __init__(self, connect, ttl=60.0, keep_warm_for=300.0):
+        self._connect = connect # Returns the client.aio.live.connect(...) context manager
+        self.ttl = ttl
+        self.keep_warm_for = keep_warm_for # Recycle only while prewarm requests are this recent
+        self._warm = None
+        self._opening = None
+        self._last_request = 0.0
+        self.connect_latency = LatencyHistogram() # Every handshake + setup, warm or cold
+        self.handshake_saved = LatencyHistogram() # Handshake time taken off the critical path
+        self.counters = {"warm_hits": 0, "cold_connects": 0, "expired": 0, "dead": 0}
+
+    def prewarm(self):
+        """Start opening a session in the background if one isn't already warm or opening."""
+        self._last_request = time.perf_counter()
+        if self._warm is not None or (self._opening and not self._opening.done()):
+            return
+        self._opening = asyncio.create_task(self._open_warm(), name="PrewarmLiveSession")
+
+    async def _open(self):
+        start = time.perf_counter()
+        stack = contextlib.AsyncExitStack()
+        try:
+            session = await stack.enter_async_context(self._connect())
+        except BaseException:
+            await stack.aclose()
+            raise
+        connect_ms = (time.perf_counter() - start) * 1000
+        self.connect_latency.record(connect_ms)
+        return session, stack, connect_ms
+
+    async def _open_warm(self):
+        try:
+            session, stack, connect_ms = await self._open()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to prewarm Live session: {e}")
+            return
+        warm = _WarmSession(session, stack, connect_ms)
+        warm.expiry_task = asyncio.create_task(self._expire(warm), name="ExpireLiveSession")
+        self._warm = warm
+        logger.info(f"Live session prewarmed in {connect_ms:.0f} ms")
+
+    async def _expire(self, warm):
+        await asyncio.sleep(self.ttl)
+        if self._warm is not warm:
+            return
+        self._warm = None
+        self.counters["expired"] += 1
+        logger.info("Recycling idle prewarmed Live session.")
+        await self._discard(warm)
+        if time.perf_counter() - self._last_request < self.keep_warm_for:
+            self._opening = asyncio.create_task(self._open_warm(), name="PrewarmLiveSession")
+
+    async def _discard(self, warm):
+        try:
+            await warm.stack.aclose()
+        except Exception as e:
+            logger.warning(f"Error closing prewarmed session: {e}")
+
+    async def acquire(self):
+        """Return (session, exit_stack): the warm session if there is one, else a fresh connection."""
+        if self._opening and not self._opening.done():
+            # A handshake is already underway; finishing it beats starting another
+            await asyncio.shield(self._opening)
+        warm, self._warm = self._warm, None
+        if warm is not None:
+            warm.expiry_task.cancel()
+            if is_session_open(warm.session):
+                self.counters["warm_hits"] += 1
+                self.handshake_saved.record(warm.connect_ms)
+                logger.info(f"Using prewarmed Live session (saved {warm.connect_ms:.0f} ms handshake)")
+                return warm.session, warm.stack
+            self.counters["dead"] += 1
+            await self._discard(warm)
+        self.counters["cold_connects"] += 1
+        session, stack, _ = await self._open()
+        return session, stack
+
+    def stats(self):
+        return dict(self.counters,
+                    warm=self._warm is not None,
+                    connect_latency=self.connect_latency.snapshot(),
+                    handshake_saved=self.handshake_saved.snapshot())
+
+    async def close(self):
+        if self._opening and not self._opening.done():
+            self._opening.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._opening
+        warm, self._warm = self._warm, None
+        if warm is not None:
+            warm.expiry_task.cancel()
+            await self._discard(warm)
+
+
+class SessionUsage:
+    """Rough context usage of one live session, to know when to stop reusing it.
+
+    The server's usage_metadata is used when it arrives; until then tokens are
+    estimated from what went over the wire.
+    """
+
+    # Approximate token costs for the Live API
+    IMAGE_TOKENS = 258
+    AUDIO_TOKENS_PER_SECOND = 25
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, send_bytes_per_second, receive_bytes_per_second):
+        self._send_rate = send_bytes_per_second
+        self._receive_rate = receive_bytes_per_second
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.perf_counter()
+        self.images = 0
+        self.estimated_tokens = 0.0
+        self.reported_tokens = None
+
+    def add_image(self):
+        self.images += 1
+        self.estimated_tokens += self.IMAGE_TOKENS
+
+    def add_text(self, text):
+        self.estimated_tokens += len(text) / self.CHARS_PER_TOKEN
+
+    def add_audio_in(self, num_bytes):
+        self.estimated_tokens += num_bytes / self._send_rate * self.AUDIO_TOKENS_PER_SECOND
+
+    def add_audio_out(self, num_bytes):
+        self.estimated_tokens += num_bytes / self._receive_rate * self.AUDIO_TOKENS_PER_SECOND
+
+    def report(self, total_token_count):
+        """Record the server's own token count (usage_metadata.total_token_count)."""
+        if total_token_count:
+            self.reported_tokens = total_token_count
+
+    @property
+    def tokens(self):
+        return max(self.reported_tokens or 0, self.estimated_tokens)
+
+    @property
+    def age(self):
+        return time.perf_counter() - self.started_at
+
+    def stats(self):
+        return {"images": self.images, "tokens": round(self.tokens), "reported_tokens": self.reported_tokens,
+                "age_s": round(self.age, 1)}
+
+
+class Transcript:
+    """Recent conversation text, kept small enough to replay into a new session."""
+
+    def __init__(self, max_chars=2000):
+        self.max_chars = max_chars
+        self.lines = collections.deque()
+        self._chars = 0
+        self._partial = {} # Role -> transcription fragments for the turn in progress
+
+    def add(self, role, text):
+        self._partial.setdefault(role, []).append(text)
+
+    def end_turn(self):
+        for role, fragments in self._partial.items():
+            text = "".join(fragments).strip()
+            if text:
+                self.lines.append(f"{role}: {text}")
+                self._chars += len(self.lines[-1])
+        self._partial = {}
+        # Oldest lines go first; the latest exchange is what matters for picking up again
+        while self._chars > self.max_chars and len(self.lines) > 1:
+            self._chars -= len(self.lines.popleft())
+
+    def summary(self):
+        self.end_turn()
+        return "\n".join(self.lines)
+
+    def clear(self):
+        self.lines.clear()
+        self._chars = 0
+        self._partial = {}
+
+
+class SessionLifecycle:
+    """The current live session, with awaitable ready/closed states.
+
+    Pipeline stages wait on these instead of polling for a session, so they
+    start the moment one opens and sleep without wakeups while there's none.
+    """
+
+    def __init__(self):
+        self.session = None
+        self._ready = asyncio.Event()
+        self._closed = asyncio.Event()
+        self._closed.set()
+        self.opened = 0
+
+    def open(self, session):
+        self.session = session
+        self.opened += 1
+        self._closed.clear()
+        self._ready.set()
+
+    def close(self):
+        self.session = None
+        self._ready.clear()
+        self._closed.set()
+
+    async def wait_ready(self):
+        """Return the session, waiting for one to open if necessary."""
+        while self.session is None:
+            await self._ready.wait()
+        return self.session
+
+    async def wait_closed(self):
+        await self._closed.wait()
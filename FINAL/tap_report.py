@@ -0,0 +1,194 @@
+"""
+## Audio tap report
+Reads a directory written by audio_tap.SessionTap, unrolls the ring files and
+reports, per track, gaps in the stream; for playback, underruns (the speaker
+ran dry in the middle of a reply); and end-to-end delays by aligning tracks:
+
+- speaker: blocks are stamped when the output callback handed them to the
+  device, on the device's clock, so a gap between blocks is silence it played
+- model_in -> speaker: each played block is matched by its position in the
+  playback queue to the server chunk it started in, giving arrival -> device
+  delay, and the reply it belongs to: a gap inside one reply is an underrun
+- mic -> model_in: for each reply, the last mic audio before it -> its first
+  audio from the server (the student stops talking -> the tutor answers)
+
+    python tap_report.py /tmp/ai-tutor-taps/20260101-120000 --export
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from audio_tap import INDEX_HEADER, INDEX_MAGIC, INDEX_RECORD, WAV_HEADER
+
+
+class Track:
+    """Chunks of one tapped stream still held in its rings: (perf_counter time, PCM bytes)."""
+
+    def __init__(self, path):
+        self.name = os.path.basename(path).rsplit(".", 1)[0]
+        with open(path + ".idx", "rb") as f:
+            index = f.read()
+        magic, self.rate, capacity, record_capacity, written, records, self.started, self.wall_started = \
+            INDEX_HEADER.unpack_from(index, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{path}.idx is not an audio tap index")
+        with open(path, "rb") as f:
+            ring = f.read()[WAV_HEADER.size:]
+        first_record = max(0, records - record_capacity)
+        entries = [INDEX_RECORD.unpack_from(index, INDEX_HEADER.size + (i % record_capacity) * INDEX_RECORD.size)
+                   for i in range(first_record, records)]
+        oldest_byte = max(0, written - capacity)
+        self.times, self.chunks, self.sources, self.replies = [], [], [], []
+        for i, (position, tapped_at, source, reply) in enumerate(entries):
+            end = entries[i + 1][0] if i + 1 < len(entries) else written
+            if position < oldest_byte:
+                continue # Audio already overwritten in the ring
+            start = position % capacity
+            data = ring[start:start + end - position]
+            if len(data) < end - position:
+                data += ring[:end - position - len(data)]
+            self.times.append(tapped_at)
+            self.chunks.append(data)
+            self.sources.append(source)
+            self.replies.append(reply)
+        self.times = np.array(self.times)
+        self.sources = np.array(self.sources, dtype=np.int64) # Playback queue position, -1 if never queued
+        self.replies = np.array(self.replies, dtype=np.int64) # Model reply number, -1 if not recorded
+        self.durations = np.array([len(c) / 2 / self.rate for c in self.chunks])
+
+    def pcm(self):
+        return b"".join(self.chunks)
+
+
+def percentiles(values):
+    if not len(values):
+        return "-"
+    values = np.asarray(values) * 1000
+    return (f"p50 {np.percentile(values, 50):.1f} ms, p95 {np.percentile(values, 95):.1f} ms, "
+            f"max {values.max():.1f} ms (n={len(values)})")
+
+
+def gaps(track, threshold):
+    """Pauses longer than `threshold` s between the end of one chunk and the next chunk."""
+    if len(track.times) < 2:
+        return np.array([])
+    idle = track.times[1:] - track.times[:-1] - track.durations[:-1]
+    return idle[idle > threshold]
+
+
+def match_played(model_in, speaker):
+    """For each played block, the index of the model_in chunk it starts in, or -1 if it's no longer in the ring."""
+    matched = np.full(len(speaker.sources), -1, dtype=np.int64)
+    queued = np.flatnonzero(model_in.sources >= 0) # Stale chunks were dropped on arrival and never played
+    if not len(queued):
+        return matched
+    starts = model_in.sources[queued]
+    ends = starts + np.array([len(model_in.chunks[i]) for i in queued], dtype=np.int64)
+    found = np.searchsorted(starts, speaker.sources, side="right") - 1
+    for block, i in enumerate(found):
+        if i >= 0 and speaker.sources[block] < ends[i]:
+            matched[block] = queued[i]
+    return matched
+
+
+def underruns(track, reply_gap, replies=None):
+    """How long the speaker ran dry each time it did mid-reply.
+
+    With the reply of each block, a gap inside a reply is an underrun; without, silences up to
+    `reply_gap` are taken to be inside one.
+    """
+    played_until = None
+    starved = []
+    for i, (tapped_at, duration) in enumerate(zip(track.times, track.durations)):
+        gap = None if played_until is None else tapped_at - played_until
+        # Under half a sample is rounding on the device clock, not silence
+        if gap is not None and gap > 0.5 / track.rate:
+            if replies is None:
+                mid_reply = gap < reply_gap
+            else:
+                mid_reply = replies[i] >= 0 and replies[i] == replies[i - 1]
+            if mid_reply:
+                starved.append(gap)
+        played_until = max(played_until or tapped_at, tapped_at) + duration
+    return starved
+
+
+def arrival_to_playback(model_in, speaker, matched):
+    """Arrival of the chunk each played block starts in -> the block reaching the device."""
+    return [played_at - model_in.times[i] for played_at, i in zip(speaker.times, matched) if i >= 0]
+
+
+def reply_delays(mic, model_in, reply_gap, max_delay):
+    """Last mic audio before each reply -> the reply's first audio; replies nobody spoke to are skipped."""
+    if not len(model_in.times) or not len(mic.times):
+        return []
+    starts = [model_in.times[0]] + [
+        t for prev, t in zip(model_in.times[:-1] + model_in.durations[:-1], model_in.times[1:]) if t - prev > reply_gap
+    ]
+    mic_ends = mic.times + mic.durations
+    delays = []
+    for start in starts:
+        before = mic_ends[mic_ends <= start]
+        if len(before) and start - before.max() <= max_delay:
+            delays.append(start - before.max())
+    return delays
+
+
+def export(track, directory):
+    """Write the unrolled track as a plain WAV, oldest audio first."""
+    pcm = track.pcm()
+    path = os.path.join(directory, f"{track.name}.unrolled.wav")
+    with open(path, "wb") as f:
+        f.write(WAV_HEADER.pack(b"RIFF", 36 + len(pcm), b"WAVE", b"fmt ", 16, 1, 1, track.rate, track.rate * 2, 2, 16,
+                                b"data", len(pcm)))
+        f.write(pcm)
+    return path
+
+
+def main(args):
+    tracks = {}
+    for name in ("mic", "model_in", "speaker"):
+        path = os.path.join(args.directory, f"{name}.wav")
+        if os.path.exists(path):
+            tracks[name] = Track(path)
+    if not tracks:
+        sys.exit(f"No tapped tracks in {args.directory}")
+    origin = min(t.times[0] for t in tracks.values() if len(t.times))
+    for track in tracks.values():
+        if not len(track.times):
+            print(f"{track.name:<9} empty")
+            continue
+        found = gaps(track, args.gap_ms / 1000)
+        print(f"{track.name:<9} {len(track.chunks)} chunks, {track.durations.sum():.1f} s of audio over "
+              f"{track.times[-1] - origin:.1f} s; {len(found)} gaps > {args.gap_ms:.0f} ms "
+              f"(total {found.sum():.2f} s, longest {found.max() * 1000 if len(found) else 0:.0f} ms)")
+        if args.export:
+            print(f"{'':<9} -> {export(track, args.directory)}")
+    reply_gap = args.reply_gap_ms / 1000
+    matched = None
+    if "model_in" in tracks and "speaker" in tracks:
+        matched = match_played(tracks["model_in"], tracks["speaker"])
+    if "speaker" in tracks:
+        replies = None if matched is None else [tracks["model_in"].replies[i] if i >= 0 else -1 for i in matched]
+        starved = underruns(tracks["speaker"], reply_gap, replies)
+        print(f"speaker underruns mid-reply: {len(starved)} (total {sum(starved) * 1000:.0f} ms)")
+    if matched is not None:
+        print(f"model_in -> speaker: {percentiles(arrival_to_playback(tracks['model_in'], tracks['speaker'], matched))}")
+    if "mic" in tracks and "model_in" in tracks:
+        delays = reply_delays(tracks["mic"], tracks["model_in"], reply_gap, args.max_reply_ms / 1000)
+        print(f"mic -> reply audio:  {percentiles(delays)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Align tapped session audio and report gaps, underruns and delay")
+    parser.add_argument("directory", help="One run's directory under AI_TUTOR_AUDIO_TAP_DIR")
+    parser.add_argument("--gap-ms", type=float, default=50, help="Pause between chunks counted as a gap")
+    parser.add_argument("--reply-gap-ms", type=float, default=1000,
+                        help="Silence that separates replies rather than interrupting one")
+    parser.add_argument("--max-reply-ms", type=float, default=5000,
+                        help="Longest mic -> reply delay still counted as an answer to the student")
+    parser.add_argument("--export", action="store_true", help="Also write each track unrolled as a plain WAV")
+    main(parser.parse_args())
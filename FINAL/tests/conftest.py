@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The host's modules live side by side in FINAL/, as the benchmarks import them
+FINAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FINAL_DIR)
@@ -0,0 +1,85 @@
+import asyncio
+
+from audio_buffer import AudioBuffer
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_put_and_read_wrap_around_the_ring():
+    async def main():
+        buffer = AudioBuffer(10)
+        await buffer.put(b"abcdefgh")
+        assert await buffer.read(6) == b"abcdef"
+        await buffer.put(b"ijklmn") # 2 bytes at the end of the ring, 4 at the start
+        assert buffer.capacity == 10
+        return await buffer.read(100)
+
+    assert run(main()) == b"ghijklmn"
+
+
+def test_read_returns_at_most_what_is_buffered():
+    async def main():
+        buffer = AudioBuffer(64)
+        await buffer.put(b"abc")
+        await buffer.put(b"def")
+        return await buffer.read(4), await buffer.read(4), len(buffer)
+
+    assert run(main()) == (b"abcd", b"ef", 0)
+
+
+def test_positions_survive_clear():
+    async def main():
+        buffer = AudioBuffer(16)
+        await buffer.put(b"0123456789")
+        await buffer.read(4)
+        assert (buffer.read_position, buffer.write_position) == (4, 10)
+        assert buffer.clear() == 6
+        assert (buffer.read_position, buffer.write_position) == (10, 10)
+        await buffer.put(b"xyz")
+        return buffer, await buffer.read(16)
+
+    buffer, out = run(main())
+    assert out == b"xyz"
+    assert buffer.read_position == buffer.write_position == 13
+    assert buffer.capacity == 16 # clear() doesn't reallocate
+
+
+def test_put_waits_for_room_then_wraps():
+    async def main():
+        buffer = AudioBuffer(8)
+        await buffer.put(b"abcdef")
+        waiter = asyncio.create_task(buffer.put(b"ghij"))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        assert await buffer.read(4) == b"abcd"
+        assert await asyncio.wait_for(waiter, 1)
+        return buffer, await buffer.read(8)
+
+    buffer, out = run(main())
+    assert out == b"efghij"
+    assert buffer.counters["budget_waits"] == 1
+
+
+def test_put_waiting_across_clear_is_dropped():
+    async def main():
+        buffer = AudioBuffer(8)
+        await buffer.put(b"abcdef")
+        waiter = asyncio.create_task(buffer.put(b"ghij"))
+        await asyncio.sleep(0)
+        buffer.clear()
+        return await asyncio.wait_for(waiter, 1), buffer
+
+    accepted, buffer = run(main())
+    assert accepted is False
+    assert buffer.empty()
+
+
+def test_oversized_chunk_gets_a_ring_of_its_own():
+    async def main():
+        buffer = AudioBuffer(4)
+        await buffer.put(b"abcdefgh")
+        return await buffer.read(100)
+
+    assert run(main()) == b"abcdefgh"
@@ -0,0 +1,126 @@
+import asyncio
+
+from audio_capture import MicCapture
+
+
+class StubStream:
+    """Stands in for a PyAudio stream; the tests call the capture's callback themselves."""
+
+    def start_stream(self):
+        pass
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StubSource:
+    def open_stream(self, rate, channels=1, frames_per_buffer=1024, stream_callback=None, start=True):
+        return StubStream()
+
+
+def frames(start, count):
+    """`count` int16 frames numbered from `start`, so any slip or repeat shows."""
+    return b"".join((i % 32768).to_bytes(2, "little") for i in range(start, start + count))
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def open_mic(**kwargs):
+    mic = MicCapture(rate=1000, frames_per_buffer=100, buffer_seconds=0.5, **kwargs) # 500-frame ring
+    await mic.open(StubSource())
+    return mic
+
+
+def test_reads_wrap_around_the_ring():
+    async def main():
+        mic = await open_mic()
+        out = b""
+        for i in range(12): # 1200 frames through a 500-frame ring, read as they come
+            mic._callback(frames(i * 100, 100), 100, None, 0)
+            out += await mic.read(100)
+        return mic, out
+
+    mic, out = run(main())
+    assert out == frames(0, 1200)
+    assert mic.counters["ring_overrun_frames"] == 0
+
+
+def test_reads_that_straddle_the_end_of_the_ring():
+    async def main():
+        mic = await open_mic()
+        for i in range(4):
+            mic._callback(frames(i * 100, 100), 100, None, 0)
+        assert await mic.read(350) == frames(0, 350)
+        for i in range(4, 7):
+            mic._callback(frames(i * 100, 100), 100, None, 0)
+        return await mic.read(300) # Frames 350-649: ring index 350 round to 149
+
+    assert run(main()) == frames(350, 300)
+
+
+def test_overrun_keeps_the_newest_audio():
+    async def main():
+        mic = await open_mic()
+        for i in range(7):
+            mic._callback(frames(i * 100, 100), 100, None, 0)
+        return mic, await mic.read(500)
+
+    mic, out = run(main())
+    assert out == frames(200, 500)
+    assert mic.counters["ring_overrun_frames"] == 200
+
+
+def test_discard_and_resume_drop_old_audio():
+    async def main():
+        mic = await open_mic()
+        mic._callback(frames(0, 300), 300, None, 0)
+        mic.discard()
+        assert mic.buffered_frames == 0
+        mic._callback(frames(300, 100), 100, None, 0)
+        assert await mic.read(100) == frames(300, 100)
+        await mic.pause()
+        mic._callback(frames(400, 100), 100, None, 0) # Still in flight as the stream stopped
+        await mic.resume()
+        mic._callback(frames(500, 100), 100, None, 0)
+        return mic, await mic.read(100)
+
+    mic, out = run(main())
+    assert out == frames(500, 100)
+    assert mic.buffered_frames == 0
+    assert mic.counters["restarts"] == 1
+
+
+def test_preroll_on_unmute():
+    async def main():
+        mic = await open_mic(preroll_ms=200) # 200 frames
+        await mic.mute() # Keeps running into the ring
+        assert mic.active
+        for i in range(4):
+            mic._callback(frames(i * 100, 100), 100, None, 0)
+        await mic.unmute()
+        mic._callback(frames(400, 100), 100, None, 0)
+        return mic, await mic.read(300)
+
+    mic, out = run(main())
+    assert out == frames(200, 300)
+    assert mic.counters["preroll_frames_sent"] == 200
+
+
+def test_reopen_at_another_rate_starts_a_fresh_ring():
+    async def main():
+        mic = await open_mic()
+        mic._callback(frames(0, 300), 300, None, 0)
+        await mic.close()
+        await mic.open(StubSource(), rate=2000)
+        assert (mic.rate, mic.frames_per_buffer) == (2000, 200)
+        assert mic.buffered_frames == 0
+        for i in range(12): # Wraps the new 1000-frame ring
+            mic._callback(frames(i * 200, 200), 200, None, 0)
+        return await mic.read(1000)
+
+    assert run(main()) == frames(1400, 1000)
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from outbound_queue import OutboundQueue, message_kind
+
+BOUNDS = {"control": 100, "image": 1000, "audio": 40}
+
+
+def audio(data):
+    return {"data": data, "mime_type": "audio/pcm"}
+
+
+def image(size, tag=b"i"):
+    return {"data": tag * size, "mime_type": "image/png"}
+
+
+def drain(queue):
+    out = []
+    while not queue.empty():
+        out.append(queue.get_nowait())
+        queue.task_done()
+    return out
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_lanes_are_served_in_priority_order():
+    async def main():
+        queue = OutboundQueue(BOUNDS)
+        queue.put_nowait(audio(b"a1"))
+        queue.put_nowait(image(10))
+        queue.put_nowait(audio(b"a2"))
+        queue.put_nowait("prompt")
+        return drain(queue)
+
+    out = run(main())
+    assert [message_kind(msg) for msg in out] == ["image", "control", "audio", "audio"]
+    assert [msg["data"] for msg in out[2:]] == [b"a1", b"a2"]
+
+
+def test_text_never_overtakes_an_earlier_image():
+    async def main():
+        queue = OutboundQueue(BOUNDS)
+        await queue.put("prompt")
+        await queue.put(image(10, b"x"))
+        await queue.put("Please analyze the image")
+        await queue.put(image(10, b"y"))
+        return drain(queue)
+
+    out = run(main())
+    assert out[0] == "prompt"
+    assert out[1]["data"] == b"x" * 10
+    # The second image was queued after the text, so the text goes first
+    assert out[2] == "Please analyze the image"
+    assert out[3]["data"] == b"y" * 10
+
+
+def test_full_audio_lane_drops_oldest_first():
+    async def main():
+        queue = OutboundQueue(BOUNDS)
+        for i in range(6):
+            queue.put_nowait(audio(bytes([i]) * 10))
+        return queue, drain(queue)
+
+    queue, out = run(main())
+    assert [msg["data"][0] for msg in out] == [2, 3, 4, 5]
+    assert queue.counters["audio_dropped_chunks"] == 2
+    assert queue.counters["audio_dropped_bytes"] == 20
+    # Dropped chunks aren't left owing a task_done()
+    with pytest.raises(ValueError):
+        queue.task_done()
+
+
+def test_put_nowait_on_a_full_image_lane_raises():
+    async def main():
+        queue = OutboundQueue(BOUNDS)
+        queue.put_nowait(image(800))
+        with pytest.raises(asyncio.QueueFull):
+            queue.put_nowait(image(800))
+        return queue
+
+    queue = run(main())
+    assert queue.qsize() == 1
+    assert queue.stats()["lanes"]["image"]["bytes"] == 800
+
+
+def test_forced_put_goes_past_the_bound():
+    async def main():
+        queue = OutboundQueue(BOUNDS)
+        queue.put_nowait(image(800))
+        queue.put_nowait(image(800), force=True)
+        for i in range(6):
+            queue.put_nowait(audio(bytes([i]) * 10), force=True)
+        return queue, drain(queue)
+
+    queue, out = run(main())
+    assert len(out) == 8
+    assert queue.peak_bytes["image"] == 1600
+    assert queue.peak_bytes["audio"] == 60
+    assert "audio_dropped_chunks" not in queue.counters
+
+
+def test_oversized_message_still_fits_an_empty_lane():
+    async def main():
+        queue = OutboundQueue(BOUNDS)
+        queue.put_nowait(image(5000))
+        # ...but nothing else joins it until it has gone
+        with pytest.raises(asyncio.QueueFull):
+            queue.put_nowait(image(10))
+        queue.get_nowait()
+        queue.task_done()
+        queue.put_nowait(image(10))
+        return queue
+
+    queue = run(main())
+    assert queue.qsize() == 1
+
+
+def test_put_waits_for_room_in_a_full_lane():
+    async def main():
+        queue = OutboundQueue(BOUNDS)
+        await queue.put(image(800, b"x"))
+        waiter = asyncio.create_task(queue.put(image(800, b"y")))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        assert queue.get_nowait()["data"][:1] == b"x"
+        queue.task_done()
+        await asyncio.wait_for(waiter, 1)
+        return queue
+
+    queue = run(main())
+    assert queue.counters["image_put_waits"] == 1
+    assert queue.get_nowait()["data"][:1] == b"y"
+
+
+def test_get_waits_for_a_message():
+    async def main():
+        queue = OutboundQueue(BOUNDS)
+        getter = asyncio.create_task(queue.get())
+        await asyncio.sleep(0)
+        assert not getter.done()
+        queue.put_nowait(audio(b"a"))
+        return await asyncio.wait_for(getter, 1)
+
+    assert run(main())["data"] == b"a"
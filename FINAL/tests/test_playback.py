@@ -0,0 +1,158 @@
+import asyncio
+
+from playback import PlaybackEngine
+
+
+class StubStream:
+    """Stands in for a PyAudio stream; the tests call the engine's callback themselves."""
+
+    def start_stream(self):
+        pass
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StubSink:
+    def open_stream(self, rate, channels=1, frames_per_buffer=1024, stream_callback=None, start=True):
+        return StubStream()
+
+
+def frames(start, count):
+    """`count` int16 frames numbered from `start`, so any slip or repeat shows."""
+    return b"".join((i % 32768).to_bytes(2, "little") for i in range(start, start + count))
+
+
+def silence(count):
+    return bytes(2 * count)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def open_engine(**kwargs):
+    engine = PlaybackEngine(rate=1000, frames_per_buffer=100, buffer_seconds=0.5, idle_stop_seconds=60,
+                            **kwargs) # 500-frame ring
+    await engine.open(StubSink())
+    return engine
+
+
+def play(engine, count=100):
+    out, _ = engine._callback(None, count, None, 0)
+    return out
+
+
+def test_playback_wraps_around_the_ring():
+    async def main():
+        engine = await open_engine()
+        out = b""
+        for i in range(4): # 1200 frames through a 500-frame ring
+            assert await engine.write(frames(i * 300, 300))
+            out += b"".join(play(engine) for _ in range(3))
+        return engine, out
+
+    engine, out = run(main())
+    assert out == frames(0, 1200)
+    assert engine.counters["frames_played"] == 1200
+    assert engine.buffered_frames == 0
+
+
+def test_write_waits_for_room_and_the_callback_wakes_it():
+    async def main():
+        engine = await open_engine()
+        writer = asyncio.create_task(engine.write(frames(0, 800)))
+        await asyncio.sleep(0)
+        assert not writer.done() # 500 frames in, 300 waiting
+        out = b""
+        while not writer.done():
+            out += play(engine)
+            await asyncio.sleep(0) # Let the callback's wake-up run
+        assert writer.result()
+        while engine.buffered_frames:
+            out += play(engine)
+        return out
+
+    assert run(main()) == frames(0, 800)
+
+
+def test_running_dry_pads_with_silence():
+    async def main():
+        engine = await open_engine()
+        await engine.write(frames(0, 150))
+        return engine, play(engine), play(engine), play(engine)
+
+    engine, first, second, third = run(main())
+    assert first == frames(0, 100)
+    assert second == frames(100, 50) + silence(50)
+    assert third == silence(100)
+    assert engine.counters["ran_dry"] == 1
+
+
+def test_flush_silences_the_next_period_and_later_audio_plays():
+    async def main():
+        engine = await open_engine()
+        await engine.write(frames(0, 400))
+        first = play(engine)
+        engine.flush()
+        after_flush = play(engine)
+        await engine.write(frames(1000, 450)) # Wraps: the ring's read position moved on to 400
+        rest = b"".join(play(engine) for _ in range(5))
+        return engine, first, after_flush, rest
+
+    engine, first, after_flush, rest = run(main())
+    assert first == frames(0, 100)
+    assert after_flush == silence(100)
+    assert rest == frames(1000, 450) + silence(50)
+    assert engine.counters["frames_flushed"] == 300
+
+
+def test_write_waiting_across_flush_is_dropped():
+    async def main():
+        engine = await open_engine()
+        await engine.write(frames(0, 500))
+        writer = asyncio.create_task(engine.write(frames(500, 100)))
+        await asyncio.sleep(0)
+        engine.flush()
+        accepted = await asyncio.wait_for(writer, 1)
+        return engine, accepted, play(engine)
+
+    engine, accepted, out = run(main())
+    assert accepted is False
+    assert out == silence(100)
+
+
+def test_marks_report_when_played_and_never_once_flushed():
+    played = []
+
+    async def main():
+        engine = await open_engine(on_played=lambda mark, at, gap: played.append((mark, gap)))
+        await engine.write(frames(0, 150), "a")
+        await engine.write(frames(150, 150), "b")
+        play(engine) # Reaches "a"
+        play(engine) # Reaches "b", 50 frames in
+        await engine.write(frames(300, 100), "c")
+        engine.flush()
+        play(engine)
+        await asyncio.sleep(0) # Reports arrive on the loop
+        return engine
+
+    engine = run(main())
+    assert [mark for mark, _ in played] == ["a", "b"]
+    assert played[1][1] == 0 # "b" followed "a" without a gap
+    assert not engine._marks
+
+
+def test_close_drops_what_is_buffered():
+    async def main():
+        engine = await open_engine()
+        await engine.write(frames(0, 300))
+        await engine.close()
+        return engine
+
+    engine = run(main())
+    assert engine.buffered_frames == 0
+    assert engine.stream is None
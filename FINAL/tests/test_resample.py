@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from resample import PolyphaseResampler
+
+RATES = [(48000, 16000), (16000, 24000), (24000, 48000), (24000, 44100), (44100, 16000)]
+
+
+def tone(rate, seconds=0.5, hz=440.0):
+    t = np.arange(int(rate * seconds)) / rate
+    return (8000 * np.sin(2 * np.pi * hz * t)).astype("<i2").tobytes()
+
+
+def in_blocks(resampler, pcm, sizes):
+    """Feed `pcm` through in blocks of the given frame counts, cycling through them."""
+    out, offset, i = [], 0, 0
+    while offset < len(pcm):
+        size = 2 * sizes[i % len(sizes)]
+        out.append(resampler.process(pcm[offset:offset + size]))
+        offset += size
+        i += 1
+    return b"".join(out)
+
+
+@pytest.mark.parametrize("in_rate,out_rate", RATES)
+def test_block_size_does_not_change_the_output(in_rate, out_rate):
+    pcm = tone(in_rate, seconds=0.1)
+    whole = PolyphaseResampler(in_rate, out_rate).process(pcm)
+    for sizes in ([1024], [160], [1], [7, 300, 1, 4096, 33], [0, 512]):
+        assert in_blocks(PolyphaseResampler(in_rate, out_rate), pcm, sizes) == whole, sizes
+
+
+@pytest.mark.parametrize("in_rate,out_rate", RATES)
+def test_output_length_follows_the_ratio(in_rate, out_rate):
+    pcm = tone(in_rate, seconds=1.0)
+    resampler = PolyphaseResampler(in_rate, out_rate)
+    total = len(in_blocks(resampler, pcm, [441, 1000])) // 2
+    assert abs(total - out_rate) <= 1
+
+
+def test_reset_forgets_the_previous_stream():
+    first, second = tone(48000, hz=300.0), tone(48000, hz=1000.0)
+    fresh = PolyphaseResampler(48000, 16000).process(second)
+    resampler = PolyphaseResampler(48000, 16000)
+    resampler.process(first[:1000]) # Leaves history and a phase behind
+    resampler.reset()
+    assert resampler.process(second) == fresh
+
+
+def test_tone_keeps_its_level_after_the_filter_delay():
+    pcm = tone(48000, seconds=1.0)
+    resampler = PolyphaseResampler(48000, 16000)
+    out = np.frombuffer(in_blocks(resampler, pcm, [480]), dtype="<i2").astype(np.float64)
+    settled = out[int(resampler.delay_seconds * 16000) + 160:]
+    rms = np.sqrt(np.mean(settled ** 2))
+    assert rms == pytest.approx(8000 / np.sqrt(2), rel=0.02)
@@ -0,0 +1,145 @@
+"""
+## Voice-activity gate for the upstream mic stream
+Sits between capture and out_queue so silence isn't shipped to Gemini. Each
+chunk is split into 20 ms frames and classified in one vectorized pass; a
+speech segment is sent with some pre-padding (audio from just before speech
+was detected) and a hangover (trailing silence, so the server still hears the
+end of the utterance). Silence in between is dropped, or replaced by a tiny
+keepalive frame every so often.
+
+Backends are callables taking an (n_frames, frame_len) int16 array and
+returning a boolean speech mask per frame; add new ones to VAD_BACKENDS.
+"""
+
+import collections
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FRAME_MS = 20
+
+
+class EnergyZcrVad:
+    """Speech = loud enough above the noise floor, with a zero-crossing rate in the speech range.
+
+    The zero-crossing check rejects loud low hum (too few crossings) and hiss
+    or fan noise (too many), which energy alone would let through.
+    """
+
+    def __init__(self, threshold_dbfs=-50.0, floor_ratio=3.0, zcr_range=(0.01, 0.35), floor_adapt=0.05):
+        self.threshold = 10 ** (threshold_dbfs / 20) * 32768
+        self.floor_ratio = floor_ratio # Speech must be this many times the noise floor's RMS
+        self.zcr_min, self.zcr_max = zcr_range
+        self.floor_adapt = floor_adapt
+        self.noise_floor = self.threshold / floor_ratio
+
+    def __call__(self, frames):
+        x = frames.astype(np.float32)
+        rms = np.sqrt(np.mean(x * x, axis=1))
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frames.shape[1] - 1)
+        loud = rms > max(self.threshold, self.noise_floor * self.floor_ratio)
+        quiet = rms[~loud]
+        if quiet.size:
+            # Track the background from quiet frames only; loud hum or hiss is the ZCR test's job,
+            # and letting it raise the floor would mask speech for a while afterwards
+            self.noise_floor += self.floor_adapt * (float(np.mean(quiet)) - self.noise_floor)
+        return loud & (zcr >= self.zcr_min) & (zcr <= self.zcr_max)
+
+
+class WebRtcVad:
+    """Google's WebRTC VAD (pip install webrtcvad); needs 10/20/30 ms frames at 8-48 kHz."""
+
+    def __init__(self, rate, aggressiveness=2):
+        import webrtcvad
+        self.rate = rate
+        self.vad = webrtcvad.Vad(aggressiveness)
+
+    def __call__(self, frames):
+        return np.array([self.vad.is_speech(frame.tobytes(), self.rate) for frame in frames])
+
+
+VAD_BACKENDS = {
+    "energy": lambda rate: EnergyZcrVad(),
+    "webrtc": lambda rate: WebRtcVad(rate),
+}
+
+
+class VoiceGate:
+    """Decides which captured chunks go upstream. `process(chunk)` returns the chunks to send now."""
+
+    def __init__(self, backend="energy", rate=16000, hangover_ms=500, pre_padding_ms=200,
+                 silence="keepalive", keepalive_ms=1000, keepalive_frame_ms=10):
+        self.rate = rate
+        self.backend_name = backend
+        self.backend = VAD_BACKENDS[backend](rate)
+        self.frame_len = rate * FRAME_MS // 1000
+        self.hangover_ms = hangover_ms
+        self.pre_padding_ms = pre_padding_ms
+        self.silence = silence # "keepalive" or "drop"
+        self.keepalive_ms = keepalive_ms
+        self.keepalive_frame = bytes(rate * keepalive_frame_ms // 1000 * 2)
+        self._pre_roll = collections.deque()
+        self._pre_roll_ms = 0.0
+        self.counters = {"bytes_captured": 0, "bytes_sent": 0, "chunks_suppressed": 0,
+                         "keepalives_sent": 0, "speech_segments": 0}
+        self.reset()
+
+    def reset(self):
+        """Forget the current segment, e.g. after the mic was muted."""
+        self.active = False
+        self._silent_ms = 0.0
+        self._since_sent_ms = 0.0
+        self._pre_roll.clear()
+        self._pre_roll_ms = 0.0
+
+    def is_speech(self, chunk):
+        samples = np.frombuffer(chunk, dtype="<i2")
+        usable = len(samples) - len(samples) % self.frame_len
+        if not usable:
+            return bool(self.backend(samples.reshape(1, -1)).any())
+        return bool(self.backend(samples[:usable].reshape(-1, self.frame_len)).any())
+
+    def _ms(self, chunk):
+        return len(chunk) / 2 * 1000 / self.rate
+
+    def process(self, chunk):
+        chunk_ms = self._ms(chunk)
+        self.counters["bytes_captured"] += len(chunk)
+        out = []
+        if self.is_speech(chunk):
+            if not self.active:
+                self.active = True
+                self.counters["speech_segments"] += 1
+                out.extend(self._pre_roll)
+                self._pre_roll.clear()
+                self._pre_roll_ms = 0.0
+            self._silent_ms = 0.0
+            out.append(chunk)
+        elif self.active:
+            out.append(chunk) # Hangover: let the trailing silence through
+            self._silent_ms += chunk_ms
+            if self._silent_ms >= self.hangover_ms:
+                self.active = False
+        else:
+            self.counters["chunks_suppressed"] += 1
+            self._pre_roll.append(chunk)
+            self._pre_roll_ms += chunk_ms
+            # Keep just enough of the most recent silence to cover pre_padding_ms
+            while self._pre_roll and self._pre_roll_ms - self._ms(self._pre_roll[0]) >= self.pre_padding_ms:
+                self._pre_roll_ms -= self._ms(self._pre_roll.popleft())
+            self._since_sent_ms += chunk_ms
+            if self.silence == "keepalive" and self._since_sent_ms >= self.keepalive_ms:
+                out.append(self.keepalive_frame)
+                self.counters["keepalives_sent"] += 1
+        if out:
+            self._since_sent_ms = 0.0
+            self.counters["bytes_sent"] += sum(len(c) for c in out)
+        return out
+
+    def stats(self):
+        captured = self.counters["bytes_captured"]
+        saved = 1 - self.counters["bytes_sent"] / captured if captured else 0.0
+        return dict(self.counters, backend=self.backend_name, saved_pct=round(saved * 100, 1))
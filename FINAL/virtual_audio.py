@@ -0,0 +1,153 @@
+"""
+## Virtual audio streams for headless runs
+Streams with PyAudio's API that need no sound card (or PyAudio at all). Input
+streams produce looped PCM (a tone, silence or a file's audio) and output
+streams swallow audio, both paced against the wall clock like a real device,
+so the rest of the pipeline sees realistic timing. The sources and sinks in
+audio_devices.py hand these out.
+"""
+
+import math
+import struct
+import threading
+import time
+
+# Same values as PyAudio's constants
+paInt16 = 8
+paContinue = 0
+paInputOverflow = 2
+paOutputUnderflow = 4
+
+BYTES_PER_SAMPLE = 2
+INPUT_BUFFER_SECONDS = 0.5
+
+
+def tone_pcm(sample_rate, frequency=440.0, seconds=1.0, amplitude=0.3):
+    """16-bit mono PCM sine wave, used as stand-in speech for the virtual mic."""
+    count = int(sample_rate * seconds)
+    scale = amplitude * 32767
+    samples = (int(scale * math.sin(2 * math.pi * frequency * i / sample_rate)) for i in range(count))
+    return struct.pack(f"<{count}h", *samples)
+
+
+class VirtualStream:
+    """A paced mono input or output stream with PyAudio's blocking and callback APIs."""
+
+    def __init__(self, rate, channels=1, input=False, output=False, frames_per_buffer=1024,
+                 input_mode="tone", output_buffer_ms=100, stream_callback=None, source_pcm=None,
+                 paced=True, on_write=None, **kwargs):
+        self.rate = rate
+        self.channels = channels
+        self.is_input = input
+        self.is_output = output
+        self.frames_per_buffer = frames_per_buffer
+        self._frame_bytes = BYTES_PER_SAMPLE * channels
+        self._output_buffer = output_buffer_ms / 1000
+        self.paced = paced # False: writes return at once, for unthrottled throughput runs
+        self._on_write = on_write # Gets each written buffer, e.g. to record it
+        self._active = kwargs.get("start", True)
+        self._lock = threading.Lock()
+        self._clock = time.perf_counter() # Device time: next sample to capture / play
+        # Mono source audio, looped: given PCM, a steady tone, a tone for 1 s in every 3 (speech with pauses), or silence
+        if source_pcm:
+            self._source = source_pcm
+        elif input_mode == "tone":
+            self._source = tone_pcm(rate)
+        elif input_mode == "bursts":
+            self._source = tone_pcm(rate) + bytes(2 * rate * self._frame_bytes)
+        else:
+            self._source = bytes(rate * self._frame_bytes)
+        self._source_pos = 0
+        self.frames_written = 0
+        self._callback = stream_callback
+        self._callback_thread = None
+        self._stopping = threading.Event() # Lets stop_stream interrupt the callback thread's wait
+        if self._callback and self._active:
+            self._start_callback_thread()
+
+    def _next_input(self, size):
+        out = bytearray()
+        while len(out) < size:
+            chunk = self._source[self._source_pos:self._source_pos + size - len(out)]
+            out += chunk
+            self._source_pos = (self._source_pos + len(chunk)) % len(self._source)
+        return bytes(out)
+
+    def _start_callback_thread(self):
+        self._stopping.clear()
+        self._callback_thread = threading.Thread(target=self._run_callbacks, name="VirtualAudioCallback", daemon=True)
+        self._callback_thread.start()
+
+    def _run_callbacks(self):
+        """Exchange a buffer with the callback every frames_per_buffer frames, like PortAudio's audio thread."""
+        period = self.frames_per_buffer / self.rate
+        due = time.perf_counter() + period
+        while self._active:
+            delay = due - time.perf_counter()
+            if delay > 0 and self.paced and self._stopping.wait(delay):
+                break
+            status = 0
+            if self.paced and time.perf_counter() - due > INPUT_BUFFER_SECONDS:
+                # The callback took so long that the device buffer would have overflowed (or run dry)
+                status = paOutputUnderflow if self.is_output else paInputOverflow
+                due = time.perf_counter()
+            if not self._active:
+                break
+            if self.is_output:
+                out, _ = self._callback(None, self.frames_per_buffer, {}, status)
+                self.frames_written += self.frames_per_buffer
+                if self._on_write:
+                    self._on_write(out)
+            else:
+                self._callback(self._next_input(self.frames_per_buffer * self._frame_bytes),
+                               self.frames_per_buffer, {}, status)
+            due += period
+
+    def read(self, num_frames, exception_on_overflow=True):
+        """Return `num_frames` of input, blocking until the device would have captured them."""
+        with self._lock:
+            # A late reader finds up to a device buffer already captured, like real hardware
+            self._clock = max(self._clock, time.perf_counter() - INPUT_BUFFER_SECONDS) + num_frames / self.rate
+            wait = self._clock - time.perf_counter()
+            out = self._next_input(num_frames * self._frame_bytes)
+        if wait > 0:
+            time.sleep(wait)
+        return out
+
+    def write(self, data, num_frames=None, exception_on_underflow=False):
+        """Accept audio, blocking once more than the device buffer is queued ahead of playback."""
+        frames = len(data) // self._frame_bytes
+        if self._on_write:
+            self._on_write(data)
+        with self._lock:
+            now = time.perf_counter()
+            self._clock = max(self._clock, now) + frames / self.rate
+            wait = self._clock - now - self._output_buffer
+            self.frames_written += frames
+        if wait > 0 and self.paced:
+            time.sleep(wait)
+
+    def start_stream(self):
+        if self._active:
+            return
+        self._active = True
+        self._clock = time.perf_counter()
+        if self._callback:
+            self._start_callback_thread()
+
+    def stop_stream(self):
+        self._active = False
+        self._stopping.set()
+        thread, self._callback_thread = self._callback_thread, None
+        if thread and thread is not threading.current_thread():
+            thread.join()
+
+    def is_active(self):
+        return self._active
+
+    def is_stopped(self):
+        return not self._active
+
+    def close(self):
+        self.stop_stream()
+
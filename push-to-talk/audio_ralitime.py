@@ -27,11 +27,15 @@ import logging
 import argparse
 from dotenv import load_dotenv
 
-import pyaudio
 import PIL.Image
 from google import genai
 from google.genai import types # Import types for config
 
+# The microphone capture engine is shared with the native host in FINAL/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "FINAL"))
+from audio_capture import MicCapture
+from audio_devices import create_sink, create_source
+
 # Load environment variables (for API key)
 load_dotenv()
 
@@ -46,11 +50,11 @@ MODEL_NAME = "models/gemini-2.0-flash-live-001"
 DEFAULT_IMAGE_PATH = None
 
 # Audio settings (Match working example where possible)
-FORMAT = pyaudio.paInt16
 CHANNELS = 1
 SEND_SAMPLE_RATE = 16000 # Rate for microphone input
 RECEIVE_SAMPLE_RATE = 24000 # Rate expected for audio output from model
 CHUNK_SIZE = 1024
+FRAMES_PER_BUFFER = 1024 # PortAudio callback period; --frames-per-buffer overrides
 
 # Define a system prompt for tutoring
 TUTOR_PROMPT = """
@@ -84,13 +88,15 @@ LIVE_CONFIG = types.LiveConnectConfig(
 )
 
 class GeminiTutor:
-    def __init__(self, api_key: str, image_path: str = None):
+    def __init__(self, api_key: str, image_path: str = None, frames_per_buffer: int = FRAMES_PER_BUFFER,
+                 source: str = "pyaudio", sink: str = "pyaudio"):
         if not api_key:
             raise ValueError("API key is required. Set GOOGLE_API_KEY environment variable.")
         self.api_key = api_key
         self.image_path = image_path
-        self.pya = pyaudio.PyAudio()
-        self.audio_stream = None
+        self.audio_source = create_source(source)
+        self.audio_sink = create_sink(sink)
+        self.mic = MicCapture(rate=SEND_SAMPLE_RATE, channels=CHANNELS, frames_per_buffer=frames_per_buffer)
         self.session = None
         self.audio_in_queue = asyncio.Queue() # Queue for incoming audio from Gemini
         self.out_queue = asyncio.Queue(maxsize=20) # Queue for outgoing audio/image data to Gemini
@@ -233,20 +239,10 @@ class GeminiTutor:
 
     async def listen_audio(self):
         """Capture audio from the microphone and put it into out_queue."""
-        audio_stream = None
         try:
             # --- Outer Try: For stream opening ---
-            mic_info = self.pya.get_default_input_device_info()
-            logger.info(f"Using microphone: {mic_info['name']}")
-            audio_stream = await asyncio.to_thread(
-                self.pya.open,
-                format=FORMAT,
-                channels=CHANNELS,
-                rate=SEND_SAMPLE_RATE,
-                input=True,
-                input_device_index=mic_info["index"],
-                frames_per_buffer=CHUNK_SIZE,
-            )
+            logger.info(f"Using microphone: {self.audio_source.device_info()['name']}")
+            await self.mic.open(self.audio_source)
             logger.info("Microphone stream opened. Listening...")
 
             # --- Loop moved inside the outer try ---
@@ -256,12 +252,8 @@ class GeminiTutor:
                      continue
                 try:
                     # --- Inner Try: For reading/queueing ---
-                    data = await asyncio.to_thread(audio_stream.read, CHUNK_SIZE, exception_on_overflow=False)
+                    data = await self.mic.read(CHUNK_SIZE)
                     await self.out_queue.put({"data": data, "mime_type": "audio/pcm"})
-                except OSError as e:
-                     # Handle specific, potentially harmless errors
-                     logger.warning(f"Error reading from audio stream (likely harmless overflow): {e}")
-                     await asyncio.sleep(0.01) 
                 except Exception as e:
                      # Catch other critical errors during read/queue
                      logger.error(f"Unexpected error in listen_audio loop: {e}", exc_info=True)
@@ -273,14 +265,9 @@ class GeminiTutor:
              raise asyncio.CancelledError("Microphone initialization failed") # Reraise to signal failure
         finally:
             # --- Finally: Always runs to close the stream ---
-            if audio_stream:
-                logger.info("Closing microphone stream in listen_audio.")
-                try:
-                    await asyncio.to_thread(audio_stream.stop_stream)
-                    await asyncio.to_thread(audio_stream.close)
-                except Exception as e:
-                    # Log error during close but don't prevent further cleanup
-                    logger.error(f"Error closing audio stream: {e}") 
+            stats = self.mic.stats()
+            logger.info(f"Microphone overflows: device={stats['input_overflows']}, ring={stats['ring_overrun_frames']} frames")
+            await self.mic.close()
         logger.info("Listen audio task finished.")
                  
     async def receive_audio(self):
@@ -326,11 +313,9 @@ class GeminiTutor:
         try:
             logger.info("Initializing audio playback stream...")
             stream = await asyncio.to_thread(
-                self.pya.open,
-                format=FORMAT,
-                channels=CHANNELS,
+                self.audio_sink.open_stream,
                 rate=RECEIVE_SAMPLE_RATE, # Use receive rate from example
-                output=True,
+                channels=CHANNELS,
             )
             logger.info("Audio playback stream opened.")
             while True:
@@ -418,11 +403,11 @@ class GeminiTutor:
             # before streams/clients are potentially closed.
             await asyncio.sleep(0.1)
 
-            # PyAudio cleanup (should happen after tasks using pya are done)
+            # Audio device cleanup (should happen after tasks using them are done)
             # The audio stream itself is closed within the listen_audio task's finally block
-            if self.pya:
-                logger.info("Terminating PyAudio.")
-                await asyncio.to_thread(self.pya.terminate)
+            logger.info("Closing audio devices.")
+            await asyncio.to_thread(self.audio_source.close)
+            await asyncio.to_thread(self.audio_sink.close)
 
             # Session cleanup (if the API provides a close method)
             if self.session and hasattr(self.session, 'close'):
@@ -447,6 +432,24 @@ if __name__ == "__main__":
         default=DEFAULT_IMAGE_PATH,
         help="Path to the image file containing a math or English problem",
     )
+    parser.add_argument(
+        "--frames-per-buffer",
+        type=int,
+        default=FRAMES_PER_BUFFER,
+        help="Microphone frames per PortAudio callback",
+    )
+    parser.add_argument(
+        "--source",
+        type=str,
+        default="pyaudio",
+        help="Microphone: pyaudio, tone, bursts, null or wav:PATH",
+    )
+    parser.add_argument(
+        "--sink",
+        type=str,
+        default="pyaudio",
+        help="Speaker: pyaudio, null, discard or wav:PATH",
+    )
     args = parser.parse_args()
     
     if not args.image:
@@ -463,7 +466,8 @@ if __name__ == "__main__":
         sys.exit(1)
 
     try:
-        tutor = GeminiTutor(api_key=api_key_to_use, image_path=args.image)
+        tutor = GeminiTutor(api_key=api_key_to_use, image_path=args.image, frames_per_buffer=args.frames_per_buffer,
+                            source=args.source, sink=args.sink)
         asyncio.run(tutor.run())
     except ValueError as e:
          print(f"Error: {e}")
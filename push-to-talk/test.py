@@ -17,20 +17,26 @@ import io
 import traceback
 
 import cv2
-import pyaudio
 import PIL.Image
 import mss
 
 import argparse
+import os
+import sys
 
 from google import genai
 from google.genai import types
 
-FORMAT = pyaudio.paInt16
+# The microphone capture engine is shared with the native host in FINAL/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "FINAL"))
+from audio_capture import MicCapture
+from audio_devices import create_sink, create_source
+
 CHANNELS = 1
 SEND_SAMPLE_RATE = 16000
 RECEIVE_SAMPLE_RATE = 24000
 CHUNK_SIZE = 1024
+FRAMES_PER_BUFFER = 1024
 
 MODEL = "models/gemini-2.0-flash-live-001"
 
@@ -56,12 +62,12 @@ CONFIG = types.LiveConnectConfig(
     ),
 )
 
-pya = pyaudio.PyAudio()
-
-
 class AudioLoop:
-    def __init__(self, video_mode=DEFAULT_MODE):
+    def __init__(self, video_mode=DEFAULT_MODE, frames_per_buffer=FRAMES_PER_BUFFER, source="pyaudio", sink="pyaudio"):
         self.video_mode = video_mode
+        self.audio_source = create_source(source)
+        self.audio_sink = create_sink(sink)
+        self.mic = MicCapture(rate=SEND_SAMPLE_RATE, channels=CHANNELS, frames_per_buffer=frames_per_buffer)
 
         self.audio_in_queue = None
         self.out_queue = None
@@ -156,22 +162,9 @@ class AudioLoop:
             await self.session.send(input=msg)
 
     async def listen_audio(self):
-        mic_info = pya.get_default_input_device_info()
-        self.audio_stream = await asyncio.to_thread(
-            pya.open,
-            format=FORMAT,
-            channels=CHANNELS,
-            rate=SEND_SAMPLE_RATE,
-            input=True,
-            input_device_index=mic_info["index"],
-            frames_per_buffer=CHUNK_SIZE,
-        )
-        if __debug__:
-            kwargs = {"exception_on_overflow": False}
-        else:
-            kwargs = {}
+        await self.mic.open(self.audio_source)
         while True:
-            data = await asyncio.to_thread(self.audio_stream.read, CHUNK_SIZE, **kwargs)
+            data = await self.mic.read(CHUNK_SIZE)
             await self.out_queue.put({"data": data, "mime_type": "audio/pcm"})
 
     async def receive_audio(self):
@@ -193,13 +186,7 @@ class AudioLoop:
                 self.audio_in_queue.get_nowait()
 
     async def play_audio(self):
-        stream = await asyncio.to_thread(
-            pya.open,
-            format=FORMAT,
-            channels=CHANNELS,
-            rate=RECEIVE_SAMPLE_RATE,
-            output=True,
-        )
+        stream = await asyncio.to_thread(self.audio_sink.open_stream, rate=RECEIVE_SAMPLE_RATE, channels=CHANNELS)
         while True:
             bytestream = await self.audio_in_queue.get()
             await asyncio.to_thread(stream.write, bytestream)
@@ -232,7 +219,7 @@ class AudioLoop:
         except asyncio.CancelledError:
             pass
         except ExceptionGroup as EG:
-            self.audio_stream.close()
+            await self.mic.close()
             traceback.print_exception(EG)
 
 
@@ -245,6 +232,24 @@ if __name__ == "__main__":
         help="pixels to stream from",
         choices=["camera", "screen", "none"],
     )
+    parser.add_argument(
+        "--frames-per-buffer",
+        type=int,
+        default=FRAMES_PER_BUFFER,
+        help="microphone frames per PortAudio callback",
+    )
+    parser.add_argument(
+        "--source",
+        type=str,
+        default="pyaudio",
+        help="microphone: pyaudio, tone, bursts, null or wav:PATH",
+    )
+    parser.add_argument(
+        "--sink",
+        type=str,
+        default="pyaudio",
+        help="speaker: pyaudio, null, discard or wav:PATH",
+    )
     args = parser.parse_args()
-    main = AudioLoop(video_mode=args.mode)
+    main = AudioLoop(video_mode=args.mode, frames_per_buffer=args.frames_per_buffer, source=args.source, sink=args.sink)
     asyncio.run(main.run())